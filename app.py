@@ -6,78 +6,185 @@ import json
 import dotenv
 import logging
 
-from litellm import embedding
-from src.answer_generation import generate_answer, build_prompt
-from src.retrieval import load_vectorized_kb
-from sklearn.metrics.pairwise import cosine_similarity
+from src.answer_generation import generate_answer, build_packed_prompt
+from src.retrieval import load_vectorized_kb, search, hybrid_search, build_contexts
+from src.vector_store import VectorStore
+from src.ann_index import load_index
+from src.lexical_index import load_lexical_index
+from src.utils.embedding_client import embed_texts
+from src.answer_cache import AnswerCache
+from src.service import RetrievalClient
+from src.utils.tracing import record
+from src.reranking import get_reranker, rerank, RerankCache
+from src.prefetch import SpeculativeRetriever
 
-dotenv.load_dotenv(override = True)
+dotenv.load_dotenv(override = False)
 logger = logging.getLogger(__name__)
 
-api_key = os.getenv("OPENAI_API_KEY")
-base = os.getenv("OPENAI_API_BASE")
-
-def get_embeddings(text):
-    model_name = "azure.text-embedding-3-large" 
-    
-    model_kwargs = {"dimensions": 1024}
-    
-    response = embedding( 
-        input=text, 
-        model=f"openai/{model_name}",
-        api_key=api_key,
-        api_base=base,
-        **model_kwargs
-    )
-    
-    return response
-
-@st.cache_data
+@st.cache_resource
 def load_kb():
-    df = pd.read_csv("/Users/pagrawal140/document-insights-prototype/output/vectorized_kb.csv")
-    return df
+    kb = load_vectorized_kb("/Users/pagrawal140/document-insights-prototype/output/vector_store")
+    return kb, load_index(kb), load_lexical_index(kb)
+
+@st.cache_resource
+def load_reranker():
+    """Re-ranker selected by RERANKER (cross-encoder or llm) and its score cache, or (None, None)."""
+    reranker = get_reranker()
+    if reranker is None:
+        return None, None
+    return reranker, RerankCache("/Users/pagrawal140/document-insights-prototype/output/rerank_cache.sqlite")
+
+def with_reranking(retrieve):
+    """Wrap `retrieve` so its contexts go through the configured re-ranker, if any."""
+    reranker, cache = load_reranker()
+    if reranker is None:
+        return retrieve
+
+    def retrieve_reranked(question, filters=None):
+        kb_version, contexts, q_embedding = retrieve(question, filters=filters)
+        contexts, _ = rerank(question, contexts, reranker, candidates=int(os.getenv("RERANK_CANDIDATES", 30)),
+                             top_n=int(os.getenv("RERANK_TOP_N", 5)), cache=cache)
+        return kb_version, contexts, q_embedding
+    return retrieve_reranked
+
+@st.cache_resource
+def load_retriever():
+    """
+    Returns `retrieve(question, filters=None) -> (kb_version, contexts, q_embedding)`
+    and the list of source documents that can be filtered on. With
+    RETRIEVAL_SERVICE_URL set, retrieval goes to the long-lived retrieval
+    service (src/service.py) instead of loading the KB into this process.
+    """
+    service_url = os.getenv("RETRIEVAL_SERVICE_URL")
+    if service_url:
+        client = RetrievalClient(service_url)
+        status = client.ready()
+        logger.info(f"Using retrieval service at {service_url} (KB {status['kb_version']})")
+
+        def retrieve(question, filters=None):
+            response = client.retrieve([question], return_embeddings=True, filters=filters)
+            result = response["results"][0]
+            return response["kb_version"], result["retrieved_context"], np.asarray(result["embedding"], dtype=np.float32)
+        return retrieve, status.get("sources", [])
 
-def retrieve_answers(user_question: list, kb_df: pd.DataFrame, top_k=None, top_p=0.9):
-    q_embeddings = get_embeddings(user_question)['data'][0]['embedding']
+    kb, index, lexical = load_kb()
 
-    similarities = cosine_similarity([q_embeddings], list(kb_df['embedding'].values))[0]
-    sorted_indices = similarities.argsort()[::-1]
-    sorted_sims = similarities[sorted_indices]
+    def retrieve(question, filters=None):
+        q_embedding = embed_texts([question])
+        contexts = retrieve_answers(question, kb, index=index, q_embedding=q_embedding, lexical=lexical,
+                                    filters=filters)
+        return kb.version, contexts, q_embedding
+    return retrieve, kb.metadata_index.values("source")
 
-    if top_k is not None:
-        selected_indices = sorted_indices[:top_k]
+def speculative_retriever(retrieve) -> SpeculativeRetriever:
+    """
+    This session's speculative retriever (src/prefetch.py). It is kept per
+    session so one user's typing never cancels another user's prefetch.
+    """
+    if "speculative_retriever" not in st.session_state:
+        st.session_state["speculative_retriever"] = SpeculativeRetriever(
+            retrieve, debounce_ms=int(os.getenv("PREFETCH_DEBOUNCE_MS", 300)))
+    return st.session_state["speculative_retriever"]
+
+@st.cache_resource
+def load_answer_cache(kb_version: str):
+    cache = AnswerCache(
+        "/Users/pagrawal140/document-insights-prototype/output/answer_cache.sqlite",
+        semantic_threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", 0.95)),
+    )
+    removed = cache.invalidate(kb_version)
+    if removed:
+        logger.info(f"Dropped {removed} cached answers from older KB versions")
+    return cache
+
+def retrieve_answers(user_question: str, kb: VectorStore, top_k=None, top_p=0.9, index=None, q_embedding=None,
+                     lexical=None, filters=None):
+    if q_embedding is None:
+        q_embedding = embed_texts([user_question])
+    if lexical is None:
+        indices, scores = search(kb, q_embedding, top_k=top_k, top_p=top_p, index=index, filters=filters)[0]
     else:
-        cumulative = 0.0
-        selected_indices = []
-        total = sum(sorted_sims)
-        for i, score in enumerate(sorted_sims):
-            cumulative += score
-            selected_indices.append(sorted_indices[i])
-            if cumulative >= top_p * total:
-                break
+        indices, scores = hybrid_search(kb, [user_question], q_embedding, lexical, top_k=top_k, top_p=top_p,
+                                        index=index, filters=filters)[0]
+    return build_contexts(kb, indices, scores)
 
-    return kb_df.iloc[selected_indices]
+def prepare_answer(question: str, retrieve, cache_for, filters=None):
+    """
+    Retrieve the question's contexts, then look it up in the exact cache and
+    the semantic cache (with the query embedding) for the KB version that
+    served it. On a miss, pack the contexts into the prompt budget and return
+    them with the prompt so the answer can be streamed while the citations
+    are already on screen.
+    `cache_for(kb_version)` returns the answer cache; answers to filtered
+    questions are neither looked up nor cached, since the cache is not keyed
+    on filters.
+    """
+    kb_version, top_contexts, q_embedding = retrieve(question, filters=filters)
+    cache = cache_for(kb_version)
+    cached = None if filters else cache.get(question, kb_version) or cache.get_similar(q_embedding, kb_version)
+    record("answer_cache", cache_hits=int(bool(cached)), items=1)
+    if cached:
+        return {**cached, "kb_version": kb_version}
+    prompt, packed_contexts, packing = build_packed_prompt(question, top_contexts)
+    return {
+        "question": question,
+        "answer": None,
+        "contexts": packed_contexts,
+        "prompt": prompt,
+        "packing": packing,
+        "q_embedding": q_embedding,
+        "kb_version": kb_version,
+        "match": None,
+    }
+
+def show_citations(contexts, limit=5):
+    st.markdown("**Sources:** " + "; ".join(
+        f"{ctx.get('source', '')} > {ctx.get('section', '')} (p. {ctx.get('page', '?')})" for ctx in contexts[:limit]
+    ) + (f" and {len(contexts) - limit} more" if len(contexts) > limit else ""))
 
 if __name__ == "__main__":
     # Streamlit UI
     st.set_page_config(page_title="Document QA Assistant", layout="wide")
     st.title("Document Insights Prototype")
 
-    kb_df = load_kb()
+    base_retrieve, sources = load_retriever()
+    speculative = speculative_retriever(base_retrieve)
+    # Re-ranking runs only for the submitted question, not for every speculative one
+    retrieve = with_reranking(speculative.get)
 
     question = st.text_input("Go ahead with you query:", placeholder="e.g. What is the procedure for financial approval?")
 
+    selected_sources = st.multiselect("Limit to documents (optional):", sources)
+    filters = {"source": selected_sources} if selected_sources else None
+
+    # Every change to the question or filters reruns the script: start embedding and retrieval now, so the
+    # round-trip overlaps with picking filters and reaching for the button
+    speculative.prefetch(question, filters)
+
     if st.button("Get Answer") and question:
-        with st.spinner("Retrieving context and generating answer..."):
-            top_contexts = retrieve_answers(question, kb_df)
-            prompt = build_prompt(question, top_contexts.to_dict(orient="records"))
-            answer = generate_answer(prompt)
+        with st.spinner("Retrieving context..."):
+            result = prepare_answer(question, retrieve, load_answer_cache, filters=filters)
+        top_contexts = result["contexts"]
 
         st.markdown("### Answer")
-        st.write(answer)
+        show_citations(top_contexts)
+        if result["answer"] is None:
+            answer = st.write_stream(generate_answer(result["prompt"], stream=True))
+            if not answer.startswith("Error generating answer") and not filters:
+                load_answer_cache(result["kb_version"]).put(question, result["kb_version"], answer, top_contexts,
+                                                            q_embedding=result["q_embedding"])
+            packing = result["packing"]
+            st.caption(f"Context: {packing['output_contexts']} of {packing['input_chunks']} chunks, "
+                       f"{packing['output_tokens']} tokens ({packing['tokens_saved']} saved by packing)")
+        else:
+            st.write(result["answer"])
+            if result["match"] == "semantic":
+                st.caption(f"Cached answer to a similar question: \"{result['question']}\" (similarity {result['similarity']:.2f})")
+            else:
+                st.caption("Cached answer")
 
         with st.expander("Show retrieved context"):
-            for _, row in top_contexts.iterrows():
-                st.markdown(f"**{row.get('source', '')} > {row.get('section', '')}** (Page {int(row.get('page', -1))})")
-                st.markdown(row['chunk'])
+            for ctx in top_contexts:
+                st.markdown(f"**{ctx.get('source', '')} > {ctx.get('section', '')}** (Page {int(ctx.get('page', -1))})")
+                st.markdown(ctx['context'])
                 st.markdown("---")
@@ -0,0 +1,596 @@
+import os
+import sys
+import json
+import heapq
+import inspect
+import time
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.vector_store import VectorStore, normalize_rows, read_manifest
+
+INDEX_DIR = "index"
+INDEX_META_FILE = "index.json"
+INDEX_DATA_FILE = "index.npz"
+
+
+class VectorIndex:
+    """
+    Nearest-neighbour index over the rows of a normalized embedding matrix.
+
+    Subclasses implement `build`, `search`, and the `_params`/`_arrays`/`_restore`
+    hooks used by `save` and `load_index`. `search` returns `(ids, scores)` of
+    shape (n_queries, k), best first; slots that could not be filled hold
+    id -1 and score -inf.
+    """
+    kind = None
+
+    def __init__(self, vectors: np.ndarray):
+        self.vectors = vectors
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def build(self):
+        return self
+
+    def search(self, queries: np.ndarray, k: int):
+        raise NotImplementedError
+
+    def _params(self) -> dict:
+        return {}
+
+    def _arrays(self) -> dict:
+        return {}
+
+    def _restore(self, arrays: dict):
+        pass
+
+    def memory_bytes(self) -> int:
+        """Bytes the index keeps in memory for search, excluding the on-disk vectors it reads."""
+        return int(sum(a.nbytes for a in self._arrays().values()))
+
+    def save(self, store_path: str):
+        index_path = os.path.join(store_path, INDEX_DIR)
+        os.makedirs(index_path, exist_ok=True)
+        np.savez(os.path.join(index_path, INDEX_DATA_FILE), **self._arrays())
+        meta = {
+            "kind": self.kind,
+            "count": len(self),
+            "kb_version": read_manifest(store_path)["kb_version"],
+            "params": self._params(),
+        }
+        with open(os.path.join(index_path, INDEX_META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+
+def _pad(ids: np.ndarray, scores: np.ndarray, k: int):
+    if len(ids) >= k:
+        return ids[:k], scores[:k]
+    pad = k - len(ids)
+    return (np.concatenate([ids, np.full(pad, -1, dtype=np.int64)]),
+            np.concatenate([scores, np.full(pad, -np.inf, dtype=np.float32)]))
+
+
+def _top_k_1d(scores: np.ndarray, k: int):
+    if k < len(scores):
+        part = np.argpartition(-scores, k - 1)[:k]
+    else:
+        part = np.arange(len(scores))
+    return part[np.argsort(-scores[part], kind="stable")]
+
+
+class ExactIndex(VectorIndex):
+    """Brute-force scan; the reference for recall and the fallback for every other index."""
+    kind = "exact"
+
+    def memory_bytes(self):
+        return int(self.vectors.nbytes)
+
+    def search(self, queries: np.ndarray, k: int):
+        queries = normalize_rows(queries)
+        scores = queries @ self.vectors.T
+        k = min(k, len(self))
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        for row in range(len(queries)):
+            ids[row] = _top_k_1d(scores[row], k)
+        return ids, np.take_along_axis(scores, ids, axis=1)
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, n_iter=20, sample_size=None, seed=0):
+    """
+    k-means on the unit sphere (cosine assignment, normalized centroid updates),
+    trained on a sample of `sample_size` rows (default: 39 per cluster, at least
+    100k) and scored a block of rows at a time, so memory stays bounded at 1M+ rows.
+    """
+    rng = np.random.default_rng(seed)
+    n = len(vectors)
+    sample_size = min(n, sample_size or max(39 * n_clusters, 100_000))
+    sample = np.asarray(vectors[np.sort(rng.choice(n, sample_size, replace=False))], dtype=np.float32)
+    centroids = sample[rng.choice(sample_size, n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _nearest_cosine(sample, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        # Rows grouped by cluster, so each cluster's sum is one contiguous reduction
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums[filled] = np.add.reduceat(sample[np.argsort(assign, kind="stable")], starts[filled], axis=0)
+        if not filled.all():
+            sums[~filled] = sample[rng.choice(sample_size, int((~filled).sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+def _nearest_cosine(vectors: np.ndarray, centroids: np.ndarray, block_rows=8192) -> np.ndarray:
+    """Highest-scoring centroid for each row, scoring `block_rows` rows at a time."""
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        assign[start:start + block_rows] = (block @ centroids.T).argmax(axis=1)
+    return assign
+
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted-file index: a spherical k-means coarse quantizer splits the corpus
+    into `n_lists` cells and a query only scans the `nprobe` closest cells.
+    Raising `nprobe` trades latency for recall; `nprobe == n_lists` is exact.
+    """
+    kind = "ivf"
+
+    def __init__(self, vectors: np.ndarray, n_lists=None, nprobe=8, n_iter=20, seed=0):
+        super().__init__(vectors)
+        self.n_lists = n_lists or max(1, int(4 * np.sqrt(len(vectors))))
+        self.nprobe = nprobe
+        self.n_iter = n_iter
+        self.seed = seed
+        self.centroids = None
+        self.list_offsets = None
+        self.list_ids = None
+
+    def build(self):
+        n_lists = min(self.n_lists, len(self))
+        self.centroids = spherical_kmeans(self.vectors, n_lists, n_iter=self.n_iter, seed=self.seed)
+        self.n_lists = len(self.centroids)
+        assign = _nearest_cosine(self.vectors, self.centroids)
+        # Postings stored CSR style: ids of list c are list_ids[list_offsets[c]:list_offsets[c + 1]]
+        self.list_ids = np.argsort(assign, kind="stable")
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=self.n_lists))])
+        return self
+
+    def search(self, queries: np.ndarray, k: int, nprobe=None):
+        queries = normalize_rows(queries)
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis=1)[:, :nprobe]
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for row, query in enumerate(queries):
+            candidates = np.concatenate([
+                self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probes[row]
+            ])
+            candidates.sort()
+            cand_scores = self.vectors[candidates] @ query
+            best = _top_k_1d(cand_scores, k)
+            ids[row], scores[row] = _pad(candidates[best], cand_scores[best], k)
+        return ids, scores
+
+    def _params(self):
+        return {"n_lists": self.n_lists, "nprobe": self.nprobe, "n_iter": self.n_iter, "seed": self.seed}
+
+    def _arrays(self):
+        return {"centroids": self.centroids, "list_offsets": self.list_offsets, "list_ids": self.list_ids}
+
+    def _restore(self, arrays):
+        self.centroids = arrays["centroids"]
+        self.list_offsets = arrays["list_offsets"]
+        self.list_ids = arrays["list_ids"]
+
+
+class HNSWIndex(VectorIndex):
+    """
+    Hierarchical navigable small-world graph. `M` bounds the out-degree per
+    layer (2*M on the base layer), `ef_construction` is the build-time beam
+    width and `ef` the search-time beam width; larger `ef` means higher recall
+    and latency. Pure Python graph walk, so build time grows quickly with
+    corpus size - prefer IVF for large stores.
+    """
+    kind = "hnsw"
+
+    def __init__(self, vectors: np.ndarray, M=16, ef_construction=100, ef=64, seed=0):
+        super().__init__(vectors)
+        self.M = M
+        self.ef_construction = ef_construction
+        self.ef = ef
+        self.seed = seed
+        self.levels = None
+        self.graph = None
+        self.entry_point = -1
+
+    def _max_degree(self, level):
+        return 2 * self.M if level == 0 else self.M
+
+    def _search_layer(self, query, entry_points, ef, level):
+        visited = set(entry_points)
+        entry_scores = self.vectors[entry_points] @ query
+        # candidates is a max-heap on similarity, results a min-heap holding the best ef
+        candidates = [(-s, p) for s, p in zip(entry_scores, entry_points)]
+        results = [(s, p) for s, p in zip(entry_scores, entry_points)]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        while candidates:
+            neg_score, node = heapq.heappop(candidates)
+            if -neg_score < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [n for n in self.graph[level].get(node, ()) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for score, neighbor in zip(self.vectors[neighbors] @ query, neighbors):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbor))
+                    heapq.heappush(results, (score, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _select_neighbors(self, candidates, max_degree):
+        """
+        Diversity heuristic from the HNSW paper: keep a candidate only if it is
+        closer to the base node than to every neighbour kept so far, then top up
+        with the pruned ones. Without it clusters lose their links to each other.
+        """
+        if len(candidates) <= max_degree:
+            return [n for _, n in candidates]
+        kept, pruned = [], []
+        for score, node in candidates:
+            if len(kept) >= max_degree:
+                break
+            if kept and (self.vectors[kept] @ self.vectors[node]).max() > score:
+                pruned.append(node)
+            else:
+                kept.append(node)
+        return kept + pruned[:max_degree - len(kept)]
+
+    def _connect(self, node, neighbors, level):
+        max_degree = self._max_degree(level)
+        self.graph[level][node] = self._select_neighbors(neighbors, self.M)
+        for neighbor in self.graph[level][node]:
+            links = self.graph[level][neighbor]
+            links.append(node)
+            if len(links) > max_degree:
+                link_scores = self.vectors[links] @ self.vectors[neighbor]
+                order = np.argsort(-link_scores)
+                self.graph[level][neighbor] = self._select_neighbors(
+                    [(link_scores[i], links[i]) for i in order], max_degree
+                )
+
+    def build(self):
+        rng = np.random.default_rng(self.seed)
+        ml = 1 / np.log(self.M)
+        self.levels = np.floor(-np.log(rng.random(len(self)) + 1e-12) * ml).astype(np.int64)
+        self.graph = [dict() for _ in range(int(self.levels.max()) + 1)]
+        for node in range(len(self)):
+            query = np.asarray(self.vectors[node], dtype=np.float32)
+            node_level = self.levels[node]
+            if self.entry_point < 0:
+                for level in range(node_level + 1):
+                    self.graph[level][node] = []
+                self.entry_point = node
+                continue
+            entry = [self.entry_point]
+            top_level = self.levels[self.entry_point]
+            for level in range(top_level, node_level, -1):
+                entry = [self._search_layer(query, entry, 1, level)[0][1]]
+            for level in range(min(node_level, top_level), -1, -1):
+                neighbors = self._search_layer(query, entry, self.ef_construction, level)
+                self._connect(node, neighbors, level)
+                entry = [n for _, n in neighbors]
+            for level in range(top_level + 1, node_level + 1):
+                self.graph[level][node] = []
+            if node_level > top_level:
+                self.entry_point = node
+        return self
+
+    def search(self, queries: np.ndarray, k: int, ef=None):
+        queries = normalize_rows(queries)
+        ef = max(ef or self.ef, k)
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        scores = np.empty((len(queries), k), dtype=np.float32)
+        for row, query in enumerate(queries):
+            entry = [self.entry_point]
+            for level in range(self.levels[self.entry_point], 0, -1):
+                entry = [self._search_layer(query, entry, 1, level)[0][1]]
+            found = self._search_layer(query, entry, ef, 0)[:k]
+            ids[row], scores[row] = _pad(np.array([n for _, n in found], dtype=np.int64),
+                                         np.array([s for s, _ in found], dtype=np.float32), k)
+        return ids, scores
+
+    def _params(self):
+        return {"M": self.M, "ef_construction": self.ef_construction, "ef": self.ef,
+                "seed": self.seed, "entry_point": int(self.entry_point)}
+
+    def _arrays(self):
+        arrays = {"levels": self.levels}
+        for level, links in enumerate(self.graph):
+            nodes = np.array(sorted(links), dtype=np.int64)
+            arrays[f"nodes_{level}"] = nodes
+            arrays[f"offsets_{level}"] = np.concatenate([[0], np.cumsum([len(links[n]) for n in nodes])]).astype(np.int64)
+            arrays[f"neighbors_{level}"] = np.array([x for n in nodes for x in links[n]], dtype=np.int64)
+        return arrays
+
+    def _restore(self, arrays):
+        self.levels = arrays["levels"]
+        self.graph = []
+        for level in range(int(self.levels.max()) + 1):
+            nodes, offsets, neighbors = arrays[f"nodes_{level}"], arrays[f"offsets_{level}"], arrays[f"neighbors_{level}"]
+            self.graph.append({
+                int(n): neighbors[offsets[i]:offsets[i + 1]].tolist() for i, n in enumerate(nodes)
+            })
+
+
+class QuantizedIndex(VectorIndex):
+    """
+    Base for compressed encodings of the full matrix. Subclasses implement
+    `_encode` and `_scores(queries, start, stop)`, the asymmetric scores of
+    float queries against the codes of rows [start, stop). A search scores the
+    codes only; with `rerank > 1` the best `k * rerank` candidates are
+    re-scored against the full vectors, which stay on disk and are read just
+    for those rows.
+    """
+    block_rows = 16384
+
+    def __init__(self, vectors: np.ndarray, rerank=4):
+        super().__init__(vectors)
+        self.rerank = rerank
+
+    def build(self):
+        self._encode()
+        return self
+
+    def search(self, queries: np.ndarray, k: int, rerank=None):
+        queries = normalize_rows(queries)
+        rerank = self.rerank if rerank is None else rerank
+        n = len(self)
+        k = min(k, n)
+        n_candidates = min(n, k * rerank) if rerank and rerank > 1 else k
+        scores = np.empty((len(queries), n), dtype=np.float32)
+        for start in range(0, n, self.block_rows):
+            scores[:, start:start + self.block_rows] = self._scores(queries, start, min(n, start + self.block_rows))
+        ids = np.empty((len(queries), k), dtype=np.int64)
+        out = np.empty((len(queries), k), dtype=np.float32)
+        for row, query in enumerate(queries):
+            candidates = _top_k_1d(scores[row], n_candidates)
+            cand_scores = scores[row, candidates]
+            if n_candidates > k:
+                candidates.sort()
+                cand_scores = np.asarray(self.vectors[candidates], dtype=np.float32) @ query
+            best = _top_k_1d(cand_scores, k)
+            ids[row], out[row] = candidates[best], cand_scores[best]
+        return ids, out
+
+
+class ScalarQuantizedIndex(QuantizedIndex):
+    """
+    8-bit scalar quantization: each dimension is mapped linearly from its
+    [min, max] over the corpus onto 0..255, a quarter of float32. For a query
+    q the score is (q * scale) . codes + q . offset, computed without decoding.
+    """
+    kind = "sq8"
+
+    def __init__(self, vectors: np.ndarray, rerank=4):
+        super().__init__(vectors, rerank=rerank)
+        self.codes = None
+        self.scale = None
+        self.offset = None
+
+    def _encode(self):
+        lo = np.full(self.vectors.shape[1], np.inf, dtype=np.float32)
+        hi = np.full(self.vectors.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = np.asarray(self.vectors[start:start + self.block_rows], dtype=np.float32)
+            lo, hi = np.minimum(lo, block.min(axis=0)), np.maximum(hi, block.max(axis=0))
+        self.offset = lo
+        self.scale = np.where(hi > lo, (hi - lo) / 255, 1.0).astype(np.float32)
+        self.codes = np.empty(self.vectors.shape, dtype=np.uint8)
+        for start in range(0, len(self), self.block_rows):
+            block = np.asarray(self.vectors[start:start + self.block_rows], dtype=np.float32)
+            self.codes[start:start + self.block_rows] = np.clip(np.rint((block - lo) / self.scale), 0, 255)
+
+    def _scores(self, queries, start, stop):
+        return (queries * self.scale) @ self.codes[start:stop].T.astype(np.float32) + (queries @ self.offset)[:, None]
+
+    def _params(self):
+        return {"rerank": self.rerank}
+
+    def _arrays(self):
+        return {"codes": self.codes, "scale": self.scale, "offset": self.offset}
+
+    def _restore(self, arrays):
+        self.codes, self.scale, self.offset = arrays["codes"], arrays["scale"], arrays["offset"]
+
+
+def kmeans(vectors: np.ndarray, n_clusters: int, n_iter=10, seed=0):
+    """Plain Euclidean k-means (used per subspace by product quantization)."""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assign = _nearest(vectors, centroids)
+        counts = np.bincount(assign, minlength=n_clusters)
+        sums = np.stack([np.bincount(assign, weights=vectors[:, d], minlength=n_clusters)
+                         for d in range(vectors.shape[1])], axis=1)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray):
+    return ((centroids ** 2).sum(axis=1) - 2 * vectors @ centroids.T).argmin(axis=1)
+
+
+class ProductQuantizedIndex(QuantizedIndex):
+    """
+    Product quantization: vectors are split into `m` sub-vectors and each is
+    replaced by the id of its nearest of 256 sub-centroids, so a vector costs
+    `m` bytes (128 bytes for m=128 at 1024 dims, 1/32 of float32). Search uses
+    asymmetric distance: per query, a (m, 256) table of sub-centroid inner
+    products is built and a row's score is the sum of its m table entries.
+    """
+    kind = "pq"
+
+    def __init__(self, vectors: np.ndarray, m=None, rerank=4, n_iter=10, sample_size=16384, seed=0):
+        super().__init__(vectors, rerank=rerank)
+        dim = vectors.shape[1]
+        self.m = m or next(d for d in (dim // 8, dim // 4, dim // 2, dim) if d and dim % d == 0)
+        if dim % self.m:
+            raise ValueError(f"m={self.m} does not divide the embedding dimension {dim}")
+        self.n_iter = n_iter
+        self.sample_size = sample_size
+        self.seed = seed
+        self.codebooks = None
+        self.codes = None
+
+    def _encode(self):
+        n, dim = self.vectors.shape
+        sub = dim // self.m
+        n_centroids = min(256, n)
+        rng = np.random.default_rng(self.seed)
+        sample = np.asarray(self.vectors[np.sort(rng.choice(n, min(n, self.sample_size), replace=False))],
+                            dtype=np.float32)
+        self.codebooks = np.stack([
+            kmeans(sample[:, j * sub:(j + 1) * sub], n_centroids, n_iter=self.n_iter, seed=self.seed + j)
+            for j in range(self.m)
+        ])
+        self.codes = np.empty((n, self.m), dtype=np.uint8)
+        for start in range(0, n, self.block_rows):
+            block = np.asarray(self.vectors[start:start + self.block_rows], dtype=np.float32)
+            for j in range(self.m):
+                self.codes[start:start + self.block_rows, j] = _nearest(block[:, j * sub:(j + 1) * sub],
+                                                                        self.codebooks[j])
+
+    def _scores(self, queries, start, stop):
+        sub = self.codebooks.shape[2]
+        # lut[q, j, c] = <query q's j-th sub-vector, centroid c of subspace j>
+        lut = np.einsum("qjd,jcd->qjc", queries.reshape(len(queries), self.m, sub), self.codebooks)
+        codes = self.codes[start:stop]
+        scores = np.zeros((len(queries), stop - start), dtype=np.float32)
+        for j in range(self.m):
+            scores += lut[:, j, codes[:, j]]
+        return scores
+
+    def _params(self):
+        return {"m": self.m, "rerank": self.rerank, "n_iter": self.n_iter, "sample_size": self.sample_size,
+                "seed": self.seed}
+
+    def _arrays(self):
+        return {"codebooks": self.codebooks, "codes": self.codes}
+
+    def _restore(self, arrays):
+        self.codebooks, self.codes = arrays["codebooks"], arrays["codes"]
+
+
+INDEX_TYPES = {cls.kind: cls for cls in (ExactIndex, IVFIndex, HNSWIndex, ScalarQuantizedIndex, ProductQuantizedIndex)}
+
+
+def build_index(kb: VectorStore, kind="ivf", **params) -> VectorIndex:
+    return INDEX_TYPES[kind](kb.matrix, **params).build()
+
+
+def index_params(kind: str, params: dict) -> dict:
+    """
+    The entries of `params` that an index of `kind` accepts. Knobs of other
+    index kinds (e.g. `nprobe` for an HNSW index) are dropped, so one set of
+    overrides works whatever index was built; a knob no index accepts raises
+    ValueError.
+    """
+    accepted = {kind: set(inspect.signature(cls.__init__).parameters) - {"self", "vectors"}
+                for kind, cls in INDEX_TYPES.items()}
+    unknown = sorted(set(params) - set().union(*accepted.values()))
+    if unknown:
+        raise ValueError(f"Unknown index parameter(s) {unknown}; "
+                         f"{kind} accepts {sorted(accepted[kind])}")
+    return {name: value for name, value in params.items() if name in accepted[kind]}
+
+
+def load_index(kb: VectorStore, **overrides):
+    """
+    Load the index persisted next to the KB, or None when there is none or it
+    was built for a different version of the KB. Keyword overrides replace
+    saved search knobs such as `nprobe` or `ef`; knobs for other index kinds
+    are ignored.
+    """
+    index_path = os.path.join(kb.path, INDEX_DIR)
+    if not os.path.isfile(os.path.join(index_path, INDEX_META_FILE)):
+        return None
+    with open(os.path.join(index_path, INDEX_META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["count"] != len(kb) or meta.get("kb_version") != kb.version:
+        return None
+    params = dict(meta["params"])
+    entry_point = params.pop("entry_point", None)
+    params.update(index_params(meta["kind"], overrides))
+    index = INDEX_TYPES[meta["kind"]](kb.matrix, **params)
+    with np.load(os.path.join(index_path, INDEX_DATA_FILE)) as arrays:
+        index._restore(dict(arrays))
+    if entry_point is not None:
+        index.entry_point = entry_point
+    return index
+
+
+def recall_at_k(approx_ids: np.ndarray, exact_ids: np.ndarray) -> float:
+    """Mean fraction of the exact top-k found by the approximate search."""
+    hits = [len(set(a[a >= 0]) & set(e)) / len(e) for a, e in zip(approx_ids, exact_ids)]
+    return float(np.mean(hits))
+
+
+def benchmark(kb: VectorStore, index: VectorIndex, queries: np.ndarray, k=10):
+    """Recall@k, mean per-query latency and in-memory size of `index` against the exact scan."""
+    exact = ExactIndex(kb.matrix)
+    start = time.perf_counter()
+    exact_ids, _ = exact.search(queries, k)
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    start = time.perf_counter()
+    approx_ids, _ = index.search(queries, k)
+    approx_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return {
+        "kind": index.kind,
+        "k": k,
+        "recall_at_k": recall_at_k(approx_ids, exact_ids),
+        "exact_ms_per_query": exact_ms,
+        "index_ms_per_query": approx_ms,
+        "exact_bytes": exact.memory_bytes(),
+        "index_bytes": index.memory_bytes(),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build an ANN index next to the vector store")
+    parser.add_argument("--store", default="/Users/pagrawal140/document-insights-prototype/output/vector_store")
+    parser.add_argument("--kind", default="ivf", choices=list(INDEX_TYPES))
+    parser.add_argument("--n-lists", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--M", type=int, default=16)
+    parser.add_argument("--ef", type=int, default=64)
+    parser.add_argument("--m", type=int, default=None, help="PQ sub-vectors (bytes per vector)")
+    parser.add_argument("--rerank", type=int, default=4, help="Re-rank k * rerank quantized candidates exactly (1 = off)")
+    args = parser.parse_args()
+
+    kb = VectorStore.open(args.store)
+    params = {}
+    if args.kind == "ivf":
+        params = {"n_lists": args.n_lists, "nprobe": args.nprobe}
+    elif args.kind == "hnsw":
+        params = {"M": args.M, "ef": args.ef}
+    elif args.kind == "sq8":
+        params = {"rerank": args.rerank}
+    elif args.kind == "pq":
+        params = {"m": args.m, "rerank": args.rerank}
+    start = time.perf_counter()
+    index = build_index(kb, args.kind, **params)
+    index.save(args.store)
+    print(f"Built {args.kind} index over {len(kb)} vectors in {time.perf_counter() - start:.2f}s "
+          f"({index.memory_bytes() / 2**20:.1f} MiB in memory vs {kb.matrix.nbytes / 2**20:.1f} MiB float32)")
@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+
+DEFAULT_CACHE_PATH = "/Users/pagrawal140/document-insights-prototype/output/answer_cache.sqlite"
+
+
+def normalize_question(question: str) -> str:
+    """Case, whitespace and trailing punctuation insensitive form of a question."""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?.! ")
+
+
+class AnswerCache:
+    """
+    Two-tier cache of answers and their retrieved contexts, persisted in SQLite.
+
+    1. Exact tier: keyed by the normalized question and the KB version.
+    2. Semantic tier: reuses the answer of a cached question whose embedding has
+       cosine similarity >= `semantic_threshold` with the new one.
+
+    Entries older than `ttl_seconds` are ignored and purged, and the least
+    recently used entries are evicted beyond `max_entries`. Every lookup is
+    scoped to a KB version, and `invalidate` drops entries from other versions
+    so a rebuilt KB never serves stale answers.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=1000, ttl_seconds=7 * 24 * 3600, semantic_threshold=0.95):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                key TEXT PRIMARY KEY,
+                kb_version TEXT NOT NULL,
+                question TEXT NOT NULL,
+                embedding BLOB,
+                answer TEXT NOT NULL,
+                contexts TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_version ON answers (kb_version)")
+        self._conn.commit()
+        # Per-version (keys, embedding matrix) for the semantic tier, rebuilt after writes
+        self._semantic = {}
+
+    @staticmethod
+    def key(question: str, kb_version: str) -> str:
+        return hashlib.sha256(f"{kb_version}|{normalize_question(question)}".encode("utf-8")).hexdigest()
+
+    def _expired_before(self) -> float:
+        return time.time() - self.ttl_seconds
+
+    def _touch(self, key: str):
+        self._conn.execute("UPDATE answers SET last_access = ? WHERE key = ?", (time.time(), key))
+        self._conn.commit()
+
+    def _entry(self, row, match: str, similarity=1.0) -> dict:
+        return {
+            "question": row[0],
+            "answer": row[1],
+            "contexts": json.loads(row[2]),
+            "match": match,
+            "similarity": float(similarity),
+        }
+
+    def get(self, question: str, kb_version: str):
+        """Exact-tier lookup; returns the cached entry dict or None."""
+        key = self.key(question, kb_version)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT question, answer, contexts FROM answers WHERE key = ? AND created_at >= ?",
+                (key, self._expired_before()),
+            ).fetchone()
+            if row is None:
+                return None
+            self._touch(key)
+        return self._entry(row, "exact")
+
+    def _semantic_index(self, kb_version: str):
+        if kb_version not in self._semantic:
+            rows = self._conn.execute(
+                "SELECT key, embedding FROM answers WHERE kb_version = ? AND embedding IS NOT NULL AND created_at >= ?",
+                (kb_version, self._expired_before()),
+            ).fetchall()
+            keys = [key for key, _ in rows]
+            matrix = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows]) if rows else None
+            self._semantic[kb_version] = (keys, matrix)
+        return self._semantic[kb_version]
+
+    def get_similar(self, q_embedding, kb_version: str):
+        """Semantic-tier lookup against cached question embeddings of the same KB version."""
+        query = np.asarray(q_embedding, dtype=np.float32).ravel()
+        query = query / (np.linalg.norm(query) or 1.0)
+        with self._lock:
+            keys, matrix = self._semantic_index(kb_version)
+            if matrix is None:
+                return None
+            sims = matrix @ query
+            candidates = np.flatnonzero(sims >= self.semantic_threshold)
+            # Best first; an entry that expired since the index was built is skipped for the next live one
+            for best in candidates[np.argsort(-sims[candidates], kind="stable")]:
+                row = self._conn.execute(
+                    "SELECT question, answer, contexts FROM answers WHERE key = ? AND created_at >= ?",
+                    (keys[best], self._expired_before()),
+                ).fetchone()
+                if row is not None:
+                    self._touch(keys[best])
+                    return self._entry(row, "semantic", sims[best])
+                self._semantic.pop(kb_version, None)
+        return None
+
+    def put(self, question: str, kb_version: str, answer: str, contexts: list, q_embedding=None):
+        embedding = None
+        if q_embedding is not None:
+            vector = np.asarray(q_embedding, dtype=np.float32).ravel()
+            embedding = (vector / (np.linalg.norm(vector) or 1.0)).tobytes()
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (self.key(question, kb_version), kb_version, question, embedding, answer,
+                 json.dumps(contexts, default=str), now, now),
+            )
+            self._evict()
+            self._conn.commit()
+            self._semantic.pop(kb_version, None)
+
+    def _evict(self):
+        removed = self._conn.execute("DELETE FROM answers WHERE created_at < ?", (self._expired_before(),)).rowcount
+        removed += self._conn.execute(
+            "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        if removed:
+            # Evicted entries may belong to any KB version; rebuild every semantic index on next use
+            self._semantic.clear()
+
+    def invalidate(self, current_kb_version: str) -> int:
+        """Drop every entry not built from `current_kb_version`; returns the number removed."""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM answers WHERE kb_version != ?", (current_kb_version,)
+            ).rowcount
+            self._conn.commit()
+            self._semantic = {k: v for k, v in self._semantic.items() if k == current_kb_version}
+        return removed
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
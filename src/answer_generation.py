@@ -4,7 +4,10 @@ import json
 from typing import List, Dict
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from src.utils.llm_call import get_chat_completion
+from src.utils.llm_call import get_chat_completion, model_config
+from src.utils.batch_runner import run_batch
+from src.context_packing import pack_contexts
+from src.utils.tracing import span, get_tracer
 
 def build_prompt(question: str, contexts: List[Dict]) -> str:
     context_blocks = "\n\n".join([
@@ -18,7 +21,26 @@ def build_prompt(question: str, contexts: List[Dict]) -> str:
         f"\n\nContext:\n{context_blocks}\n\nQuestion: {question}\nAnswer:"
     )
 
-def generate_answer(prompt: str) -> str:
+def build_packed_prompt(question: str, contexts: List[Dict], max_tokens=None):
+    """
+    Pack `contexts` into the context budget (CONTEXT_TOKEN_BUDGET, default 3000
+    tokens) before building the prompt. Returns the prompt, the contexts that
+    made it in and the packing report.
+    """
+    max_tokens = max_tokens or int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))
+    with span("prompt_build", items=len(contexts)) as s:
+        packed, report = pack_contexts(contexts, max_tokens=max_tokens)
+        prompt = build_prompt(question, packed)
+        s.add(bytes=len(prompt.encode("utf-8")), prompt_tokens=report["output_tokens"])
+    return prompt, packed, report
+
+def generate_answer(prompt: str, stream: bool = False):
+    """
+    Answer for `prompt`. With `stream=True` returns a generator of text
+    deltas, so callers can render tokens as they arrive.
+    """
+    if stream:
+        return _stream_answer(prompt)
     try:
         response = get_chat_completion(
             [
@@ -29,22 +51,57 @@ def generate_answer(prompt: str) -> str:
     except Exception as e:
         return f"Error generating answer: {e}"
 
-def generate_answers_from_retrieval(input_path: str, output_path: str):
+def _stream_answer(prompt: str):
+    try:
+        yield from get_chat_completion(
+            [
+                {"role": "user", "content": prompt}
+            ],
+            stream=True
+        )
+    except Exception as e:
+        yield f"Error generating answer: {e}"
+
+def answer_item(item: dict) -> dict:
+    """Answer one retrieval result. Raises on API errors so the batch runner can retry."""
+    question = item['question']
+    contexts = item['retrieved_context']
+    prompt, _, packing = build_packed_prompt(question, contexts)
+    response = get_chat_completion(
+        [
+            {"role": "user", "content": prompt}
+        ]
+    )
+    return {
+        "question": question,
+        "answer": response.choices[0]['message']['content'].strip(),
+        "contexts": contexts,
+        "packing": packing
+    }
+
+def answer_config() -> dict:
+    """Model, prompt template and context budget behind `answer_item`, for keying its checkpoint."""
+    template = build_prompt("{question}", [{"source": "{source}", "section": "{section}", "page": "{page}",
+                                            "context": "{context}"}])
+    return {**model_config(), "prompt": template, "context_budget": int(os.getenv("CONTEXT_TOKEN_BUDGET", 3000))}
+
+def generate_answers_from_retrieval(input_path: str, output_path: str, max_workers=8, rate=None):
+    """
+    Answer every retrieved item concurrently (`rate` caps requests per second).
+    Answers stream to `<output>.jsonl` as they finish, which is also the
+    checkpoint an interrupted run resumes from, as long as the model, prompt
+    and context budget are unchanged.
+    """
     with open(input_path, "r", encoding="utf-8") as f:
         retrieval_data = json.load(f)
 
-    results = []
-    for item in retrieval_data:
-        question = item['question']
-        contexts = item['retrieved_context']
-        prompt = build_prompt(question, contexts)
-        answer = generate_answer(prompt)
-
-        results.append({
-            "question": question,
-            "answer": answer,
-            "contexts": contexts
-        })
+    answers = run_batch(retrieval_data, answer_item, f"{os.path.splitext(output_path)[0]}.jsonl",
+                        max_workers=max_workers, rate=rate, label="answers", stage="generate",
+                        config=answer_config())
+    results = [
+        answer or {"question": item['question'], "answer": "Error generating answer", "contexts": item['retrieved_context']}
+        for item, answer in zip(retrieval_data, answers)
+    ]
 
     with open(output_path, "w", encoding="utf-8") as f:
         json.dump(results, f, indent=2, ensure_ascii=False)
@@ -53,4 +110,11 @@ def generate_answers_from_retrieval(input_path: str, output_path: str):
 if __name__ == "__main__":
     input_file = "/Users/pagrawal140/document-insights-prototype/output/query_results.json"
     output_file = "/Users/pagrawal140/document-insights-prototype/output/generated_answers.json"
-    generate_answers_from_retrieval(input_file, output_file)
+    generate_answers_from_retrieval(
+        input_file,
+        output_file,
+        max_workers=int(os.getenv("ANSWER_WORKERS", 8)),
+        rate=float(os.getenv("ANSWER_RATE", 0)) or None
+    )
+    if os.getenv("METRICS_PATH"):
+        get_tracer().write_prometheus(os.getenv("METRICS_PATH"))
@@ -0,0 +1,198 @@
+import os
+import re
+import hashlib
+import functools
+import pandas as pd
+import tiktoken
+
+TABLE_LINE = re.compile(r"^\s*\|.*\|\s*$")
+TABLE_SEPARATOR = re.compile(r"^\s*\|[\s:|-]+\|\s*$")
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_BREAK = re.compile(r"(?<=[.!?;])\s+(?=[\"'(\[]?[A-Z0-9•])|(?<=:)\s*\n\s*")
+INLINE_SPACE = re.compile(r"[ \t\xa0]+")
+HYPHEN_RUN = re.compile(r"-{2,}")
+EMBEDDING_NOISE = re.compile(r"[|\s]+")
+CHUNK_ORDINAL_BITS = 20
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(name=None):
+    """tiktoken encoding used to measure chunks (CHUNK_TOKENIZER, default cl100k_base)."""
+    return tiktoken.get_encoding(name or os.getenv("CHUNK_TOKENIZER", "cl100k_base"))
+
+
+def clean_text_for_embedding(text: str) -> str:
+    """Pipes, newlines and runs of whitespace to single spaces, runs of hyphens to one."""
+    return EMBEDDING_NOISE.sub(" ", HYPHEN_RUN.sub("-", text)).strip()
+
+
+def clean_texts(texts: pd.Series) -> pd.Series:
+    """`clean_text_for_embedding` over a whole column."""
+    return texts.str.replace(HYPHEN_RUN, "-", regex=True).str.replace(EMBEDDING_NOISE, " ", regex=True).str.strip()
+
+
+def normalize_sections(texts: pd.Series) -> pd.Series:
+    """Column-wide normalization that keeps line structure (needed to find tables)."""
+    return texts.str.replace(INLINE_SPACE, " ", regex=True).str.replace(HYPHEN_RUN, "-", regex=True).str.strip()
+
+
+def split_units(text: str) -> list:
+    """
+    Split a section into the units a chunk boundary may fall between:
+    `("sentence", text)` for prose and `("header", row)` / `("row", row)` for
+    Markdown table lines, so tables are never cut mid-row.
+    """
+    units, prose = [], []
+
+    def flush_prose():
+        for paragraph in PARAGRAPH_BREAK.split("\n".join(prose)):
+            units.extend(("sentence", s.strip()) for s in SENTENCE_BREAK.split(paragraph) if s and s.strip())
+        prose.clear()
+
+    lines = text.split("\n")
+    i = 0
+    while i < len(lines):
+        if TABLE_LINE.match(lines[i]):
+            flush_prose()
+            header = [lines[i]]
+            if i + 1 < len(lines) and TABLE_SEPARATOR.match(lines[i + 1]):
+                header.append(lines[i + 1])
+                i += 1
+            units.append(("header", "\n".join(header)))
+            i += 1
+            while i < len(lines) and TABLE_LINE.match(lines[i]):
+                units.append(("row", lines[i]))
+                i += 1
+        else:
+            prose.append(lines[i])
+            i += 1
+    flush_prose()
+    return units
+
+
+def _join(units: list) -> str:
+    text = ""
+    for kind, unit, _ in units:
+        if not text:
+            text = unit
+        else:
+            text += ("\n" if kind in ("header", "row") else " ") + unit
+    return text
+
+
+def pack_units(units: list, lengths: list, max_tokens=256, overlap_tokens=32):
+    """
+    Greedily pack units into chunks of at most `max_tokens`, yielding chunk text.
+
+    A new chunk starts with the trailing sentences of the previous one (up to
+    `overlap_tokens`) for continuity, or with the table header when it starts
+    inside a table. A single unit over the budget is cut at token boundaries.
+    """
+    current, header = [], None
+    for (kind, unit), length in zip(units, lengths):
+        if kind == "header":
+            header = (kind, unit, length)
+        elif kind == "sentence":
+            header = None
+        if length > max_tokens:
+            if current:
+                yield _join(current)
+            yield from _split_tokens(unit, max_tokens, overlap_tokens)
+            current = []
+            continue
+        if current and sum(l for *_, l in current) + length > max_tokens:
+            yield _join(current)
+            carry = []
+            if kind == "row" and header is not None:
+                carry = [header]
+            elif kind == "sentence":
+                for prev in reversed(current):
+                    if prev[0] != "sentence" or sum(l for *_, l in carry) + prev[2] > overlap_tokens:
+                        break
+                    carry.insert(0, prev)
+            current = carry if sum(l for *_, l in carry) + length <= max_tokens else []
+        current.append((kind, unit, length))
+    if current:
+        yield _join(current)
+
+
+def _split_tokens(text: str, max_tokens: int, overlap_tokens: int):
+    encoding = get_encoding()
+    tokens = encoding.encode_ordinary(text)
+    step = max(1, max_tokens - overlap_tokens)
+    for start in range(0, len(tokens), step):
+        yield encoding.decode(tokens[start:start + max_tokens])
+        if start + max_tokens >= len(tokens):
+            break
+
+
+def merge_small_sections(sections: list, min_tokens=40) -> list:
+    """
+    Fold sections shorter than `min_tokens` (typically a lone heading line)
+    into the next section, or into the previous one at the end of the
+    document. Sections are dicts of units, lengths, tokens, topic and page;
+    a merged section keeps the topic and page of the section it was folded into.
+    """
+    def fold(first, second, keep):
+        return {**keep, "units": first["units"] + second["units"], "lengths": first["lengths"] + second["lengths"],
+                "tokens": first["tokens"] + second["tokens"]}
+
+    merged, pending = [], None
+    for section in sections:
+        if pending is not None:
+            section, pending = fold(pending, section, section), None
+        if section["tokens"] < min_tokens:
+            pending = section
+        else:
+            merged.append(section)
+    if pending is not None:
+        if merged:
+            last = merged.pop()
+            merged.append(fold(last, pending, last))
+        else:
+            merged.append(pending)
+    return merged
+
+
+def chunk_id_base(source: str) -> int:
+    """
+    First chunk id of `source`: a 40-bit hash of the source name shifted left
+    by CHUNK_ORDINAL_BITS. A document's chunks are numbered consecutively from
+    it, so ids are unique across documents without any coordination between
+    workers, stable across runs, and consecutive chunks still differ by one.
+    """
+    digest = hashlib.blake2b(str(source).encode("utf-8"), digest_size=5).digest()
+    return int.from_bytes(digest, "big") << CHUNK_ORDINAL_BITS
+
+
+def iter_chunks(df: pd.DataFrame, filename: str, max_tokens=256, overlap_tokens=32, min_section_tokens=40):
+    """
+    Stream chunk rows (chunk_id, source, topic, page, chunk_text) for one document's sections
+    (`Context`, `Keyword`, `Page_Number` columns, as written by post_processing).
+
+    Sections are normalized column-wide, split into sentence and table-row
+    units, measured with one batched tokenizer call, merged when tiny and
+    packed into token-budgeted chunks. Chunk ids count up from
+    `chunk_id_base(filename)`.
+    """
+    df = df[df["Context"].notna()]
+    texts = normalize_sections(df["Context"].astype(str))
+    keep = texts.str.len() > 0
+    df, texts = df[keep], texts[keep]
+
+    section_units = [split_units(text) for text in texts]
+    flat = [unit for units in section_units for _, unit in units]
+    flat_lengths = [len(tokens) for tokens in get_encoding().encode_ordinary_batch(flat)] if flat else []
+
+    sections, offset = [], 0
+    for units, topic, page in zip(section_units, df["Keyword"], df["Page_Number"]):
+        lengths = flat_lengths[offset:offset + len(units)]
+        offset += len(units)
+        sections.append({"units": units, "lengths": lengths, "tokens": sum(lengths), "topic": topic, "page": page})
+
+    chunk_id = chunk_id_base(filename)
+    for section in merge_small_sections(sections, min_section_tokens):
+        for text in pack_units(section["units"], section["lengths"], max_tokens, overlap_tokens):
+            yield {"chunk_id": chunk_id, "source": filename, "topic": section["topic"], "page": int(section["page"]),
+                   "chunk_text": clean_text_for_embedding(text)}
+            chunk_id += 1
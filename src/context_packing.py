@@ -0,0 +1,128 @@
+import os
+import sys
+import hashlib
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.chunking import get_encoding
+
+MINHASH_PRIME = (1 << 31) - 1
+
+
+def minhash_signatures(texts: list, shingle_size=5, num_perm=64, seed=0) -> np.ndarray:
+    """
+    MinHash signatures of word `shingle_size`-grams, one row per text. The
+    fraction of equal entries between two rows estimates their Jaccard similarity.
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MINHASH_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_PRIME, num_perm, dtype=np.uint64)
+    signatures = np.full((len(texts), num_perm), MINHASH_PRIME, dtype=np.uint64)
+    for row, text in enumerate(texts):
+        words = str(text).lower().split()
+        shingles = {" ".join(words[i:i + shingle_size]) for i in range(max(1, len(words) - shingle_size + 1))}
+        hashes = np.array([int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little")
+                           for s in shingles], dtype=np.uint64) % MINHASH_PRIME
+        signatures[row] = ((hashes[:, None] * a + b) % MINHASH_PRIME).min(axis=0)
+    return signatures
+
+
+def _word_overlap(first: str, second: str, max_words=120) -> int:
+    """Length of the longest run of words ending `first` that also starts `second`."""
+    a, b = first.split(), second.split()
+    for n in range(min(len(a), len(b), max_words), 0, -1):
+        if a[-n:] == b[:n]:
+            return n
+    return 0
+
+
+def _merge_adjacent(contexts: list) -> tuple:
+    """
+    Join chunks that are consecutive (by chunk_id) in the same source and page,
+    dropping the overlap the chunker repeated between them. The merged context
+    takes the best score of its parts.
+    """
+    groups = {}
+    for ctx in contexts:
+        groups.setdefault((ctx.get("source"), ctx.get("page")), []).append(ctx)
+    merged, n_merged = [], 0
+    for group in groups.values():
+        if any(ctx.get("chunk_id") is None for ctx in group):
+            merged.extend(group)
+            continue
+        group = sorted(group, key=lambda ctx: ctx["chunk_id"])
+        current = dict(group[0])
+        for ctx in group[1:]:
+            if ctx["chunk_id"] == current["chunk_id"] + 1:
+                overlap = _word_overlap(current["context"], ctx["context"])
+                tail = " ".join(ctx["context"].split()[overlap:])
+                current = {**current, "context": f"{current['context']} {tail}".strip(),
+                           "score": max(current["score"], ctx["score"]), "chunk_id": ctx["chunk_id"],
+                           "merged_chunks": current.get("merged_chunks", 1) + 1}
+                n_merged += 1
+            else:
+                merged.append(current)
+                current = dict(ctx)
+        merged.append(current)
+    return merged, n_merged
+
+
+def pack_contexts(contexts: list, max_tokens=3000, dedup_threshold=0.8, min_tail_tokens=64) -> tuple:
+    """
+    Fit retrieved contexts into a prompt budget of `max_tokens`.
+
+    1. Near-duplicates (MinHash Jaccard >= `dedup_threshold` with a better
+       scored chunk) are dropped.
+    2. Consecutive chunks from the same source and page are merged, removing
+       the text the chunker repeated between them.
+    3. Contexts are ordered by relevance and added until the budget is spent;
+       the first one that does not fit is truncated if at least
+       `min_tail_tokens` remain, and the rest are dropped.
+
+    Returns the packed contexts and a report of what was dropped and the
+    tokens saved.
+    """
+    encoding = get_encoding()
+    contexts = sorted(contexts, key=lambda ctx: ctx["score"], reverse=True)
+    input_tokens = sum(len(t) for t in encoding.encode_ordinary_batch([c["context"] for c in contexts])) if contexts else 0
+
+    kept, duplicates = [], 0
+    if contexts:
+        signatures = minhash_signatures([ctx["context"] for ctx in contexts])
+        kept_rows = []
+        for row, ctx in enumerate(contexts):
+            if kept_rows and (signatures[kept_rows] == signatures[row]).mean(axis=1).max() >= dedup_threshold:
+                duplicates += 1
+                continue
+            kept_rows.append(row)
+            kept.append(ctx)
+
+    merged, n_merged = _merge_adjacent(kept)
+    merged.sort(key=lambda ctx: ctx["score"], reverse=True)
+
+    packed, used, truncated, over_budget = [], 0, 0, 0
+    lengths = [len(t) for t in encoding.encode_ordinary_batch([c["context"] for c in merged])] if merged else []
+    for ctx, length in zip(merged, lengths):
+        if max_tokens is None or used + length <= max_tokens:
+            packed.append(ctx)
+            used += length
+        elif not truncated and max_tokens - used >= min_tail_tokens:
+            tokens = encoding.encode_ordinary(ctx["context"])[:max_tokens - used]
+            packed.append({**ctx, "context": encoding.decode(tokens), "truncated": True})
+            used += len(tokens)
+            truncated += 1
+        else:
+            over_budget += 1
+
+    report = {
+        "input_chunks": len(contexts),
+        "duplicates_dropped": duplicates,
+        "chunks_merged": n_merged,
+        "truncated": truncated,
+        "dropped_for_budget": over_budget,
+        "output_contexts": len(packed),
+        "input_tokens": input_tokens,
+        "output_tokens": used,
+        "tokens_saved": input_tokens - used,
+    }
+    return packed, report
@@ -1,41 +1,26 @@
 import os
+import sys
 import pandas as pd
 import numpy as np
 import dotenv
 import logging
-from litellm import embedding
 
-dotenv.load_dotenv(override = True)
-logger = logging.getLogger(__name__)
-
-api_key = os.getenv("OPENAI_API_KEY")
-base = os.getenv("OPENAI_API_BASE")
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.vector_store import write_vector_store
+from src.lexical_index import build_lexical_index
+from src.utils.embedding_client import embed_texts
 
-def get_embeddings(text):
-    model_name = "azure.text-embedding-3-large" 
-    
-    model_kwargs = {"dimensions": 1024}
-    
-    response = embedding( 
-        input=text, 
-        model=f"openai/{model_name}",
-        api_key=api_key,
-        api_base=base,
-        **model_kwargs
-    )
-    
-    return response
+dotenv.load_dotenv(override = False)
+logger = logging.getLogger(__name__)
 
 if __name__ == "__main__":
-    chunks_df = pd.read_csv("/Users/pagrawal140/document-insights-prototype/output/chunked_kb.csv")
+    chunks_df = pd.read_parquet("/Users/pagrawal140/document-insights-prototype/output/chunked_kb.parquet")
 
-    chunks_df['embedding'] = chunks_df['chunk_text'].apply(lambda x : get_embeddings(x)['data'][0]['embedding'])
-
-    embeddings = np.array(chunks_df['embedding'].tolist())
+    embeddings = embed_texts(chunks_df['chunk_text'].astype(str).tolist())
     print(embeddings.shape)
-    if embeddings.ndim == 1:
-        embeddings = embeddings.reshape(1, -1)
-    norm_embeddings = embeddings/np.linalg.norm(embeddings, axis = 1, keepdims=True)
-    chunks_df['norm_embedding'] = norm_embeddings.tolist()
 
-    chunks_df.to_csv("/Users/pagrawal140/document-insights-prototype/output/vectorized_kb.csv", index = False)
\ No newline at end of file
+    store = write_vector_store("/Users/pagrawal140/document-insights-prototype/output/vector_store", embeddings, chunks_df)
+    print(f"Vector store written: {len(store)} chunks, KB version {store.version}")
+
+    build_lexical_index(store).save(store.path)
+    print("BM25 index written next to the vector store")
@@ -0,0 +1,188 @@
+import os
+import sys
+import json
+import time
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.preprocessing import extract_text_from_pdf_pages, post_processing, file_hash, page_hashes
+from src.vector_store import (VectorStore, is_vector_store, read_manifest, write_vector_store, patch_vector_store,
+                              chunk_frame, CHUNK_COLUMNS, CHUNK_SCHEMA)
+from src.lexical_index import build_lexical_index, load_lexical_index
+from src.utils.embedding_client import embed_texts
+from src.utils.tracing import get_tracer
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {"documents": {}}
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_manifest(manifest_path, manifest):
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def _chunks_path(output_dir, name):
+    return os.path.join(output_dir, "chunks", f"{name}.parquet")
+
+
+def _read_chunks(output_dir, name):
+    path = _chunks_path(output_dir, name)
+    if not os.path.exists(path) and os.path.exists(path[:-len(".parquet")] + ".csv"):
+        # Chunk file from before chunks were written as Parquet
+        return chunk_frame(pd.read_csv(path[:-len(".parquet")] + ".csv"))
+    return pd.read_parquet(path)
+
+
+def _sources(store: VectorStore):
+    return store.column('source') if store is not None else np.array([], dtype=object)
+
+
+def _rebuild_store(store_path, output_dir, documents):
+    """Rebuild the vector store from the per-document chunk files; embeddings come from the cache."""
+    frames = [_read_chunks(output_dir, name) for name, entry in documents.items() if entry.get("status") == "indexed"]
+    chunks_df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=list(CHUNK_COLUMNS))
+    store = write_vector_store(store_path, embed_texts(chunks_df['chunk_text'].astype(str).tolist()), chunks_df)
+    build_lexical_index(store).save(store_path)
+    return store
+
+
+def _chunk_document(json_path):
+    """Process pool task: post-process and chunk one extracted document, returning its tracing totals too."""
+    tracer = get_tracer()
+    tracer.reset()
+    chunks_df = post_processing(json_path)
+    return chunks_df, tracer.snapshot()
+
+
+def chunk_documents(json_paths: dict, workers=None) -> dict:
+    """
+    Post-process and chunk documents ({name: extracted JSON path}) on a pool
+    of `workers` processes, one task per document. Chunk ids are derived from
+    the document name (see src/chunking.chunk_id_base), so they do not depend
+    on which worker ran or in which order. Returns {name: chunks DataFrame}.
+    """
+    workers = workers or min(len(json_paths), os.cpu_count() or 1)
+    if workers <= 1 or len(json_paths) <= 1:
+        return {name: post_processing(path) for name, path in json_paths.items()}
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {name: pool.submit(_chunk_document, path) for name, path in json_paths.items()}
+        for name, future in futures.items():
+            results[name], totals = future.result()
+            get_tracer().merge(totals)
+    return results
+
+
+def write_chunked_kb(output_dir, names):
+    """Stream the per-document chunk files into one Parquet file, one row group per document."""
+    path = os.path.join(output_dir, "chunked_kb.parquet")
+    with pq.ParquetWriter(path + ".tmp", CHUNK_SCHEMA) as writer:
+        for name in names:
+            chunks_df = chunk_frame(_read_chunks(output_dir, name))
+            writer.write_table(pa.Table.from_pandas(chunks_df, schema=CHUNK_SCHEMA, preserve_index=False))
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def _patch_store(store_path, store, drop_mask, embeddings, chunks_df):
+    """Patch the vector store and its BM25 index together, so the index stays in step without a rebuild."""
+    lexical = load_lexical_index(store) if store is not None else None
+    patched = patch_vector_store(store_path, drop_mask, embeddings, chunks_df)
+    if lexical is not None:
+        lexical.update(drop_mask, chunks_df['chunk_text'].astype(str).tolist())
+    else:
+        lexical = build_lexical_index(patched)
+    lexical.save(store_path)
+    return patched
+
+
+def ingest_documents(data_files: dict, output_dir: str, store_path: str, manifest_path: str, max_concurrency=4,
+                     render_options=None, workers=None):
+    """
+    Bring the knowledge base up to date with `data_files` ({name: pdf path}).
+
+    The manifest records a content hash per file and per page. Unchanged files
+    are skipped outright; for a new or changed file only pages without a
+    matching entry in its page checkpoint are extracted. Changed documents are
+    then post-processed and chunked in parallel on `workers` processes, and
+    only chunks whose text is not already in the embedding cache are embedded.
+    Their rows in the vector store are replaced in place with one patch, along
+    with their BM25 postings. Files removed from `data_files` are dropped from
+    the store. Chunk files and chunked_kb.parquet are written by this process
+    only. An interrupted run resumes from the page checkpoint and the
+    manifest status of each file.
+    """
+    manifest = load_manifest(manifest_path)
+    documents = manifest.setdefault("documents", {})
+    os.makedirs(os.path.join(output_dir, "chunks"), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, "extracted_data"), exist_ok=True)
+
+    store = None
+    if is_vector_store(store_path):
+        if read_manifest(store_path).get("dirty"):
+            print("Vector store was left mid-patch, rebuilding from chunk files")
+            store = _rebuild_store(store_path, output_dir, documents)
+        else:
+            store = VectorStore.open(store_path)
+
+    extracted, changed_pages = {}, {}
+    for name, path in data_files.items():
+        if not path.endswith(".pdf"):
+            print(f"{path} - skipped, input file should be a PDF file")
+            continue
+        digest = file_hash(path)
+        entry = documents.get(name, {})
+        if entry.get("sha256") == digest and entry.get("status") == "indexed":
+            continue
+
+        print(f"{path} - begins!")
+        json_path = os.path.join(output_dir, "extracted_data", f"{name}.json")
+        hashes = page_hashes(path)
+        changed_pages[name] = extract_text_from_pdf_pages(path, json_path, max_concurrency=max_concurrency,
+                                                          hashes=hashes, render_options=render_options)
+        documents[name] = {
+            "path": path,
+            "sha256": digest,
+            "pages": {str(p): h for p, h in hashes.items()},
+            "status": "extracted",
+        }
+        extracted[name] = json_path
+        save_manifest(manifest_path, manifest)
+
+    start = time.perf_counter()
+    chunked = chunk_documents(extracted, workers=workers)
+    for name, chunks_df in chunked.items():
+        chunks_df.to_parquet(_chunks_path(output_dir, name), index=False)
+    if chunked:
+        print(f"Chunked {len(chunked)} documents in {time.perf_counter() - start:.1f}s")
+
+    removed = [name for name in documents if name not in data_files]
+    if (chunked or removed) and (store is not None or chunked):
+        # One embedding pass and one store patch for every changed and removed document
+        chunks_df = pd.concat(chunked.values(), ignore_index=True) if chunked else \
+            pd.DataFrame(columns=list(CHUNK_COLUMNS))
+        embeddings = embed_texts(chunks_df['chunk_text'].astype(str).tolist()) if len(chunks_df) else \
+            np.empty((0, store.dim if store is not None else 0))
+        store = _patch_store(store_path, store, np.isin(_sources(store), list(chunked) + removed), embeddings,
+                             chunks_df)
+    for name, chunks_df in chunked.items():
+        documents[name].update({"status": "indexed", "chunks": len(chunks_df), "changed_pages": changed_pages[name]})
+        print(f"{name}: {len(changed_pages[name])} pages extracted, {len(chunks_df)} chunks indexed")
+    for name in removed:
+        documents.pop(name)
+        if os.path.exists(_chunks_path(output_dir, name)):
+            os.remove(_chunks_path(output_dir, name))
+    save_manifest(manifest_path, manifest)
+
+    write_chunked_kb(output_dir, list(documents))
+    return store
@@ -12,6 +12,92 @@ def load_docx(file):
     doc = docx.Document(file)
     return "\n".join([p.text for p in doc.paragraphs])
 
+def classify_page(page, min_chars=200, max_image_coverage=0.5, min_printable=0.95):
+    """
+    Decide whether a page's text layer is good enough to skip vision OCR.
+
+    Returns "native" when the page has fonts, at least `min_chars` of
+    extractable text that is mostly printable (broken font encodings show up as
+    U+FFFD), and images covering less than `max_image_coverage` of the page.
+    Anything else - scans, image-heavy or nearly empty pages - is "ocr".
+    """
+    if not page.get_fonts():
+        return "ocr"
+    text = page.get_text("text").strip()
+    if len(text) < min_chars:
+        return "ocr"
+    printable = sum(1 for c in text if c.isprintable() or c.isspace()) - text.count("�")
+    if printable / len(text) < min_printable:
+        return "ocr"
+    page_area = abs(page.rect) or 1.0
+    image_area = sum(abs(fitz.Rect(info["bbox"]) & page.rect) for info in page.get_image_info())
+    if image_area / page_area > max_image_coverage:
+        return "ocr"
+    return "native"
+
+def _inside(bbox, rects):
+    rect = fitz.Rect(bbox)
+    return any(abs(rect & r) > 0.5 * abs(rect) for r in rects if abs(rect))
+
+def extract_native_page(page, heading_ratio=1.15, max_heading_chars=80):
+    """
+    Extract a page from its text layer in the same shape the OCR prompt asks
+    for: a list of {heading: text} objects, with text before the first heading
+    under "No Heading" and tables rendered as Markdown.
+
+    Headings are lines set noticeably larger than the body font (the most
+    common size by character count) or short lines set entirely in bold that do not end like a sentence.
+    Tables come from PyMuPDF's table finder and are placed by their position.
+    """
+    tables = page.find_tables().tables
+    table_rects = [fitz.Rect(t.bbox) for t in tables]
+
+    lines = []
+    size_weights = {}
+    for block in page.get_text("dict")["blocks"]:
+        if block.get("type") != 0 or _inside(block["bbox"], table_rects):
+            continue
+        for line in block["lines"]:
+            spans = [s for s in line["spans"] if s["text"].strip()]
+            if not spans:
+                continue
+            text = "".join(s["text"] for s in spans).strip()
+            size = max(s["size"] for s in spans)
+            bold = all(s["flags"] & 16 or "bold" in s["font"].lower() for s in spans)
+            for s in spans:
+                size_weights[round(s["size"], 1)] = size_weights.get(round(s["size"], 1), 0) + len(s["text"])
+            lines.append((line["bbox"][1], text, size, bold))
+
+    body_size = max(size_weights, key=size_weights.get) if size_weights else 0
+    items = [(y, "line", (text, size, bold)) for y, text, size, bold in lines]
+    items += [(t.bbox[1], "table", t.to_markdown()) for t in tables]
+    items.sort(key=lambda item: item[0])
+
+    sections = []
+    heading, body = "No Heading", []
+    for _, kind, value in items:
+        if kind == "line":
+            text, size, bold = value
+            is_heading = len(text) <= max_heading_chars and (
+                size >= body_size * heading_ratio or (bold and not text.endswith((".", ",", ";")))
+            )
+            if is_heading:
+                if body:
+                    sections.append({heading: "\n".join(body).strip()})
+                    heading, body = text, []
+                elif heading != "No Heading":
+                    # Consecutive heading lines (e.g. a wrapped title) form one heading
+                    heading = f"{heading} {text}"
+                else:
+                    heading = text
+                continue
+            body.append(text)
+        else:
+            body.append(value)
+    if body or heading != "No Heading":
+        sections.append({heading: "\n".join(body).strip()})
+    return sections
+
 if __name__ == "__main__":
     data = load_pdf(file)
     print(data)
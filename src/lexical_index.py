@@ -0,0 +1,195 @@
+import os
+import re
+import sys
+import json
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.vector_store import VectorStore, read_manifest
+
+LEXICAL_DIR = "lexical"
+LEXICAL_META_FILE = "bm25.json"
+LEXICAL_DATA_FILE = "bm25.npz"
+
+# Words, numbers and identifiers such as "hud-52736a", "990", "5,000" or "1.5"
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-.,/][a-z0-9]+)*")
+PART_PATTERN = re.compile(r"[-.,/]")
+
+
+def tokenize(text: str) -> list:
+    """
+    Lowercased terms of `text`. Compound identifiers are kept whole and also
+    split into their parts, so "HUD-52736A" matches both "hud-52736a" and "52736a";
+    digit groups are joined so "$5,000" and "5000" match.
+    """
+    terms = []
+    for token in TOKEN_PATTERN.findall(str(text).lower()):
+        if re.fullmatch(r"\d{1,3}(?:,\d{3})+(?:\.\d+)?", token):
+            token = token.replace(",", "")
+        terms.append(token)
+        parts = PART_PATTERN.split(token)
+        if len(parts) > 1:
+            terms.extend(part for part in parts if part)
+    return terms
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the chunk texts of a vector store, with postings in CSR form.
+
+    Postings for term t are `doc_ids[indptr[t]:indptr[t + 1]]` with matching
+    term frequencies in `tfs`; rows line up with the rows of the vector store.
+    Scoring a query gathers the postings of its terms and accumulates them into
+    one score array, with no per-document Python work.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.empty(0, dtype=np.int32)
+        self.tfs = np.empty(0, dtype=np.float32)
+        self.doc_len = np.empty(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    @property
+    def idf(self) -> np.ndarray:
+        df = np.diff(self.indptr)
+        return np.log1p((len(self) - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    def _term_ids(self, terms: list, grow=False) -> np.ndarray:
+        if grow:
+            for term in terms:
+                self.vocab.setdefault(term, len(self.vocab))
+        return np.array([self.vocab[t] for t in terms if t in self.vocab], dtype=np.int64)
+
+    def _postings(self, texts: list, offset: int):
+        """(term ids, doc ids, tfs, doc lengths) for new documents numbered from `offset`."""
+        term_ids, doc_ids, doc_len = [], [], np.zeros(len(texts), dtype=np.float32)
+        for i, text in enumerate(texts):
+            ids = self._term_ids(tokenize(text), grow=True)
+            doc_len[i] = len(ids)
+            term_ids.append(ids)
+            doc_ids.append(np.full(len(ids), offset + i, dtype=np.int64))
+        if not texts:
+            return np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0, np.float32), doc_len
+        pairs, tfs = np.unique(np.stack([np.concatenate(term_ids), np.concatenate(doc_ids)]), axis=1,
+                               return_counts=True)
+        return pairs[0], pairs[1], tfs.astype(np.float32), doc_len
+
+    def _set_postings(self, term_ids, doc_ids, tfs):
+        order = np.lexsort((doc_ids, term_ids))
+        self.doc_ids = doc_ids[order].astype(np.int32)
+        self.tfs = tfs[order].astype(np.float32)
+        self.indptr = np.zeros(len(self.vocab) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(self.vocab)), out=self.indptr[1:])
+
+    def build(self, texts: list) -> "BM25Index":
+        self.vocab = {}
+        term_ids, doc_ids, tfs, self.doc_len = self._postings(texts, 0)
+        self._set_postings(term_ids, doc_ids, tfs)
+        return self
+
+    def update(self, drop_mask, texts: list) -> "BM25Index":
+        """
+        Mirror `patch_vector_store`: drop the rows in `drop_mask`, then append
+        `texts` as new rows. Existing documents are not re-tokenized; their
+        postings are renumbered and merged with the new ones.
+        """
+        keep = ~np.asarray(drop_mask, dtype=bool)
+        new_row = np.cumsum(keep) - 1
+        term_ids = np.repeat(np.arange(len(self.vocab), dtype=np.int64), np.diff(self.indptr))
+        kept = keep[self.doc_ids]
+        old_terms, old_docs, old_tfs = term_ids[kept], new_row[self.doc_ids[kept]], self.tfs[kept]
+        self.doc_len = self.doc_len[keep]
+
+        new_terms, new_docs, new_tfs, new_len = self._postings(texts, len(self.doc_len))
+        self.doc_len = np.concatenate([self.doc_len, new_len])
+        self._set_postings(np.concatenate([old_terms, new_terms]), np.concatenate([old_docs, new_docs]),
+                           np.concatenate([old_tfs, new_tfs]))
+        return self
+
+    def score(self, query: str) -> np.ndarray:
+        """BM25 score of every document for `query`."""
+        scores = np.zeros(len(self), dtype=np.float32)
+        if not len(self):
+            return scores
+        term_ids, counts = np.unique(self._term_ids(tokenize(query)), return_counts=True)
+        idf = self.idf
+        avg_len = self.doc_len.mean() or 1.0
+        for term, count in zip(term_ids, counts):
+            lo, hi = self.indptr[term], self.indptr[term + 1]
+            docs, tf = self.doc_ids[lo:hi], self.tfs[lo:hi]
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / avg_len)
+            scores[docs] += count * idf[term] * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, queries: list, k: int, mask=None) -> list:
+        """
+        Best-first `(ids, scores)` per query, keeping only documents that match a
+        query term (and `mask`, a boolean row filter, when given).
+        """
+        hits = []
+        for query in queries:
+            scores = self.score(query)
+            if mask is not None:
+                scores[~mask] = 0
+            matched = np.flatnonzero(scores > 0)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            order = np.argsort(-scores[matched], kind="stable")
+            hits.append((matched[order], scores[matched[order]]))
+        return hits
+
+    def save(self, store_path: str):
+        lexical_path = os.path.join(store_path, LEXICAL_DIR)
+        os.makedirs(lexical_path, exist_ok=True)
+        terms = np.array(sorted(self.vocab, key=self.vocab.get), dtype=str)
+        np.savez(os.path.join(lexical_path, LEXICAL_DATA_FILE), terms=terms, indptr=self.indptr,
+                 doc_ids=self.doc_ids, tfs=self.tfs, doc_len=self.doc_len)
+        meta = {
+            "count": len(self),
+            "kb_version": read_manifest(store_path)["kb_version"],
+            "params": {"k1": self.k1, "b": self.b},
+        }
+        with open(os.path.join(lexical_path, LEXICAL_META_FILE), "w", encoding="utf-8") as f:
+            json.dump(meta, f, indent=2)
+
+
+def build_lexical_index(kb: VectorStore, **params) -> BM25Index:
+    return BM25Index(**params).build(kb.column('chunk_text').tolist())
+
+
+def load_lexical_index(kb: VectorStore):
+    """Load the BM25 index persisted next to the KB, or None when missing or built for another KB version."""
+    lexical_path = os.path.join(kb.path, LEXICAL_DIR)
+    if not os.path.isfile(os.path.join(lexical_path, LEXICAL_META_FILE)):
+        return None
+    with open(os.path.join(lexical_path, LEXICAL_META_FILE), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta["count"] != len(kb) or meta.get("kb_version") != kb.version:
+        return None
+    index = BM25Index(**meta["params"])
+    with np.load(os.path.join(lexical_path, LEXICAL_DATA_FILE)) as arrays:
+        index.vocab = {term: i for i, term in enumerate(arrays["terms"].tolist())}
+        index.indptr, index.doc_ids = arrays["indptr"], arrays["doc_ids"]
+        index.tfs, index.doc_len = arrays["tfs"], arrays["doc_len"]
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build a BM25 index next to the vector store")
+    parser.add_argument("--store", default="/Users/pagrawal140/document-insights-prototype/output/vector_store")
+    parser.add_argument("--k1", type=float, default=1.2)
+    parser.add_argument("--b", type=float, default=0.75)
+    args = parser.parse_args()
+
+    kb = VectorStore.open(args.store)
+    index = build_lexical_index(kb, k1=args.k1, b=args.b)
+    index.save(args.store)
+    print(f"BM25 index: {len(index.vocab)} terms, {len(index.doc_ids)} postings over {len(index)} chunks")
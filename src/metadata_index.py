@@ -0,0 +1,159 @@
+import re
+import numpy as np
+import pandas as pd
+
+CATEGORICAL_FIELDS = ("source", "topic")
+RANGE_FIELDS = ("page",)
+
+CLAUSE_PATTERN = re.compile(
+    r"^\s*(?P<field>\w+)\s*(?:"
+    r"in\s*\{(?P<values>[^}]*)\}"
+    r"|(?:between|in)\s+(?P<lo>-?\d+)\s*(?:and|\.\.|-)\s*(?P<hi>-?\d+)"
+    r"|(?P<op>==|=|>=|<=|>|<)\s*(?P<value>.+?)"
+    r")\s*$",
+    re.IGNORECASE,
+)
+
+
+class MetadataIndex:
+    """
+    Columnar view of chunk metadata for filtering before scoring.
+
+    Sources and topics are stored as categorical codes with one packed bitmap
+    per category (built on first use), pages as an int32 column. `mask`
+    combines bitmaps with bitwise ops, so a filter costs a few vector
+    operations regardless of how many chunks match.
+    """
+
+    def __init__(self, columns: dict):
+        self.count = len(columns["source"])
+        self.codes, self.categories = {}, {}
+        for field in CATEGORICAL_FIELDS:
+            codes, categories = pd.factorize(pd.Series(columns[field], dtype=object).fillna(""), sort=True)
+            self.codes[field] = codes.astype(np.int32)
+            self.categories[field] = {value: code for code, value in enumerate(categories)}
+        self.page = pd.to_numeric(pd.Series(columns["page"], dtype=object), errors="coerce").fillna(-1).to_numpy(np.int32)
+        self._bitmaps = {}
+
+    def values(self, field: str) -> list:
+        return list(self.categories[field])
+
+    def bitmap(self, field: str, value) -> np.ndarray:
+        """Packed bitmap of the rows whose `field` equals `value` (all zeros for unknown values)."""
+        code = self.categories[field].get(value)
+        if code is None:
+            return np.zeros((self.count + 7) // 8, dtype=np.uint8)
+        if (field, code) not in self._bitmaps:
+            self._bitmaps[(field, code)] = np.packbits(self.codes[field] == code)
+        return self._bitmaps[(field, code)]
+
+    def mask(self, filters) -> np.ndarray:
+        """
+        Boolean row mask for `filters`: a dict such as
+        {"source": ["a.pdf", "b.pdf"], "topic": "Travel", "page": [3, 10]} or a
+        string expression accepted by `parse_filter`. Conditions are ANDed;
+        page ranges are inclusive and either bound may be None.
+        """
+        bits = np.full((self.count + 7) // 8, 0xFF, dtype=np.uint8)
+        for field, condition in normalize_filters(filters).items():
+            if field in CATEGORICAL_FIELDS:
+                selected = np.zeros_like(bits)
+                for value in condition:
+                    selected |= self.bitmap(field, value)
+                bits &= selected
+            else:
+                lo, hi = condition
+                column = getattr(self, field)
+                in_range = np.ones(self.count, dtype=bool)
+                if lo is not None:
+                    in_range &= column >= lo
+                if hi is not None:
+                    in_range &= column <= hi
+                bits &= np.packbits(in_range)
+        return np.unpackbits(bits, count=self.count).astype(bool)
+
+    def rows(self, filters) -> np.ndarray:
+        """Row ids matching `filters`, ascending."""
+        return np.flatnonzero(self.mask(filters))
+
+
+def _bound(field: str, value):
+    if value is None or (isinstance(value, (int, np.integer)) and not isinstance(value, bool)):
+        return value
+    raise ValueError(f"{field} bounds must be integers or None, got {value!r}")
+
+
+def normalize_filters(filters) -> dict:
+    """
+    Validate `filters` (a dict or a `parse_filter` expression) without touching
+    any rows, and return them as {field: [values]} for categorical fields and
+    {field: (lo, hi)} for ranges. A range is a single value, `[value]` or
+    `[lo, hi]`. Raises ValueError for anything else, so bad filters can be
+    rejected before a query is queued.
+    """
+    if isinstance(filters, str):
+        filters = parse_filter(filters)
+    if not isinstance(filters, dict):
+        raise ValueError(f"Filters must be a dict or an expression string, got {type(filters).__name__}")
+    normalized = {}
+    for field, condition in filters.items():
+        if field in CATEGORICAL_FIELDS:
+            values = [condition] if isinstance(condition, str) else condition
+            if not isinstance(values, (list, tuple, set)) or not all(isinstance(v, str) for v in values):
+                raise ValueError(f"{field} filter must be a string or a list of strings, got {condition!r}")
+            normalized[field] = list(values)
+        elif field in RANGE_FIELDS:
+            if not isinstance(condition, (list, tuple)):
+                condition = [condition]
+            if len(condition) == 1:
+                condition = [condition[0], condition[0]]
+            if len(condition) != 2:
+                raise ValueError(f"{field} filter must be a value, [value] or [lo, hi], got {condition!r}")
+            normalized[field] = (_bound(field, condition[0]), _bound(field, condition[1]))
+        else:
+            raise ValueError(f"Cannot filter on {field!r}, expected one of {CATEGORICAL_FIELDS + RANGE_FIELDS}")
+    return normalized
+
+
+def parse_filter(expression: str) -> dict:
+    """
+    Parse a filter expression into the dict form used by `MetadataIndex.mask`.
+    Clauses are joined with "and", e.g.
+    `source in {Travel Policy.pdf, Finance Manual.pdf} and page between 3 and 10`
+    or `topic = Budgeting and page >= 5`. Clauses on the same field are
+    combined: `page >= 5 and page <= 10` is pages 5 to 10.
+    """
+    filters = {}
+
+    def add(field, condition):
+        # Repeated clauses on one field narrow it: ranges intersect, value sets intersect
+        if field not in filters:
+            filters[field] = condition
+        elif field in RANGE_FIELDS:
+            (lo, hi), (new_lo, new_hi) = filters[field], condition
+            filters[field] = [max((b for b in (lo, new_lo) if b is not None), default=None),
+                              min((b for b in (hi, new_hi) if b is not None), default=None)]
+        else:
+            filters[field] = [value for value in filters[field] if value in condition]
+
+    expression = re.sub(r"between\s+(-?\d+)\s+and\s+(-?\d+)", r"between \1..\2", expression.strip(), flags=re.IGNORECASE)
+    for clause in re.split(r"\s+and\s+(?![^{]*\})", expression, flags=re.IGNORECASE):
+        match = CLAUSE_PATTERN.match(clause)
+        if not match:
+            raise ValueError(f"Cannot parse filter clause {clause!r}")
+        field = match["field"].lower()
+        if match["values"] is not None:
+            add(field, [v.strip().strip("'\"") for v in match["values"].split(",") if v.strip()])
+        elif match["lo"] is not None:
+            add(field, [int(match["lo"]), int(match["hi"])])
+        else:
+            op, value = match["op"], match["value"].strip().strip("'\"")
+            if field in RANGE_FIELDS:
+                value = int(value)
+                add(field, {"=": [value, value], "==": [value, value], ">=": [value, None], ">": [value + 1, None],
+                            "<=": [None, value], "<": [None, value - 1]}[op])
+            elif op in ("=", "=="):
+                add(field, [value])
+            else:
+                raise ValueError(f"Operator {op} only applies to {RANGE_FIELDS}")
+    return filters
@@ -0,0 +1,116 @@
+import os
+import sys
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.utils.tracing import record
+
+
+class SpeculativeRetriever:
+    """
+    Starts embedding and retrieval for a question before it is submitted.
+
+    `prefetch(question, filters)` is called whenever the input changes. The
+    work starts once the input has been stable for `debounce_ms`; a newer
+    prefetch cancels the pending one, and a queued job that has not started
+    yet is cancelled too. Running jobs cannot be interrupted (they are one
+    embedding call and one scan), so they finish on the pool, capped at
+    `max_workers`, and their results stay in the cache in case the user
+    goes back to that question.
+
+    `get(question, filters)` has the signature of `retrieve` and returns the
+    finished or in-flight result for the same question and filters, or runs
+    `retrieve` directly. The last `max_entries` results are kept.
+    """
+
+    def __init__(self, retrieve, debounce_ms=300, max_workers=2, max_entries=32):
+        self.retrieve = retrieve
+        self.debounce = debounce_ms / 1000
+        self.max_entries = max_entries
+        self.stats = {"prefetched": 0, "cancelled": 0, "hits": 0, "misses": 0}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self._futures = OrderedDict()
+        self._speculative = set()
+        self._timer = None
+        self._pending = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(question: str, filters=None) -> str:
+        return json.dumps([" ".join(question.split()), filters], sort_keys=True, default=str)
+
+    def prefetch(self, question: str, filters=None):
+        """Schedule speculative retrieval for `question` after the debounce delay, replacing any pending one."""
+        if not question or not question.strip():
+            return
+        key = self.key(question, filters)
+        with self._lock:
+            if key in self._futures or key == self._pending:
+                return
+            self._cancel_pending()
+            self._pending = key
+            self._timer = threading.Timer(self.debounce, self._start, args=(key, question, filters))
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _cancel_pending(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending is not None:
+            self.stats["cancelled"] += 1
+            self._pending = None
+        # Speculative jobs still queued behind running ones are stale now; jobs a caller is waiting on are kept
+        for key in list(self._speculative):
+            if self._futures[key].cancel():
+                self._futures.pop(key)
+                self.stats["cancelled"] += 1
+        self._speculative.clear()
+
+    def _start(self, key: str, question: str, filters):
+        with self._lock:
+            if self._pending != key:
+                return
+            self._pending, self._timer = None, None
+            self._submit(key, question, filters)
+            self._speculative.add(key)
+            self.stats["prefetched"] += 1
+
+    def _submit(self, key: str, question: str, filters):
+        future = self._pool.submit(self.retrieve, question, filters=filters)
+        self._futures[key] = future
+        self._futures.move_to_end(key)
+        while len(self._futures) > self.max_entries:
+            self._speculative.discard(self._futures.popitem(last=False)[0])
+        return future
+
+    def get(self, question: str, filters=None):
+        """Result of `retrieve(question, filters=filters)`, reusing speculative work for the same input."""
+        key = self.key(question, filters)
+        with self._lock:
+            future = self._futures.get(key)
+            self._speculative.discard(key)
+            if future is not None and not future.cancelled():
+                self._futures.move_to_end(key)
+                self.stats["hits"] += 1
+                hit = True
+            else:
+                if key == self._pending:
+                    # Submitted before the debounce fired: start now instead of waiting it out
+                    self._timer.cancel()
+                    self._pending, self._timer = None, None
+                future = self._submit(key, question, filters)
+                self.stats["misses"] += 1
+                hit = False
+        record("prefetch", cache_hits=int(hit), items=1)
+        try:
+            return future.result()
+        except Exception:
+            # Do not keep a failed retrieval around for the next click
+            with self._lock:
+                if self._futures.get(key) is future:
+                    self._futures.pop(key)
+            raise
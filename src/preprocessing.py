@@ -1,5 +1,4 @@
 import base64
-import io
 import os
 import sys
 import pandas as pd
@@ -8,135 +7,256 @@ import json
 import fitz
 import re
 import difflib
-from PIL import Image
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from src.utils.llm_call import get_chat_completion
+from src.ingestion import classify_page, extract_native_page
+from src.chunking import iter_chunks
+from src.vector_store import CHUNK_COLUMNS
+from src.utils.tracing import span, get_tracer
 
-def convert_pdf_to_images_with_pymupdf(pdf_path, dpi=200):
-    """Convert each page of a PDF into a PIL Image using PyMuPDF."""
-    doc = fitz.open(pdf_path)
-    images = []
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        zoom = dpi / 72
-        mat = fitz.Matrix(zoom, zoom)
-        pix = page.get_pixmap(matrix=mat)
-        
-        img_bytes = pix.tobytes("png")
-        image = Image.open(io.BytesIO(img_bytes))
-        images.append(image)
-    return images
-
-def image_to_base64(pil_image):
-    """Convert a PIL Image to a base64-encoded PNG."""
-    buffer = io.BytesIO()
-    pil_image.save(buffer, format="PNG")
-    return base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-def extract_text_from_pdf_pages(pdf_path, output_json_path):
+IMAGE_MIME_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+
+def render_page(page, dpi=200, max_pixels=None, grayscale=False, image_format="png", quality=80):
     """
-    1. Converts PDF pages to images for GPT OCR.
-    2. Sends each image to GPT for text and table extraction.
-    3. Outputs the final JSON.
+    Render one page straight from the pixmap to encoded image bytes.
+
+    `max_pixels` caps width*height by lowering the DPI for large pages, so
+    oversized pages do not inflate the upload. `grayscale` renders a single
+    channel. PNG and JPEG are encoded by MuPDF directly; WebP goes through
+    Pillow once from the raw samples. Returns (mime_type, image bytes, dpi used).
     """
+    zoom = dpi / 72
+    if max_pixels:
+        width, height = page.rect.width * zoom, page.rect.height * zoom
+        if width * height > max_pixels:
+            zoom *= (max_pixels / (width * height)) ** 0.5
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=colorspace, alpha=False)
+    if image_format == "png":
+        data = pix.tobytes("png")
+    elif image_format == "jpeg":
+        data = pix.tobytes("jpeg", jpg_quality=quality)
+    elif image_format == "webp":
+        data = pix.pil_tobytes(format="WEBP", quality=quality)
+    else:
+        raise ValueError(f"Unsupported image format {image_format}, expected one of {list(IMAGE_MIME_TYPES)}")
+    return IMAGE_MIME_TYPES[image_format], data, round(zoom * 72)
+
+OCR_SYSTEM_PROMPT = (
+    "You are a helpful assistant that extracts text and tables from images. "
+    "If any tables are present, please convert them into Markdown format. "
+    "Return your answer as valid JSON. "
+    "Return ONLY valid JSON. Do not wrap your JSON in triple backticks or code fences. "
+    "Structure it as a JSON array of objects, where each object has a single key (the heading) "
+    "and the value is the text (including any tables in Markdown) that follows until the next heading. "
+    "If there is text with no heading, place it under the key 'No Heading'. "
+    "Do not include any extra commentary—only return valid JSON."
+)
+
+def iter_page_images(pdf_path, page_numbers=None, **render_options):
+    """
+    Lazily render pages as (page_number, data URL, stats); only one page is held
+    at a time. `render_options` are passed to `render_page`; stats report the
+    DPI used and the bytes sent.
+    """
+    doc = fitz.open(pdf_path)
+    try:
+        for page_num in range(len(doc)):
+            if page_numbers is not None and page_num + 1 not in page_numbers:
+                continue
+            with span("render", page=page_num + 1) as s:
+                mime, data, dpi = render_page(doc.load_page(page_num), **render_options)
+                encoded = base64.b64encode(data).decode("utf-8")
+                s.add(bytes=len(encoded))
+            stats = {"render_dpi": dpi, "image_bytes": len(data), "payload_bytes": len(encoded)}
+            yield page_num + 1, f"data:{mime};base64,{encoded}", stats
+    finally:
+        doc.close()
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def page_hashes(pdf_path):
+    """Content hash per page (drawing commands plus embedded images), keyed by page number."""
+    doc = fitz.open(pdf_path)
+    try:
+        hashes = {}
+        for page_num in range(len(doc)):
+            page = doc.load_page(page_num)
+            digest = hashlib.sha256(repr(tuple(page.rect)).encode("utf-8"))
+            digest.update(page.read_contents())
+            for image in page.get_images(full=True):
+                digest.update(doc.xref_stream_raw(image[0]) or b"")
+            hashes[page_num + 1] = digest.hexdigest()
+        return hashes
+    finally:
+        doc.close()
+
+def load_page_checkpoint(jsonl_path, hashes):
+    """Pages already OCR'd into `jsonl_path` whose content hash still matches."""
+    done = {}
+    if not os.path.exists(jsonl_path):
+        return done
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn last line from an interrupted run
+                continue
+            if hashes.get(record.get("page_number")) == record.get("page_hash"):
+                done[record["page_number"]] = record
+    return done
+
+def ocr_page(page_number, image_url, stats=None):
+    """Send one rendered page to the vision LLM and parse its JSON answer."""
+    user_prompt = [
+        {
+            "type": "text",
+            "text": f"This is page {page_number} of the PDF. Please extract all text and tables in JSON format as described."
+        },
+        {
+            "type": "image_url",
+            "image_url": {"url": image_url}
+        }
+    ]
+
+    raw_response = get_chat_completion([
+        {"role": "system", "content": OCR_SYSTEM_PROMPT},
+        {"role": "user", "content": user_prompt}
+    ], stage="ocr")
+    gpt_response = raw_response.choices[0].message.content
+    cleaned_response = re.sub(r"```(?:json)?", "", gpt_response).replace("```", "").strip()
+
+    try:
+        page_data = json.loads(cleaned_response)
+    except json.JSONDecodeError:
+        page_data = [{"Error": cleaned_response}]
+
+    return {
+        "page_number": page_number,
+        "extracted_data": page_data,
+        "method": "ocr",
+        **(stats or {})
+    }
+
+def pages_jsonl_path(output_json_path):
+    return f"{os.path.splitext(output_json_path)[0]}.pages.jsonl"
+
+def classify_pages(pdf_path, page_numbers):
     doc = fitz.open(pdf_path)
-    images = convert_pdf_to_images_with_pymupdf(pdf_path)
-    all_pages_data = []
-
-    for idx, img in enumerate(images):
-        page = doc.load_page(idx)
-        base64_img = image_to_base64(img)
-
-        system_prompt = (
-            "You are a helpful assistant that extracts text and tables from images. "
-            "If any tables are present, please convert them into Markdown format. "
-            "Return your answer as valid JSON. "
-            "Return ONLY valid JSON. Do not wrap your JSON in triple backticks or code fences. "
-            "Structure it as a JSON array of objects, where each object has a single key (the heading) "
-            "and the value is the text (including any tables in Markdown) that follows until the next heading. "
-            "If there is text with no heading, place it under the key 'No Heading'. "
-            "Do not include any extra commentary—only return valid JSON."
-        )
-
-        user_prompt = [
-            {
-                "type": "text",
-                "text": f"This is page {idx + 1} of the PDF. Please extract all text and tables in JSON format as described."
-            },
-            {
-                "type": "image_url",
-                "image_url": {"url": f"data:image/png;base64,{base64_img}"}
-            }
-        ]
-
-        raw_response = get_chat_completion([
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ])
-        gpt_response = raw_response.choices[0].message.content
-        cleaned_response = re.sub(r"```(?:json)?", "", gpt_response).replace("```", "").strip()
-
-        try:
-            page_data = json.loads(cleaned_response)
-        except json.JSONDecodeError:
-            page_data = [{"Error": cleaned_response}]
-
-        all_pages_data.append({
-            "page_number": idx + 1,
-            "extracted_data": page_data
-        })
+    try:
+        return {p: classify_page(doc.load_page(p - 1)) for p in page_numbers}
+    finally:
+        doc.close()
+
+def extract_text_from_pdf_pages(pdf_path, output_json_path, max_concurrency=4, resume=True, hashes=None, native_text=True,
+                                render_options=None):
+    """
+    1. Extracts pages with a usable text layer locally (see src/ingestion.classify_page).
+    2. Lazily renders the remaining pages to images for GPT OCR (`render_options`
+       go to `render_page`: dpi, max_pixels, grayscale, image_format, quality).
+    3. Sends up to `max_concurrency` pages to GPT at once for text and table extraction.
+    4. Appends each finished page to `<output>.pages.jsonl` as soon as it is done.
+    5. Outputs the final JSON, ordered by page.
+
+    At most `max_concurrency` rendered pages are in memory at any time, so
+    memory stays flat regardless of document length. With `resume`, pages
+    already in the JSONL checkpoint with an unchanged content hash are reused,
+    so a rerun or an interrupted run only extracts new or changed pages.
+
+    Returns the page numbers that were extracted in this call.
+    """
+    jsonl_path = pages_jsonl_path(output_json_path)
+    hashes = hashes or page_hashes(pdf_path)
+    done = load_page_checkpoint(jsonl_path, hashes) if resume else {}
+    todo = [p for p in hashes if p not in done]
+    if native_text:
+        methods = classify_pages(pdf_path, todo)
+    else:
+        methods = {p: "ocr" for p in todo}
+    ocr_pages = [p for p in todo if methods[p] == "ocr"]
+    get_tracer().record("extract", cache_hits=len(done), items=len(todo))
+    if todo:
+        print(f"{len(todo)} of {len(hashes)} pages to extract ({len(done)} reused from checkpoint), "
+              f"{len(ocr_pages)} need OCR")
+
+    pages = iter_page_images(pdf_path, page_numbers=set(ocr_pages), **(render_options or {}))
+    with open(jsonl_path, "w", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        # Rewrite the checkpoint with the still valid pages, dropping stale or torn records
+        for record in done.values():
+            out.write(json.dumps(record) + "\n")
+        out.flush()
+
+        if native_text:
+            doc = fitz.open(pdf_path)
+            for page_number in todo:
+                if methods[page_number] == "native":
+                    with span("native_text", page=page_number):
+                        extracted = extract_native_page(doc.load_page(page_number - 1))
+                    _write_record(out, {
+                        "page_number": page_number,
+                        "extracted_data": extracted,
+                        "method": "native",
+                    }, hashes, done)
+            doc.close()
+            out.flush()
+
+        in_flight = set()
+        for page_number, image_url, stats in pages:
+            in_flight.add(pool.submit(ocr_page, page_number, image_url, stats))
+            if len(in_flight) >= max_concurrency:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                _write_pages(out, finished, hashes, done)
+        _write_pages(out, wait(in_flight).done, hashes, done)
 
+    all_pages_data = [
+        {"page_number": p, "extracted_data": done[p]["extracted_data"]}
+        for p in sorted(hashes)
+    ]
     with open(output_json_path, "w", encoding="utf-8") as f:
         json.dump(all_pages_data, f, indent=2)
+    sent = [done[p].get("payload_bytes", 0) for p in ocr_pages]
+    if sent:
+        print(f"Sent {sum(sent) / 1024:.0f} KiB of images for {len(sent)} OCR pages "
+              f"(avg {sum(sent) / len(sent) / 1024:.0f} KiB, max {max(sent) / 1024:.0f} KiB per page)")
     print(f"Extraction complete! Output saved to {output_json_path}")
+    return todo
 
-def chunk_text(text, max_words=250, overlap=50):
-    # print("Text : ", text)
-    text = str(text)
-    words = text.split()
-    chunks = []
-    start = 0
-    while start < len(words):
-        end = min(start + max_words, len(words))
-        chunk = " ".join(words[start:end])
-        chunks.append(chunk)
-        if end == len(words):
-            break
-        start = end - overlap
-    return chunks
-
-def clean_text_for_embedding(text: str) -> str:
-    # Remove pipe characters, newlines, and tabs
-    text = re.sub(r'[\|\n\t]', ' ', text)
-    # Reduce multiple hyphens to one
-    text = re.sub(r'-{2,}', '-', text)
-    # Remove multiple spaces
-    text = re.sub(r'\s+', ' ', text)
-    return text.strip()
-
-def chunking(df, filename):
-    chunked_rows = []
-    id = 0
-    for i, row in df.iterrows():
-        topic = row["Keyword"]
-        full_text = row["Context"]
-        page = row["Page_Number"]
-
-        if full_text == np.nan:
-            continue
-        
-        chunks = chunk_text(full_text)
-        for chunk in chunks:
-            metadata = {"chunk_id" : id, "topic" : topic, "source" : filename, "page" : page}
-            id += 1
-            chunked_rows.append({
-                "chunk_text": clean_text_for_embedding(chunk),
-                "metadata": json.dumps(metadata)
-            })
-    chunks_df = pd.DataFrame(chunked_rows)
+def _write_record(out, record, hashes, done):
+    record["page_hash"] = hashes[record["page_number"]]
+    done[record["page_number"]] = record
+    out.write(json.dumps(record) + "\n")
+
+def _write_pages(out, futures, hashes, done):
+    for future in futures:
+        _write_record(out, future.result(), hashes, done)
+    out.flush()
+
+def chunking(df, filename, max_tokens=None, overlap_tokens=None):
+    """Chunk one document's sections; see src/chunking.py. Budgets default to CHUNK_MAX_TOKENS / CHUNK_OVERLAP_TOKENS."""
+    max_tokens = max_tokens or int(os.getenv("CHUNK_MAX_TOKENS", 256))
+    overlap_tokens = overlap_tokens if overlap_tokens is not None else int(os.getenv("CHUNK_OVERLAP_TOKENS", 32))
+    with span("chunk", source=filename, bytes=int(df["Context"].astype(str).str.len().sum()) if len(df) else 0) as s:
+        rows = iter_chunks(df, filename, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+        chunks_df = pd.DataFrame(rows, columns=list(CHUNK_COLUMNS))
+        s.add(items=len(chunks_df))
     return chunks_df
 
 def post_processing(filepath):
+    with span("post_process", bytes=os.path.getsize(filepath)):
+        df = _sections_frame(filepath)
+
+    chunks_df = chunking(df,filepath.split('/')[-1][:-5])
+    return chunks_df
+
+def _sections_frame(filepath):
     with open(filepath, "r", encoding="utf-8") as f:
         data_list = json.load(f)
 
@@ -161,12 +281,10 @@ def post_processing(filepath):
     df = pd.DataFrame(final_rows)[['Context', 'Keyword', 'Page_Number']]
     print(df)
 
-    output_csv_path = f"/Users/pagrawal140/document-insights-prototype/output/extracted_data/{filepath.split('/')[-1][:-5]}.csv"
-    df.to_csv(output_csv_path, index=False)
-    print(f"CSV file saved at: {output_csv_path}")
-
-    chunks_df = chunking(df,filepath.split('/')[-1][:-5])
-    return chunks_df
+    output_path = f"{filepath[:-5]}.parquet"
+    df.astype({"Context": str, "Keyword": str, "Page_Number": "int32"}).to_parquet(output_path, index=False)
+    print(f"Sections saved at: {output_path}")
+    return df
 
 if __name__ == "__main__":
     data_files = {
@@ -175,16 +293,21 @@ if __name__ == "__main__":
         "Fin_Management_Policy" : "/Users/pagrawal140/document-insights-prototype/data/sample_fin_mgmt_policy.pdf",
         "NonProfit_Financial_Policies_and_Procedures" : "/Users/pagrawal140/document-insights-prototype/data/Sample-Nonprofit-Financial-Policies-and-Procedures-Manual-Resource.pdf"
     }
-    final_kb = pd.DataFrame(columns = ["chunk_text", "metadata"])
-    for file_name, file in data_files.items():
-        if file.endswith('.pdf'):
-            print(f"{file} - begins!")
-            pdf_file_path = file
-            output_json_file_path = f"/Users/pagrawal140/document-insights-prototype/output/extracted_data/{file_name}.json"
-            extract_text_from_pdf_pages(pdf_file_path, output_json_file_path)
-            chunks_df = post_processing(output_json_file_path)
-            final_kb = pd.concat([final_kb, chunks_df])
-        else:
-            print("Input file should be a PDF file")
-    final_kb.to_csv("/Users/pagrawal140/document-insights-prototype/output/chunked_kb.csv", index = False)
+    from src.incremental_ingest import ingest_documents
 
+    ingest_documents(
+        data_files,
+        output_dir="/Users/pagrawal140/document-insights-prototype/output",
+        store_path="/Users/pagrawal140/document-insights-prototype/output/vector_store",
+        manifest_path="/Users/pagrawal140/document-insights-prototype/output/ingest_manifest.json",
+        max_concurrency=int(os.getenv("OCR_CONCURRENCY", 4)),
+        workers=int(os.getenv("CHUNK_WORKERS", 0)) or None,
+        render_options={
+            "dpi": int(os.getenv("OCR_DPI", 200)),
+            "max_pixels": int(os.getenv("OCR_MAX_PIXELS", 0)) or None,
+            "grayscale": os.getenv("OCR_GRAYSCALE", "0") == "1",
+            "image_format": os.getenv("OCR_IMAGE_FORMAT", "png"),
+        },
+    )
+    if os.getenv("METRICS_PATH"):
+        get_tracer().write_prometheus(os.getenv("METRICS_PATH"))
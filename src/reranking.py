@@ -0,0 +1,163 @@
+import os
+import re
+import sys
+import json
+import hashlib
+import logging
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.utils.llm_call import get_chat_completion
+from src.utils.tracing import span
+from src.utils.sqlite_store import SQLiteStore
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = "/Users/pagrawal140/document-insights-prototype/output/rerank_cache.sqlite"
+DEFAULT_CROSS_ENCODER = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+LLM_RERANK_PROMPT = (
+    "Rate how useful each passage is for answering the question, from 0 (irrelevant) to 10 "
+    "(directly answers it). Return ONLY a JSON array of integers, one per passage, in passage order. "
+    "Do not include any extra commentary."
+)
+
+
+class RerankCache(SQLiteStore):
+    """Persistent re-rank scores in SQLite, keyed by a hash of (model, question, chunk text)."""
+
+    table = "scores"
+    columns = (("score", "REAL NOT NULL"),)
+
+    @staticmethod
+    def key(model: str, question: str, text: str) -> str:
+        return hashlib.sha256(f"{model}|{question.strip().lower()}|{text}".encode("utf-8")).hexdigest()
+
+    def encode(self, score) -> tuple:
+        return (float(score),)
+
+
+class CrossEncoderReranker:
+    """
+    Local cross-encoder (sentence-transformers) scoring (question, passage)
+    pairs jointly. Logits are squashed to [0, 1] with a sigmoid so the
+    confidence threshold means the same thing for every re-ranker.
+    """
+
+    kind = "cross-encoder"
+
+    def __init__(self, model=DEFAULT_CROSS_ENCODER, batch_size=16):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError as e:
+            raise ImportError("The cross-encoder re-ranker needs sentence-transformers "
+                              "(pip install sentence-transformers); use RERANKER=llm otherwise") from e
+        self.model = model
+        self.batch_size = batch_size
+        self._model = CrossEncoder(model)
+
+    def score(self, question: str, texts: list) -> np.ndarray:
+        logits = self._model.predict([(question, text) for text in texts], batch_size=self.batch_size)
+        return 1.0 / (1.0 + np.exp(-np.asarray(logits, dtype=np.float64)))
+
+
+class LLMReranker:
+    """
+    Scores a batch of passages with one chat completion that returns a JSON
+    array of 0-10 ratings, scaled to [0, 1].
+    """
+
+    kind = "llm"
+
+    def __init__(self, model=None, max_chars=1500):
+        self.model = model or os.getenv("MODEL", "llm")
+        self.max_chars = max_chars
+
+    def score(self, question: str, texts: list) -> np.ndarray:
+        passages = "\n\n".join(f"[{i + 1}] {text[:self.max_chars]}" for i, text in enumerate(texts))
+        response = get_chat_completion([
+            {"role": "system", "content": LLM_RERANK_PROMPT},
+            {"role": "user", "content": f"Question: {question}\n\nPassages:\n{passages}\n\n"
+                                        f"Return a JSON array of {len(texts)} integers."}
+        ], stage="rerank_llm")
+        output = response.choices[0]['message']['content']
+        match = re.search(r"\[[^\[\]]*\]", output)
+        scores = json.loads(match.group(0)) if match else None
+        if not isinstance(scores, list) or len(scores) != len(texts):
+            raise ValueError(f"Expected {len(texts)} scores from the re-ranker, got {output[:200]!r}")
+        return np.clip(np.asarray(scores, dtype=np.float64), 0, 10) / 10
+
+
+RERANKERS = {cls.kind: cls for cls in (CrossEncoderReranker, LLMReranker)}
+
+
+def get_reranker(kind=None, **params):
+    """Re-ranker named by `kind` or RERANKER ("cross-encoder" or "llm"); None when re-ranking is off."""
+    kind = kind or os.getenv("RERANKER")
+    if not kind or kind == "none":
+        return None
+    if kind not in RERANKERS:
+        raise ValueError(f"Unknown re-ranker {kind!r}, expected one of {list(RERANKERS)}")
+    return RERANKERS[kind](**params)
+
+
+def rerank(question: str, contexts: list, reranker, candidates=30, top_n=5, batch_size=8, confidence=0.7,
+           min_score=0.3, cache=None):
+    """
+    Re-score the best `candidates` contexts (by retrieval score) with `reranker`
+    and return at most `top_n` of them, best first, plus a report.
+
+    Candidates are scored `batch_size` at a time in retrieval order; scoring
+    stops early once `top_n` of them reach `confidence`, since later
+    candidates are unlikely to displace them. Contexts scoring below
+    `min_score` are dropped, except that the best one is always kept; the
+    report's "below_min_score" flag says when nothing passed. Scores are
+    cached per (question, chunk text) in `cache` (a RerankCache), so repeated
+    questions cost no model calls. If the re-ranker fails, the retrieval
+    order is kept.
+
+    Each returned context keeps its retrieval score as "retrieval_score" and
+    carries the re-rank score as "score".
+    """
+    pool = sorted(contexts, key=lambda ctx: ctx["score"], reverse=True)[:candidates]
+    model = getattr(reranker, "model", reranker.kind)
+    keys = [RerankCache.key(model, question, ctx["context"]) for ctx in pool]
+    cached = cache.get_many(keys) if cache is not None else {}
+    report = {"input_contexts": len(contexts), "candidates": len(pool), "scored": 0, "cache_hits": 0,
+              "early_stop": False, "output_contexts": 0}
+
+    with span("rerank", items=len(pool)) as s:
+        scores = {}
+        for start in range(0, len(pool), batch_size):
+            batch = list(range(start, min(start + batch_size, len(pool))))
+            todo = [i for i in batch if keys[i] not in cached]
+            report["cache_hits"] += len(batch) - len(todo)
+            if todo:
+                try:
+                    new_scores = reranker.score(question, [pool[i]["context"] for i in todo])
+                except Exception as e:
+                    logger.warning(f"Re-ranking failed ({type(e).__name__}: {e}), keeping retrieval order")
+                    s.add(errors=1)
+                    report["fallback"] = True
+                    packed = pool[:top_n]
+                    report["output_contexts"] = len(packed)
+                    return packed, report
+                fresh = {keys[i]: float(score) for i, score in zip(todo, new_scores)}
+                cached.update(fresh)
+                if cache is not None:
+                    cache.put_many(fresh)
+            scores.update({i: cached[keys[i]] for i in batch})
+            report["scored"] = len(scores)
+            if sum(score >= confidence for score in scores.values()) >= top_n:
+                report["early_stop"] = start + batch_size < len(pool)
+                break
+        s.add(cache_hits=report["cache_hits"])
+
+    ranked = sorted(scores, key=lambda i: scores[i], reverse=True)
+    kept = [i for i in ranked if scores[i] >= min_score]
+    # Never hand an empty context list to answer generation; keep the best candidate and flag it
+    report["below_min_score"] = bool(ranked) and not kept
+    reranked = [{**pool[i], "retrieval_score": pool[i]["score"], "score": scores[i]}
+                for i in (kept or ranked[:1])][:top_n]
+    report["output_contexts"] = len(reranked)
+    return reranked, report
@@ -1,61 +1,224 @@
 import os
 import sys
 import json
+import time
 import pandas as pd
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from src.utils.llm_call import get_embeddings
+from src.utils.embedding_client import embed_texts
+from src.vector_store import VectorStore, is_vector_store, convert_csv_to_store, convert_parquet_to_store, normalize_rows
+from src.ann_index import load_index
+from src.lexical_index import load_lexical_index
+from src.utils.tracing import span, record
+from src.reranking import get_reranker, rerank, RerankCache, DEFAULT_CACHE_PATH as RERANK_CACHE_PATH
 
-def load_vectorized_kb(csv_path: str):
-    df = pd.read_csv(csv_path)
-    df['embedding'] = df['embedding'].apply(lambda x: np.array(json.loads(x)))
-    return df
+def load_vectorized_kb(path: str) -> VectorStore:
+    """
+    Open the vectorized KB. `path` is a vector store directory; a legacy
+    vectorized_kb.csv or an exported KB .parquet file is loaded into a
+    `vector_store` directory next to it on first load.
+    """
+    if is_vector_store(path):
+        return VectorStore.open(path)
+    if path.endswith((".csv", ".parquet")):
+        store_path = os.path.join(os.path.dirname(path), "vector_store")
+        if is_vector_store(store_path):
+            return VectorStore.open(store_path)
+        if path.endswith(".parquet"):
+            return convert_parquet_to_store(path, store_path)
+        return convert_csv_to_store(path, store_path)
+    raise FileNotFoundError(f"No vector store found at {path}")
 
 def embed_questions(questions: list):
-    embeddings = []
-    for q in questions:
-        embeddings.append(get_embeddings(q)['data'][0]['embedding'])
-    return embeddings
+    return embed_texts(questions)
 
-def retrieve_answers(user_questions: list, kb_df: pd.DataFrame, top_k=None, top_p=0.9):
-    q_embeddings = embed_questions(user_questions)
-    results = []
+def select_top_k(scores: np.ndarray, k: int):
+    """Indices of the k highest scores per row, best first, via argpartition (no full sort)."""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        part = np.tile(np.arange(n), (scores.shape[0], 1))
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1)
+
+def top_p_cutoff(sorted_scores: np.ndarray, thresholds: np.ndarray):
+    """
+    Number of leading scores needed for the cumulative sum to reach each row's
+    threshold, or -1 where the given prefix is not long enough.
+    """
+    reached = np.cumsum(sorted_scores, axis=1) >= thresholds[:, None]
+    counts = reached.argmax(axis=1) + 1
+    counts[~reached.any(axis=1)] = -1
+    return counts
+
+def select_top_p(candidates, totals: np.ndarray, top_p: float, n: int, initial_k=64):
+    """
+    Smallest best-first prefix per row whose similarity mass reaches `top_p` of
+    that row's total. `candidates(rows, k)` returns best-first `(ids, scores)`
+    for the given rows and must be exact once k == n. Candidates are widened by
+    doubling k only for rows that have not reached the threshold yet, so the
+    full row is sorted only when the cutoff really lies that deep.
+    """
+    thresholds = top_p * totals
+    selected = [None] * len(totals)
+    pending = np.arange(len(totals))
+    k = min(initial_k, n)
+    while len(pending):
+        ids, scores = candidates(pending, k)
+        counts = top_p_cutoff(scores, thresholds[pending])
+        if k == n:
+            # Floating point drift can keep the sum just under the threshold; take everything
+            counts[counts < 0] = n
+        for row, idx, score, count in zip(pending, ids, scores, counts):
+            if count > 0:
+                selected[row] = (idx[:count], score[:count])
+        pending = pending[counts < 0]
+        k = min(k * 2, n)
+    return selected
+
+def search(kb: VectorStore, q_embeddings, top_k=None, top_p=0.9, index=None, exact_fallback=0.25, query_block=128,
+           filters=None):
+    """
+    Score a batch of query embeddings against the KB and return `(indices, scores)`
+    per query, best first.
+
+    Without an index every block of queries is scored in one matrix multiply.
+    With an ANN index (see src/ann_index.py) candidates come from the index;
+    top-p rows whose cutoff needs more than `exact_fallback` of the corpus are
+    finished with the exact scan, so top_k/top_p keep their meaning.
 
-    for q_idx, q_embed in enumerate(q_embeddings):
-        similarities = cosine_similarity([q_embed], list(kb_df['embedding'].values))[0]
-        sorted_indices = similarities.argsort()[::-1]
-        sorted_sims = similarities[sorted_indices]
+    `filters` (see src/metadata_index.py) restricts the search to matching
+    chunks before scoring: only their vectors are read and multiplied, and the
+    top-p mass is taken over that subset. Filtered searches scan the subset
+    exactly instead of using the index.
+    """
+    started = time.perf_counter()
+    queries = normalize_rows(q_embeddings)
+    subset = None
+    if filters:
+        subset = kb.metadata_index.rows(filters)
+        matrix = np.asarray(kb.matrix[subset])
+        column_sum = matrix.sum(axis=0, dtype=np.float64)
+        index = None
+    else:
+        matrix = kb.matrix
+        column_sum = kb.column_sum
+    n = len(matrix)
+    if n == 0:
+        return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in range(len(queries))]
+    hits = []
+    for start in range(0, len(queries), query_block):
+        block = queries[start:start + query_block]
+        if index is None:
+            scores = block @ matrix.T
+
+            def candidates(rows, k):
+                ids = select_top_k(scores[rows], k)
+                return ids, np.take_along_axis(scores[rows], ids, axis=1)
+        else:
+            def candidates(rows, k):
+                if k > exact_fallback * n:
+                    exact = block[rows] @ matrix.T
+                    ids = select_top_k(exact, k)
+                    return ids, np.take_along_axis(exact, ids, axis=1)
+                return index.search(block[rows], k)
 
         if top_k is not None:
-            selected_indices = sorted_indices[:top_k]
+            ids, scores_k = candidates(np.arange(len(block)), min(top_k, n))
+            selected = [(idx[idx >= 0], score[idx >= 0]) for idx, score in zip(ids, scores_k)]
+        else:
+            totals = block.astype(np.float64) @ column_sum
+            selected = select_top_p(candidates, totals, top_p, n)
+        hits.extend(selected)
+    if subset is not None:
+        hits = [(subset[idx], score) for idx, score in hits]
+    record("retrieve", time.perf_counter() - started, items=len(queries), index=index.kind if index else "exact",
+           bytes=matrix.nbytes if index is None else 0)
+    return hits
+
+def fuse_rankings(dense, lexical, fusion="rrf", alpha=0.5, rrf_k=60, limit=None):
+    """
+    Merge one query's dense and lexical `(ids, scores)` lists, best first.
+
+    - "rrf": reciprocal rank fusion, sum of 1 / (rrf_k + rank) over both lists.
+    - "weighted": alpha * dense + (1 - alpha) * lexical, each min-max scaled
+      over its own list; a chunk missing from a list contributes 0 for it.
+    """
+    ids = np.union1d(dense[0], lexical[0]).astype(np.int64)
+    fused = np.zeros(len(ids), dtype=np.float64)
+    for (hit_ids, hit_scores), weight in ((dense, alpha), (lexical, 1 - alpha)):
+        if not len(hit_ids):
+            continue
+        pos = np.searchsorted(ids, hit_ids)
+        if fusion == "rrf":
+            fused[pos] += 1.0 / (rrf_k + np.arange(1, len(hit_ids) + 1))
+        elif fusion == "weighted":
+            lo, hi = hit_scores.min(), hit_scores.max()
+            fused[pos] += weight * ((hit_scores - lo) / (hi - lo) if hi > lo else np.ones(len(hit_scores)))
         else:
-            cumulative = 0.0
-            selected_indices = []
-            total = sum(sorted_sims)
-            for i, score in enumerate(sorted_sims):
-                cumulative += score
-                selected_indices.append(sorted_indices[i])
-                if cumulative >= top_p * total:
-                    break
-
-        answers = []
-        for i in selected_indices:
-            row = kb_df.iloc[i]
-            metadata = json.loads(row['metadata']) if isinstance(row['metadata'], str) else row['metadata']
-            answers.append({
-                "score": float(similarities[i]),
-                "context": row['chunk_text'],
-                "source": metadata['source'],
-                "section": metadata['topic']
-            })
-
-        results.append({
-            "question": user_questions[q_idx],
-            "retrieved_context": answers
-        })
+            raise ValueError(f"Unknown fusion {fusion!r}, expected 'rrf' or 'weighted'")
+    order = np.argsort(-fused, kind="stable")[:limit]
+    return ids[order], fused[order]
+
+def hybrid_search(kb: VectorStore, questions: list, q_embeddings, lexical, top_k=None, top_p=0.9, index=None,
+                  fusion="rrf", alpha=0.5, lexical_k=20, filters=None):
+    """
+    Dense `search` fused with BM25 hits from `lexical` (see src/lexical_index.py).
+    The result keeps the size the dense selection would have (top_k, or the
+    top-p cutoff) so exact-term matches displace weak dense hits instead of
+    growing the context.
+    """
+    dense_hits = search(kb, q_embeddings, top_k=top_k, top_p=top_p, index=index, filters=filters)
+    lexical_hits = lexical_search(kb, lexical, questions, lexical_k, filters=filters)
+    return [
+        fuse_rankings(dense, lex, fusion=fusion, alpha=alpha, limit=max(len(dense[0]), 1))
+        for dense, lex in zip(dense_hits, lexical_hits)
+    ]
 
+def lexical_search(kb: VectorStore, lexical, questions: list, top_k=10, filters=None):
+    """Keyword-only retrieval; needs no embedding call."""
+    with span("lexical", items=len(questions)):
+        return lexical.search(questions, top_k, mask=kb.metadata_index.mask(filters) if filters else None)
+
+def build_contexts(kb: VectorStore, indices, scores):
+    """Contexts for the hit rows; only their row groups of the chunk columns are read."""
+    columns = kb.take(indices)
+    return [
+        {"score": float(score), "context": text, "source": source, "section": topic, "page": int(page),
+         "chunk_id": int(chunk_id)}
+        for score, text, source, topic, page, chunk_id in zip(scores, columns['chunk_text'], columns['source'],
+                                                              columns['topic'], columns['page'], columns['chunk_id'])
+    ]
+
+def retrieve_answers(user_questions: list, kb: VectorStore, top_k=None, top_p=0.9, index=None, lexical=None,
+                     fusion="rrf", filters=None, reranker=None, rerank_cache=None, rerank_top_n=5):
+    """
+    Retrieve contexts for each question. `filters` limits retrieval to chunks
+    matching e.g. {"source": ["Travel Policy.pdf"], "page": [3, 10]} or
+    "source in {Travel Policy.pdf} and page between 3 and 10".
+
+    With a `reranker` (see src/reranking.py) the retrieved candidates are
+    re-scored and cut to at most `rerank_top_n` contexts per question.
+    """
+    q_embeddings = embed_questions(user_questions)
+    if lexical is None:
+        hits = search(kb, q_embeddings, top_k=top_k, top_p=top_p, index=index, filters=filters)
+    else:
+        hits = hybrid_search(kb, user_questions, q_embeddings, lexical, top_k=top_k, top_p=top_p, index=index,
+                             fusion=fusion, filters=filters)
+    results = [
+        {"question": question, "retrieved_context": build_contexts(kb, indices, scores)}
+        for question, (indices, scores) in zip(user_questions, hits)
+    ]
+    if reranker is not None:
+        for result in results:
+            result["retrieved_context"], result["rerank"] = rerank(
+                result["question"], result["retrieved_context"], reranker, top_n=rerank_top_n, cache=rerank_cache)
     return results
 
 def save_results(results, output_path="/Users/pagrawal140/document-insights-prototype/output/query_results.json"):
@@ -71,9 +234,15 @@ if __name__ == "__main__":
         "What internal controls are established for auditing and financial oversight?"
     ]
 
-    kb_csv_path = "/Users/pagrawal140/document-insights-prototype/output/vectorized_kb.csv"
-    kb_df = load_vectorized_kb(kb_csv_path)
+    kb_path = "/Users/pagrawal140/document-insights-prototype/output/vector_store"
+    kb = load_vectorized_kb(kb_path)
+    index = load_index(kb)
+    lexical = load_lexical_index(kb)
 
-    result = retrieve_answers(questions, kb_df, top_k=None, top_p=0.8)
+    # RERANKER=cross-encoder|llm re-scores the top-p candidates and keeps the best few
+    reranker = get_reranker()
+    result = retrieve_answers(questions, kb, top_k=None, top_p=0.8, index=index, lexical=lexical, reranker=reranker,
+                              rerank_cache=RerankCache(RERANK_CACHE_PATH) if reranker else None,
+                              rerank_top_n=int(os.getenv("RERANK_TOP_N", 5)))
     save_results(result)
     print(f"Retrieval complete. Results saved to output/query_results.json")
@@ -0,0 +1,305 @@
+import os
+import sys
+import json
+import time
+import queue
+import logging
+import threading
+import requests
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.retrieval import load_vectorized_kb, search, hybrid_search, build_contexts
+from src.ann_index import load_index
+from src.lexical_index import load_lexical_index
+from src.metadata_index import normalize_filters
+from src.answer_generation import answer_item
+from src.utils.embedding_client import embed_texts
+from src.utils.tracing import get_tracer
+from src.utils.http_server import ConcurrentHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBatcher:
+    """
+    Coalesces concurrent retrieval requests. Requests arriving within
+    `max_wait_ms` of each other (up to `max_batch`) are embedded with one
+    embedding call and scored with one matrix multiply per (top_k, top_p,
+    filters) group, then each caller's future is resolved with its own result.
+    """
+
+    def __init__(self, kb, index=None, max_batch=64, max_wait_ms=5, lexical=None):
+        self.kb = kb
+        self.index = index
+        self.lexical = lexical
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.queries = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, question: str, top_k=None, top_p=0.9, filters=None) -> Future:
+        """
+        Queue a query. A non-string question or malformed filters raise here,
+        before they reach the embedding call shared by the whole batch.
+        """
+        if not isinstance(question, str):
+            raise TypeError(f"question must be a string, got {type(question).__name__}")
+        if filters:
+            filters = normalize_filters(filters)
+        future = Future()
+        self._queue.put((question, top_k, top_p, filters, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                self._process(batch)
+            except Exception as e:
+                for *_, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _process(self, batch):
+        q_embeddings = embed_texts([question for question, *_ in batch])
+        groups = {}
+        for row, (_, top_k, top_p, filters, _) in enumerate(batch):
+            key = (str(top_k), str(top_p), json.dumps(filters, sort_keys=True, default=sorted))
+            groups.setdefault(key, []).append(row)
+        for rows in groups.values():
+            # A bad top_k, top_p or filter fails only the requests that share it, not the whole batch
+            try:
+                results = self._search_group(batch, rows, q_embeddings)
+            except Exception as e:
+                for row in rows:
+                    batch[row][-1].set_exception(e)
+                continue
+            for row, result in zip(rows, results):
+                batch[row][-1].set_result(result)
+        self.batches += 1
+        self.queries += len(batch)
+
+    def _search_group(self, batch, rows, q_embeddings) -> list:
+        _, top_k, top_p, filters, _ = batch[rows[0]]
+        if self.lexical is None:
+            hits = search(self.kb, q_embeddings[rows], top_k=top_k, top_p=top_p, index=self.index, filters=filters)
+        else:
+            hits = hybrid_search(self.kb, [batch[row][0] for row in rows], q_embeddings[rows], self.lexical,
+                                 top_k=top_k, top_p=top_p, index=self.index, filters=filters)
+        return [{
+            "question": batch[row][0],
+            "retrieved_context": build_contexts(self.kb, indices, scores),
+            "embedding": q_embeddings[row].tolist(),
+        } for row, (indices, scores) in zip(rows, hits)]
+
+
+class RetrievalService:
+    """
+    Long-lived process holding the KB, its index and a query batcher.
+
+    Endpoints:
+        GET  /healthz   - process is up
+        GET  /readyz    - KB is loaded (503 until then); reports KB version and size
+        GET  /metrics   - per-stage timings and counters in the Prometheus text format
+        POST /retrieve  - {"questions": [...] | "question": str, "top_k", "top_p", "filters", "return_embeddings"}
+        POST /answer    - {"question": str, "top_k", "top_p", "filters"} -> answer, contexts and packing report
+    """
+
+    def __init__(self, kb_path: str, host="127.0.0.1", port=8000, max_batch=64, max_wait_ms=5):
+        self.kb_path = kb_path
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.kb = None
+        self.batcher = None
+        self.load_error = None
+        self._server = ConcurrentHTTPServer((host, port), self._handler_class())
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def load(self):
+        try:
+            start = time.perf_counter()
+            kb = load_vectorized_kb(self.kb_path)
+            index = load_index(kb)
+            # Load the filter columns up front so the first request does not pay for it; chunk text
+            # is only read for the rows a query returns
+            kb.metadata_index
+            self.batcher = QueryBatcher(kb, index, max_batch=self.max_batch, max_wait_ms=self.max_wait_ms,
+                                        lexical=load_lexical_index(kb))
+            self.kb = kb
+            logger.info(f"Loaded KB {kb.version} ({len(kb)} chunks, index: {index.kind if index else 'exact'}) "
+                        f"in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            self.load_error = str(e)
+            logger.exception("Failed to load KB")
+
+    def start(self, block=True):
+        threading.Thread(target=self.load, daemon=True).start()
+        if block:
+            self._server.serve_forever()
+        else:
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def ready(self) -> bool:
+        return self.kb is not None
+
+    def retrieve(self, questions: list, top_k=None, top_p=0.9, filters=None) -> list:
+        futures = [self.batcher.submit(q, top_k=top_k, top_p=top_p, filters=filters) for q in questions]
+        return [f.result() for f in futures]
+
+    def _handler_class(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: dict):
+                data = json.dumps(payload, default=str).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path == "/healthz":
+                    self._send(200, {"status": "ok"})
+                elif self.path == "/readyz":
+                    if service.ready():
+                        self._send(200, {"status": "ready", "kb_version": service.kb.version, "chunks": len(service.kb),
+                                         "sources": service.kb.metadata_index.values("source"),
+                                         "batches": service.batcher.batches, "queries": service.batcher.queries})
+                    else:
+                        self._send(503, {"status": "loading" if service.load_error is None else "failed",
+                                         "error": service.load_error})
+                elif self.path == "/metrics":
+                    data = get_tracer().prometheus_text().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                else:
+                    self._send(404, {"error": f"Unknown path {self.path}"})
+
+            def do_POST(self):
+                if not service.ready():
+                    self._send(503, {"error": "KB not loaded yet"})
+                    return
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                except json.JSONDecodeError as e:
+                    self._send(400, {"error": f"Invalid JSON: {e}"})
+                    return
+                if not isinstance(body, dict):
+                    self._send(400, {"error": "Request body must be a JSON object"})
+                    return
+                questions = body.get("questions") or [body.get("question")]
+                if not isinstance(questions, list) or not all(isinstance(q, str) and q.strip() for q in questions):
+                    self._send(400, {"error": "'question' must be a non-empty string, 'questions' a list of them"})
+                    return
+                top_k, top_p, filters = body.get("top_k"), body.get("top_p", 0.9), body.get("filters")
+                if self.path not in ("/retrieve", "/answer"):
+                    self._send(404, {"error": f"Unknown path {self.path}"})
+                    return
+                try:
+                    self._post(questions, body, top_k, top_p, filters)
+                except (ValueError, TypeError) as e:
+                    self._send(400, {"error": f"{type(e).__name__}: {e}"})
+                except Exception as e:
+                    # Embedding or LLM API failures: the request was fine, the upstream call was not
+                    logger.exception(f"{self.path} failed")
+                    self._send(502, {"error": f"{type(e).__name__}: {e}"})
+
+            def _post(self, questions, body, top_k, top_p, filters):
+                if self.path == "/retrieve":
+                    results = service.retrieve(questions, top_k=top_k, top_p=top_p, filters=filters)
+                    if not body.get("return_embeddings"):
+                        for result in results:
+                            result.pop("embedding")
+                    self._send(200, {"kb_version": service.kb.version, "results": results})
+                else:
+                    result = service.retrieve(questions[:1], top_k=top_k, top_p=top_p, filters=filters)[0]
+                    try:
+                        answer = answer_item(result)
+                    except Exception as e:
+                        # Any generation failure is upstream, even a TypeError or ValueError from the client
+                        logger.exception("/answer generation failed")
+                        self._send(502, {"error": f"{type(e).__name__}: {e}"})
+                        return
+                    self._send(200, {"kb_version": service.kb.version, **answer})
+
+        return Handler
+
+
+class RetrievalClient:
+    """Thin HTTP client for RetrievalService, used by app.py when RETRIEVAL_SERVICE_URL is set."""
+
+    def __init__(self, base_url: str, timeout=30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._session = requests.Session()
+
+    def ready(self) -> dict:
+        response = self._session.get(f"{self.base_url}/readyz", timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def retrieve(self, questions: list, top_k=None, top_p=0.9, return_embeddings=False, filters=None) -> dict:
+        response = self._session.post(f"{self.base_url}/retrieve", timeout=self.timeout, json={
+            "questions": questions, "top_k": top_k, "top_p": top_p, "filters": filters,
+            "return_embeddings": return_embeddings,
+        })
+        response.raise_for_status()
+        return response.json()
+
+    def answer(self, question: str, top_k=None, top_p=0.9, filters=None) -> dict:
+        response = self._session.post(f"{self.base_url}/answer", timeout=self.timeout,
+                                      json={"question": question, "top_k": top_k, "top_p": top_p, "filters": filters})
+        response.raise_for_status()
+        return response.json()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve retrieval and answers over HTTP from a warm in-memory KB")
+    parser.add_argument("--kb", default="/Users/pagrawal140/document-insights-prototype/output/vector_store")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    service = RetrievalService(args.kb, host=args.host, port=args.port, max_batch=args.max_batch,
+                               max_wait_ms=args.max_wait_ms)
+    print(f"Retrieval service listening on {service.base_url}")
+    service.start()
@@ -0,0 +1,313 @@
+import os
+import sys
+import json
+import heapq
+import hashlib
+import logging
+import threading
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.vector_store import VectorStore, write_vector_store, normalize_rows
+from src.retrieval import search, build_contexts
+
+logger = logging.getLogger(__name__)
+
+SHARDS_FILE = "shards.json"
+GLOBAL_ROWS_FILE = "global_rows.npy"
+
+
+def _stable_hash(values) -> np.ndarray:
+    return np.array([int.from_bytes(hashlib.blake2b(str(v).encode("utf-8"), digest_size=8).digest(), "little")
+                     for v in values], dtype=np.uint64)
+
+
+def shard_vector_store(kb: VectorStore, out_dir: str, n_shards: int, by="source") -> dict:
+    """
+    Split `kb` into `n_shards` vector stores under `out_dir`, by a stable hash
+    of the source document (`by="source"`, keeps documents whole) or of
+    (source, chunk_id) (`by="chunk"`, evens out shard sizes). Rows are copied
+    bit for bit and each shard records the global row of every local row, so
+    merged results can be compared with the unsharded store.
+    """
+    if by == "source":
+        keys = kb.column("source")
+    elif by == "chunk":
+        keys = [f"{source}|{chunk_id}" for source, chunk_id in zip(kb.column("source"), kb.column("chunk_id"))]
+    else:
+        raise ValueError(f"Unknown sharding key {by!r}, expected 'source' or 'chunk'")
+    assignment = _stable_hash(keys) % np.uint64(n_shards)
+
+    os.makedirs(out_dir, exist_ok=True)
+    shards = []
+    for shard in range(n_shards):
+        rows = np.flatnonzero(assignment == shard)
+        name = f"shard-{shard:03d}"
+        store = write_vector_store(os.path.join(out_dir, name), np.asarray(kb.embeddings[rows]),
+                                   pd.DataFrame(kb.take(rows)), dtype=kb.manifest["dtype"], normalize=False)
+        np.save(os.path.join(store.path, GLOBAL_ROWS_FILE), rows)
+        shards.append({"path": name, "count": int(len(rows))})
+    layout = {"by": by, "n_shards": n_shards, "kb_version": kb.version, "dim": kb.dim, "shards": shards}
+    with open(os.path.join(out_dir, SHARDS_FILE), "w", encoding="utf-8") as f:
+        json.dump(layout, f, indent=2)
+    return layout
+
+
+class ShardWorker:
+    """
+    Serves one shard over a local socket (multiprocessing.connection). Requests
+    are tuples: ("info",), ("search", queries, k, filters) returning the
+    shard's best-first top-k per query, its row count and its column sum for
+    the filter, and ("contexts", rows, scores) returning context dicts.
+    """
+
+    def __init__(self, path: str):
+        self.kb = VectorStore.open(path)
+        global_rows_path = os.path.join(path, GLOBAL_ROWS_FILE)
+        self.global_rows = np.load(global_rows_path) if os.path.exists(global_rows_path) else np.arange(len(self.kb))
+        self._column_sums = {}
+
+    def column_sum(self, filters):
+        if not filters:
+            return self.kb.column_sum, len(self.kb)
+        key = json.dumps(filters, sort_keys=True, default=sorted)
+        if key not in self._column_sums:
+            subset = self.kb.metadata_index.rows(filters)
+            self._column_sums[key] = (np.asarray(self.kb.matrix[subset]).sum(axis=0, dtype=np.float64), len(subset))
+        return self._column_sums[key]
+
+    def handle(self, request):
+        kind = request[0]
+        if kind == "info":
+            return {"count": len(self.kb), "dim": self.kb.dim, "kb_version": self.kb.version}
+        if kind == "search":
+            _, queries, k, filters = request
+            column_sum, count = self.column_sum(filters)
+            hits = search(self.kb, queries, top_k=k, filters=filters) if count else \
+                [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in range(len(queries))]
+            return {"hits": [(self.global_rows[ids], ids, scores) for ids, scores in hits], "count": count,
+                    "column_sum": column_sum}
+        if kind == "contexts":
+            _, rows, scores = request
+            return build_contexts(self.kb, np.asarray(rows, dtype=np.int64), scores)
+        raise ValueError(f"Unknown request {kind!r}")
+
+    def serve(self, listener: Listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, OSError) as e:
+                # A client with the wrong key (or one that hung up mid-handshake) must not stop the shard
+                logger.warning(f"Rejected shard connection: {type(e).__name__}: {e}")
+                continue
+            threading.Thread(target=self._serve_connection, args=(conn,), daemon=True).start()
+
+    def _serve_connection(self, conn):
+        with conn:
+            while True:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    return
+                try:
+                    conn.send(("ok", self.handle(request)))
+                except Exception as e:
+                    conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def shard_authkey(authkey=None) -> bytes:
+    """
+    Key for shard connections: `authkey` (bytes or hex) or else the hex
+    SHARD_AUTHKEY environment variable. Connections exchange pickles, so there
+    is deliberately no default key.
+    """
+    authkey = authkey or os.getenv("SHARD_AUTHKEY")
+    if not authkey:
+        raise ValueError("Shard connections need an authkey: pass one or set SHARD_AUTHKEY (hex)")
+    return bytes.fromhex(authkey) if isinstance(authkey, str) else authkey
+
+
+def serve_shard(path: str, address=("127.0.0.1", 0), authkey=None, ready=None):
+    """Process entry point: open the shard, listen on `address` and report the bound address through `ready`."""
+    authkey = shard_authkey(authkey)
+    worker = ShardWorker(path)
+    with Listener(address, authkey=authkey) as listener:
+        if ready is not None:
+            ready.send(listener.address)
+            ready.close()
+        worker.serve(listener)
+
+
+def start_local_shards(shards_dir: str) -> tuple:
+    """
+    Start one worker process per shard in `shards_dir` under a fresh random
+    key; returns (addresses, processes, authkey).
+    """
+    authkey = os.urandom(32)
+    with open(os.path.join(shards_dir, SHARDS_FILE), "r", encoding="utf-8") as f:
+        layout = json.load(f)
+    addresses, processes = [], []
+    for shard in layout["shards"]:
+        parent, child = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=serve_shard, daemon=True,
+                                          args=(os.path.join(shards_dir, shard["path"]), ("127.0.0.1", 0), authkey, child))
+        process.start()
+        addresses.append(parent.recv())
+        processes.append(process)
+    return addresses, processes, authkey
+
+
+class ShardedRetriever:
+    """
+    Coordinator over shard workers. A query batch is scattered to every shard
+    at once and the per-shard best-first lists are k-way merged.
+
+    top_k: each shard returns its own top_k; the global top_k is the head of
+    the merge.
+
+    top_p: the threshold uses the global similarity mass (query dot the sum of
+    the shards' column sums, for the filter). Shards return `k` candidates and
+    the merge is cut at the lowest score every unexhausted shard has already
+    passed, so the merged prefix is exactly the head of the single-node
+    ranking. Rows whose cutoff lies beyond that prefix are asked again with
+    `k` doubled, as `select_top_p` does on a single node.
+
+    Shards scan exactly, so the selected chunks match `retrieval.search`
+    without an index. Scores can differ from it in the last bit, as they
+    already do on one node between query batch sizes (BLAS blocking).
+
+    `authkey` must match the shards' key (see `shard_authkey`).
+    """
+
+    def __init__(self, addresses: list, authkey=None, initial_k=64):
+        self.initial_k = initial_k
+        authkey = shard_authkey(authkey)
+        self._connections = [Client(tuple(address), authkey=authkey) for address in addresses]
+        self._locks = [threading.Lock() for _ in addresses]
+        self._pool = ThreadPoolExecutor(max_workers=len(addresses))
+        self.shards = self._scatter([("info",)] * len(addresses))
+
+    def _call(self, shard: int, request):
+        with self._locks[shard]:
+            self._connections[shard].send(request)
+            status, payload = self._connections[shard].recv()
+        if status != "ok":
+            raise RuntimeError(f"Shard {shard} failed: {payload}")
+        return payload
+
+    def _scatter(self, requests: list) -> list:
+        return list(self._pool.map(self._call, range(len(requests)), requests))
+
+    def close(self):
+        for conn in self._connections:
+            conn.close()
+        self._pool.shutdown()
+
+    def search(self, q_embeddings, top_k=None, top_p=0.9, filters=None) -> list:
+        """Best-first hits per query as (global_rows, scores, [(shard, local_row), ...])."""
+        # Shards normalize the queries themselves, as `search` does; normalizing twice would change the low bits
+        queries = np.asarray(q_embeddings, dtype=np.float32)
+        n_shards = len(self._connections)
+        if top_k is not None:
+            responses = self._scatter([("search", queries, top_k, filters)] * n_shards)
+            return [self._merge([response["hits"][row] for response in responses], top_k)
+                    for row in range(len(queries))]
+
+        selected = [None] * len(queries)
+        pending = np.arange(len(queries))
+        thresholds = None
+        k = self.initial_k
+        while len(pending):
+            responses = self._scatter([("search", queries[pending], k, filters)] * n_shards)
+            if thresholds is None:
+                column_sum = np.sum([response["column_sum"] for response in responses], axis=0)
+                thresholds = top_p * (normalize_rows(queries).astype(np.float64) @ column_sum)
+            still_pending = []
+            for position, row in enumerate(pending):
+                lists = [response["hits"][position] for response in responses]
+                open_shards = [hits for hits, response in zip(lists, responses)
+                               if len(hits[2]) == k and k < response["count"]]
+                bound = max(hits[2][-1] for hits in open_shards) if open_shards else -np.inf
+                global_rows, scores, origin = self._merge(lists)
+                complete = int(np.sum(scores >= bound)) if open_shards else len(scores)
+                reached = np.flatnonzero(np.cumsum(scores[:complete]) >= thresholds[row])
+                if len(reached):
+                    count = reached[0] + 1
+                elif not open_shards:
+                    # Floating point drift can keep the sum just under the threshold; take everything
+                    count = len(scores)
+                else:
+                    still_pending.append(row)
+                    continue
+                selected[row] = (global_rows[:count], scores[:count], origin[:count])
+            pending = np.array(still_pending, dtype=np.int64)
+            k *= 2
+        return selected
+
+    @staticmethod
+    def _merge(lists: list, limit=None) -> tuple:
+        """k-way merge of per-shard best-first (global_rows, local_rows, scores) lists."""
+        streams = [
+            [(float(score), int(global_row), shard, int(local_row)) for global_row, local_row, score in zip(*hits)]
+            for shard, hits in enumerate(lists)
+        ]
+        merged = list(heapq.merge(*streams, key=lambda hit: -hit[0]))[:limit]
+        scores = np.array([hit[0] for hit in merged], dtype=np.float32)
+        global_rows = np.array([hit[1] for hit in merged], dtype=np.int64)
+        return global_rows, scores, [(hit[2], hit[3]) for hit in merged]
+
+    def retrieve(self, questions: list, q_embeddings, top_k=None, top_p=0.9, filters=None) -> list:
+        """Same result shape as `retrieval.retrieve_answers`; contexts are fetched from the shards holding the hits."""
+        results = []
+        for question, (_, scores, origin) in zip(questions, self.search(q_embeddings, top_k, top_p, filters)):
+            by_shard = {}
+            for position, (shard, local_row) in enumerate(origin):
+                by_shard.setdefault(shard, []).append((position, local_row))
+            contexts = [None] * len(origin)
+            shards = list(by_shard)
+            fetched = self._pool.map(self._call, shards, [
+                ("contexts", [row for _, row in by_shard[shard]], [float(scores[p]) for p, _ in by_shard[shard]])
+                for shard in shards])
+            for shard, shard_contexts in zip(shards, fetched):
+                for (position, _), context in zip(by_shard[shard], shard_contexts):
+                    contexts[position] = context
+            results.append({"question": question, "retrieved_context": contexts})
+        return results
+
+
+if __name__ == "__main__":
+    import argparse
+    from src.retrieval import load_vectorized_kb
+
+    parser = argparse.ArgumentParser(description="Split the vector store into shards and check sharded retrieval "
+                                                 "against a single node with local worker processes")
+    parser.add_argument("--kb", default="/Users/pagrawal140/document-insights-prototype/output/vector_store")
+    parser.add_argument("--out", default="/Users/pagrawal140/document-insights-prototype/output/shards")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--by", default="source", choices=["source", "chunk"])
+    parser.add_argument("--check", type=int, default=50, help="Queries to compare against single-node search (0 skips)")
+    args = parser.parse_args()
+
+    kb = load_vectorized_kb(args.kb)
+    layout = shard_vector_store(kb, args.out, args.shards, by=args.by)
+    print(f"Wrote {len(kb)} chunks to {args.shards} shards: {[shard['count'] for shard in layout['shards']]}")
+
+    if args.check:
+        rng = np.random.default_rng(0)
+        sample = np.sort(rng.choice(len(kb), size=min(args.check, len(kb)), replace=False))
+        queries = np.asarray(kb.matrix[sample]) + 0.05 * rng.standard_normal((len(sample), kb.dim)).astype(np.float32)
+        addresses, processes, authkey = start_local_shards(args.out)
+        retriever = ShardedRetriever(addresses, authkey)
+        for top_k, top_p in ((5, 0.9), (20, 0.9), (None, 0.5), (None, 0.9)):
+            single = search(kb, queries, top_k=top_k, top_p=top_p)
+            sharded = retriever.search(queries, top_k=top_k, top_p=top_p)
+            exact = all(np.array_equal(np.sort(s[0]), np.sort(d[0])) for s, d in zip(single, sharded))
+            print(f"top_k={top_k} top_p={top_p if top_k is None else '-'}: sharded == single node for all {len(queries)} queries: {exact}")
+        retriever.close()
+        for process in processes:
+            process.terminate()
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from src.utils.tracing import get_tracer
+from litellm.exceptions import (
+    RateLimitError,
+    APIConnectionError,
+    Timeout,
+    ServiceUnavailableError,
+    InternalServerError,
+)
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, Timeout, ServiceUnavailableError, InternalServerError)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens per second refill up to `capacity`.
+    `acquire` blocks until a token is available, so callers are smoothed to
+    the rate instead of sleeping a fixed time after every call.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0):
+        while True:
+            wait = self._take(tokens)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        """Take `tokens` if they are available now, without waiting."""
+        return self._take(tokens) == 0
+
+    def refund(self, tokens: float = 1.0):
+        """Give back tokens taken for a call that did not happen."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def _take(self, tokens: float) -> float:
+        # Seconds until `tokens` are available, or 0 after taking them
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0
+            return (tokens - self._tokens) / self.rate
+
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    """Exponential backoff with jitter for the given zero-based retry attempt."""
+    return min(cap, base * 2 ** attempt) * (0.5 + random.random())
+
+
+def call_with_retry(fn, *args, max_retries=5, backoff=1.0, max_backoff=60.0, retry_on=RETRYABLE_ERRORS,
+                    on_retry=None, **kwargs):
+    """Call `fn`, retrying errors in `retry_on` with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return fn(*args, **kwargs)
+        except retry_on as e:
+            if attempt == max_retries:
+                raise
+            delay = backoff_delay(attempt, backoff, max_backoff)
+            logger.warning(f"{getattr(fn, '__name__', 'call')} failed ({type(e).__name__}), retrying in {delay:.1f}s")
+            if on_retry:
+                on_retry(e)
+            time.sleep(delay)
+
+
+def item_key(item) -> str:
+    return hashlib.sha256(json.dumps(item, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def load_checkpoint(checkpoint_path: str) -> dict:
+    """Finished results from a JSONL checkpoint, keyed by item key. Failed items are retried."""
+    done = {}
+    if not os.path.exists(checkpoint_path):
+        return done
+    with open(checkpoint_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "error" not in record:
+                done[record["key"]] = record
+    return done
+
+
+def _terminate_torn_line(path: str):
+    # A run killed mid-write leaves a partial last line; start appends on a fresh line
+    if os.path.exists(path) and os.path.getsize(path):
+        with open(path, "rb+") as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+
+def run_batch(items: list, fn, checkpoint_path: str, max_workers=8, rate=None, burst=None, max_retries=5,
+              backoff=1.0, key_fn=item_key, label="items", stage=None, config=None):
+    """
+    Apply `fn` to every item on a thread pool and return the results in input order.
+
+    - `rate` (calls per second, with optional `burst`) is enforced by a shared
+      token bucket across all workers.
+    - Transient API errors are retried with exponential backoff; an item that
+      still fails is recorded with an "error" field and returns None.
+    - Every finished item is appended to the JSONL `checkpoint_path` as it
+      completes, and items already finished there are skipped, so an
+      interrupted run resumes where it stopped.
+    - `config` describes everything besides the item that changes the result
+      (model, prompt template, budgets). It is part of every key, so a
+      checkpoint written under another config is never reused.
+    - Once every item has succeeded the checkpoint is rotated to
+      `<checkpoint>.done`, so resuming only ever covers an interrupted run.
+    - Retries are counted against the tracing `stage` of `fn`, when given.
+    """
+    bucket = TokenBucket(rate, burst) if rate else None
+    tracer = get_tracer()
+    on_retry = (lambda e: tracer.record(stage, retries=1)) if stage else None
+    done = load_checkpoint(checkpoint_path)
+    fingerprint = item_key(config) if config is not None else None
+    keys = [key_fn(item) if fingerprint is None else item_key([fingerprint, key_fn(item)]) for item in items]
+    todo = [(key, item) for key, item in zip(keys, items) if key not in done]
+    todo = list({key: item for key, item in todo}.items())
+    print(f"{len(items) - len(todo)} of {len(items)} {label} already done, running {len(todo)}")
+    if stage:
+        tracer.record(stage, cache_hits=len(items) - len(todo))
+
+    def work(key, item):
+        def call():
+            if bucket:
+                bucket.acquire()
+            return fn(item)
+        try:
+            return {"key": key, "result": call_with_retry(call, max_retries=max_retries, backoff=backoff,
+                                                          on_retry=on_retry)}
+        except Exception as e:
+            logger.error(f"Giving up on {key[:12]}: {e}")
+            return {"key": key, "error": f"{type(e).__name__}: {e}"}
+
+    start = time.perf_counter()
+    failed = 0
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint_path)), exist_ok=True)
+    _terminate_torn_line(checkpoint_path)
+    with open(checkpoint_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(work, key, item) for key, item in todo]
+        for n, future in enumerate(as_completed(futures), start=1):
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            out.flush()
+            if "error" in record:
+                failed += 1
+            else:
+                done[record["key"]] = record
+            if n % 50 == 0 or n == len(futures):
+                elapsed = time.perf_counter() - start
+                print(f"{n}/{len(futures)} {label} in {elapsed:.1f}s ({n / elapsed:.1f}/s, {failed} failed)")
+
+    if all(key in done for key in keys) and os.path.exists(checkpoint_path):
+        os.replace(checkpoint_path, f"{checkpoint_path}.done")
+    return [done[key]["result"] if key in done else None for key in keys]
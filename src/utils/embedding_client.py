@@ -0,0 +1,154 @@
+import os
+import hashlib
+import logging
+import threading
+import numpy as np
+import dotenv
+from concurrent.futures import ThreadPoolExecutor
+from litellm import embedding
+from src.utils.batch_runner import call_with_retry
+from src.utils.tracing import span
+from src.utils.sqlite_store import SQLiteStore
+from src.utils.llm_backend import get_backend, embedding_request
+
+dotenv.load_dotenv(override = False)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "azure.text-embedding-3-large"
+DEFAULT_DIMENSIONS = 1024
+DEFAULT_CACHE_PATH = "/Users/pagrawal140/document-insights-prototype/output/embedding_cache.sqlite"
+
+
+class EmbeddingCache(SQLiteStore):
+    """Persistent embedding cache in SQLite, keyed by a hash of (model, dimensions, text)."""
+
+    table = "embeddings"
+    columns = (("vector", "BLOB NOT NULL"),)
+
+    def encode(self, vector) -> tuple:
+        return (np.asarray(vector, dtype=np.float32).tobytes(),)
+
+    def decode(self, vector) -> np.ndarray:
+        return np.frombuffer(vector, dtype=np.float32)
+
+
+class EmbeddingClient:
+    """
+    Single entry point for embedding text.
+
+    Unique, uncached texts are packed `batch_size` per request and the requests
+    run on a pool of `max_workers` threads. Rate limits and transient API
+    errors are retried with exponential backoff and jitter. Results are stored
+    in the persistent cache so an unchanged chunk or a repeated question is
+    never sent twice.
+
+    `api_base` can point at any OpenAI compatible endpoint, including the local
+    fake in src/utils/fake_endpoint.py. Requests go through the LLM_BACKEND
+    (src/utils/llm_backend.py) for recording, replay or synthetic responses.
+    """
+
+    def __init__(self, model=DEFAULT_MODEL, dimensions=DEFAULT_DIMENSIONS, api_key=None, api_base=None,
+                 batch_size=64, max_workers=4, max_retries=6, backoff=1.0, max_backoff=60.0,
+                 cache_path=DEFAULT_CACHE_PATH):
+        self.model = model
+        self.dimensions = dimensions
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY")
+        self.api_base = api_base or os.getenv("OPENAI_API_BASE")
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self.stats = {"requests": 0, "retries": 0, "cache_hits": 0, "embedded": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, stat: str, n=1):
+        with self._stats_lock:
+            self.stats[stat] += n
+
+    def cache_key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}|{self.dimensions}|{text}".encode("utf-8")).hexdigest()
+
+    def _request(self, texts: list, trace=None) -> list:
+        requests = [embedding_request(self.model, self.dimensions, text) for text in texts]
+        response = get_backend().embed(requests, lambda: embedding(
+            input=texts,
+            model=f"openai/{self.model}",
+            api_key=self.api_key,
+            api_base=self.api_base,
+            dimensions=self.dimensions,
+            max_retries=0,  # retries are handled here so backoff and accounting are in one place
+        ))
+        if trace is not None:
+            usage = response.get('usage') or {}
+            trace.add(prompt_tokens=usage.get('prompt_tokens', 0), bytes=sum(len(t.encode("utf-8")) for t in texts))
+        data = sorted(response['data'], key=lambda item: item['index'])
+        return [item['embedding'] for item in data]
+
+    def _request_with_retry(self, texts: list, trace=None) -> list:
+        def request():
+            self._count("requests")
+            return self._request(texts, trace)
+
+        def on_retry(e):
+            self._count("retries")
+            if trace is not None:
+                trace.add(retries=1)
+        return call_with_retry(request, max_retries=self.max_retries, backoff=self.backoff,
+                               max_backoff=self.max_backoff, on_retry=on_retry)
+
+    def embed(self, texts: list) -> np.ndarray:
+        """Embed `texts` and return a float32 matrix with one row per input, in order."""
+        if isinstance(texts, str):
+            texts = [texts]
+        with span("embed", items=len(texts), backend=get_backend().mode) as trace:
+            return self._embed(texts, trace)
+
+    def _embed(self, texts: list, trace) -> np.ndarray:
+        keys = [self.cache_key(t) for t in texts]
+        vectors = self.cache.get_many(list(set(keys))) if self.cache else {}
+        hits = sum(1 for k in keys if k in vectors)
+        self._count("cache_hits", hits)
+        trace.add(cache_hits=hits)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing.setdefault(key, text)
+        if missing:
+            missing_keys = list(missing)
+            batches = [missing_keys[i:i + self.batch_size] for i in range(0, len(missing_keys), self.batch_size)]
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                for batch, result in zip(batches, pool.map(
+                        lambda b: self._request_with_retry([missing[k] for k in b], trace), batches)):
+                    new_vectors = {k: np.asarray(v, dtype=np.float32) for k, v in zip(batch, result)}
+                    vectors.update(new_vectors)
+                    if self.cache:
+                        self.cache.put_many(new_vectors)
+            self._count("embedded", len(missing))
+
+        if not keys:
+            return np.empty((0, self.dimensions), dtype=np.float32)
+        return np.stack([vectors[k] for k in keys])
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def get_client() -> EmbeddingClient:
+    """Process-wide client configured from the environment."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = EmbeddingClient(
+                batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", 64)),
+                max_workers=int(os.getenv("EMBEDDING_MAX_WORKERS", 4)),
+                cache_path=os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_CACHE_PATH),
+            )
+        return _default_client
+
+
+def embed_texts(texts: list) -> np.ndarray:
+    return get_client().embed(texts)
@@ -0,0 +1,152 @@
+import json
+import time
+import hashlib
+import threading
+import numpy as np
+from http.server import BaseHTTPRequestHandler
+from src.utils.http_server import ConcurrentHTTPServer
+
+
+class FakeOpenAIServer:
+    """
+    Local stand-in for an OpenAI compatible API, for exercising clients offline.
+
+    POST /embeddings returns deterministic pseudo-random unit vectors derived
+    from each input's hash; POST /chat/completions echoes the tail of the last
+    user message, as server-sent events one word at a time (`token_latency`
+    seconds apart) when the request asks to stream. `rate_limit_every=n`
+    answers every n-th request with HTTP 429 and `latency` adds a fixed delay
+    in seconds, so retry and concurrency paths can be exercised.
+
+    Use it as a context manager or call start() and stop(), and point clients
+    at `server.base_url`.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, rate_limit_every=0, token_latency=0.0):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.rate_limit_every = rate_limit_every
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = ConcurrentHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _record(self, path: str, body: dict) -> int:
+        with self._lock:
+            self.requests.append((path, body))
+            return len(self.requests)
+
+    def _handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: dict):
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_stream(self, response: dict):
+                # Server-sent events, one word per chunk, like a streaming completion
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                words = response["choices"][0]["message"]["content"].split(" ")
+                for i, word in enumerate(words):
+                    chunk = {
+                        "id": response["id"], "object": "chat.completion.chunk", "created": response["created"],
+                        "model": response["model"],
+                        "choices": [{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                     "finish_reason": None}],
+                    }
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    if fake.token_latency:
+                        time.sleep(fake.token_latency)
+                done = {"id": response["id"], "object": "chat.completion.chunk", "created": response["created"],
+                        "model": response["model"], "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+                self.wfile.write(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                count = fake._record(self.path, body)
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if fake.rate_limit_every and count % fake.rate_limit_every == 0:
+                    self._send(429, {"error": {"message": "Rate limit exceeded", "type": "rate_limit_error"}})
+                elif self.path.endswith("/embeddings"):
+                    self._send(200, fake_embedding_response(body))
+                elif self.path.endswith("/chat/completions") and body.get("stream"):
+                    self._send_stream(fake_chat_response(body))
+                elif self.path.endswith("/chat/completions"):
+                    self._send(200, fake_chat_response(body))
+                else:
+                    self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+        return Handler
+
+
+def fake_vector(text: str, dimensions: int) -> list:
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def fake_embedding_response(body: dict) -> dict:
+    inputs = body.get("input", [])
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    dimensions = body.get("dimensions") or 1024
+    return {
+        "object": "list",
+        "model": body.get("model", "fake-embedding"),
+        "data": [
+            {"object": "embedding", "index": i, "embedding": fake_vector(text, dimensions)}
+            for i, text in enumerate(inputs)
+        ],
+        "usage": {"prompt_tokens": sum(len(t.split()) for t in inputs), "total_tokens": sum(len(t.split()) for t in inputs)},
+    }
+
+
+def fake_chat_response(body: dict) -> dict:
+    content = body.get("messages", [{}])[-1].get("content", "")
+    if not isinstance(content, str):
+        content = " ".join(part.get("text", "") for part in content if part.get("type") == "text")
+    answer = f"Fake answer based on: {content[-200:]}"
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake-chat"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": len(content.split()), "completion_tokens": len(answer.split()),
+                  "total_tokens": len(content.split()) + len(answer.split())},
+    }
@@ -0,0 +1,9 @@
+from http.server import ThreadingHTTPServer
+
+
+class ConcurrentHTTPServer(ThreadingHTTPServer):
+    """Threaded HTTP server for the local service and the fake endpoint."""
+
+    # The stdlib default backlog of 5 resets connections under concurrent load
+    request_queue_size = 128
+    daemon_threads = True
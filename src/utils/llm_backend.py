@@ -0,0 +1,420 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import logging
+import threading
+import numpy as np
+import dotenv
+from litellm import ModelResponse
+from litellm.exceptions import RateLimitError
+from litellm.types.utils import ModelResponseStream
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from src.utils.batch_runner import TokenBucket
+from src.utils.fake_endpoint import fake_vector, fake_chat_response
+from src.utils.sqlite_store import SQLiteStore
+
+dotenv.load_dotenv(override = False)
+logger = logging.getLogger(__name__)
+
+DEFAULT_RECORDINGS_PATH = "/Users/pagrawal140/document-insights-prototype/output/llm_recordings.sqlite"
+
+
+class ReplayMissError(LookupError):
+    """A request that has no recording, in replay mode."""
+
+
+def request_key(kind: str, request: dict) -> str:
+    """Content hash of a request: everything that can change the response, and nothing else."""
+    return hashlib.sha256(json.dumps([kind, request], sort_keys=True, ensure_ascii=False, default=str)
+                          .encode("utf-8")).hexdigest()
+
+
+def chat_request(model, messages, **params) -> dict:
+    return {"model": model, "messages": messages, **{k: v for k, v in params.items() if v is not None}}
+
+
+def embedding_request(model, dimensions, text: str) -> dict:
+    # Embeddings are keyed per text, so a recording replays under any batch size
+    return {"model": model, "dimensions": dimensions, "input": text}
+
+
+def _words(text: str) -> int:
+    return len(text.split())
+
+
+def _response_dict(response) -> dict:
+    return response if isinstance(response, dict) else response.model_dump()
+
+
+def _stream_chunks(response: dict, sleep_per_chunk=0.0):
+    """A stored chat response as litellm stream chunks: one per word, then a usage chunk."""
+    content = response["choices"][0]["message"]["content"] or ""
+    head = {"id": response.get("id", "chatcmpl-replay"), "created": response.get("created", 0),
+            "model": response.get("model", "")}
+    for i, word in enumerate(content.split(" ")):
+        if sleep_per_chunk:
+            time.sleep(sleep_per_chunk)
+        yield ModelResponseStream(**head, choices=[{"index": 0, "delta": {"content": word if i == 0 else " " + word},
+                                                    "finish_reason": None}])
+    yield ModelResponseStream(**head, choices=[], usage=response.get("usage"))
+
+
+class RecordingStore(SQLiteStore):
+    """
+    Request/response pairs in SQLite, keyed by `request_key`. Values are
+    (kind, response, seconds), with the live call's wall time; `get_many`
+    returns (response, seconds).
+    """
+
+    table = "recordings"
+    columns = (("kind", "TEXT NOT NULL"), ("response", "TEXT NOT NULL"), ("seconds", "REAL NOT NULL"))
+
+    def encode(self, value) -> tuple:
+        kind, response, seconds = value
+        return kind, json.dumps(response, default=str), float(seconds)
+
+    def decode(self, kind, response, seconds) -> tuple:
+        return json.loads(response), seconds
+
+    def counts(self) -> dict:
+        return dict(self.query(f"SELECT kind, COUNT(*) FROM {self.table} GROUP BY kind"))
+
+
+class LatencyModel:
+    """
+    Synthetic latency: a draw from `distribution` plus `per_token` seconds per
+    token. `mean` and `spread` mean:
+      fixed        mean
+      uniform      mean +/- spread
+      normal       mean, standard deviation spread (clipped at 0)
+      lognormal    median mean, shape (sigma) spread -- a long right tail
+      exponential  mean
+    """
+
+    DISTRIBUTIONS = ("fixed", "uniform", "normal", "lognormal", "exponential")
+
+    def __init__(self, distribution="fixed", mean=0.0, spread=0.0, per_token=0.0, seed=None):
+        if distribution not in self.DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {distribution!r}, expected one of {self.DISTRIBUTIONS}")
+        self.distribution = distribution
+        self.mean = mean
+        self.spread = spread
+        self.per_token = per_token
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def parse(cls, spec: str, seed=None) -> "LatencyModel":
+        """From "distribution:mean,spread,per_token", e.g. "lognormal:0.8,0.5,0.002" or "fixed:0.05"."""
+        if not spec:
+            return cls(seed=seed)
+        distribution, _, params = spec.partition(":")
+        values = [float(v) for v in params.split(",") if v.strip()]
+        return cls(distribution.strip(), *values, seed=seed)
+
+    def sample(self) -> float:
+        with self._lock:
+            if self.distribution == "uniform":
+                value = self._rng.uniform(self.mean - self.spread, self.mean + self.spread)
+            elif self.distribution == "normal":
+                value = self._rng.normal(self.mean, self.spread)
+            elif self.distribution == "lognormal":
+                value = self.mean * self._rng.lognormal(0.0, self.spread)
+            elif self.distribution == "exponential":
+                value = self._rng.exponential(self.mean)
+            else:
+                value = self.mean
+        return max(0.0, float(value))
+
+
+class LiveBackend:
+    """Calls the API. `call` is the litellm call the request describes."""
+
+    mode = "live"
+
+    def chat(self, request: dict, call):
+        return call()
+
+    def chat_stream(self, request: dict, call):
+        return call()
+
+    def embed(self, requests: list, call) -> dict:
+        return call()
+
+
+class RecordBackend(LiveBackend):
+    """Calls the API and stores every response under its request's content hash."""
+
+    mode = "record"
+
+    def __init__(self, store: RecordingStore):
+        self.store = store
+
+    def chat(self, request: dict, call):
+        started = time.perf_counter()
+        response = call()
+        self.store.put_many({request_key("chat", request): ("chat", _response_dict(response),
+                                                            time.perf_counter() - started)})
+        return response
+
+    def chat_stream(self, request: dict, call):
+        started = time.perf_counter()
+        deltas, usage, head = [], None, {}
+        for chunk in call():
+            head = head or {"id": chunk.id, "created": chunk.created, "model": chunk.model}
+            usage = getattr(chunk, "usage", None) or usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                deltas.append(chunk.choices[0].delta.content)
+            yield chunk
+        # Only a stream that ran to the end is recorded
+        content = "".join(deltas)
+        response = {**head, "object": "chat.completion",
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                                 "finish_reason": "stop"}],
+                    "usage": _response_dict(usage) if usage else {"completion_tokens": len(deltas)}}
+        self.store.put_many({request_key("chat", request): ("chat", response, time.perf_counter() - started)})
+
+    def embed(self, requests: list, call) -> dict:
+        started = time.perf_counter()
+        response = call()
+        seconds = (time.perf_counter() - started) / max(1, len(requests))
+        data = sorted(response['data'], key=lambda item: item['index'])
+        self.store.put_many({request_key("embedding", request): ("embedding", {"embedding": item['embedding']}, seconds)
+                             for request, item in zip(requests, data)})
+        return response
+
+
+class ReplayBackend(LiveBackend):
+    """
+    Serves recorded responses and never calls the API; a request without a
+    recording raises ReplayMissError. `speed` replays the recorded wall time
+    scaled by that factor (0 answers at once, 1 at the recorded pace).
+    """
+
+    mode = "replay"
+
+    def __init__(self, store: RecordingStore, speed=0.0):
+        self.store = store
+        self.speed = speed
+
+    def _lookup(self, kind: str, requests: list) -> list:
+        keys = [request_key(kind, request) for request in requests]
+        found = self.store.get_many(list(set(keys)))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            raise ReplayMissError(f"No recording for {len(missing)} {kind} request(s) (first {missing[0][:12]}); "
+                                  f"record them with LLM_BACKEND=record")
+        return [found[key] for key in keys]
+
+    def chat(self, request: dict, call):
+        response, seconds = self._lookup("chat", [request])[0]
+        if self.speed:
+            time.sleep(seconds * self.speed)
+        return ModelResponse(**response)
+
+    def chat_stream(self, request: dict, call):
+        response, seconds = self._lookup("chat", [request])[0]
+        words = len((response["choices"][0]["message"]["content"] or "").split(" "))
+        return _stream_chunks(response, seconds * self.speed / words)
+
+    def embed(self, requests: list, call) -> dict:
+        found = self._lookup("embedding", requests)
+        if self.speed:
+            time.sleep(sum(seconds for _, seconds in found) * self.speed)
+        return {"data": [{"index": i, "embedding": response["embedding"]} for i, (response, _) in enumerate(found)],
+                "usage": {"prompt_tokens": sum(_words(request["input"]) for request in requests)}}
+
+
+class SyntheticBackend(LiveBackend):
+    """
+    Deterministic fake responses (the same ones src/utils/fake_endpoint.py
+    serves) with simulated latency and capacity, in process:
+
+    - `chat_latency` / `embed_latency` are LatencyModels; a streamed answer
+      waits the base draw before its first word and `per_token` between words.
+    - `rps` (requests per second) and `tpm` (tokens per minute) are token
+      buckets shared by all calls, and `concurrency` caps requests in flight.
+    - Over a limit, `on_limit="wait"` queues the call and `"reject"` raises
+      litellm's RateLimitError, as a throttled endpoint would, so the retry
+      paths are exercised too.
+    """
+
+    mode = "synthetic"
+
+    def __init__(self, chat_latency=None, embed_latency=None, rps=None, tpm=None, concurrency=None, on_limit="wait"):
+        if on_limit not in ("wait", "reject"):
+            raise ValueError(f"on_limit must be 'wait' or 'reject', got {on_limit!r}")
+        self.chat_latency = chat_latency or LatencyModel()
+        self.embed_latency = embed_latency or LatencyModel()
+        self.on_limit = on_limit
+        self._requests = TokenBucket(rps) if rps else None
+        self._tokens = TokenBucket(tpm / 60, tpm) if tpm else None
+        self._in_flight = threading.BoundedSemaphore(concurrency) if concurrency else None
+
+    def _admit(self, model: str, tokens: int):
+        """Take a request slot, `tokens` and a concurrency slot, or nothing at all when the call is rejected."""
+        limits = [(bucket, amount) for bucket, amount in
+                  ((self._requests, 1), (self._tokens, min(tokens, self._tokens.capacity) if self._tokens else 0))
+                  if bucket is not None]
+        taken = []
+        try:
+            for bucket, amount in limits:
+                if self.on_limit == "wait":
+                    bucket.acquire(amount)
+                elif not bucket.try_acquire(amount):
+                    raise RateLimitError("Synthetic rate limit exceeded", llm_provider="openai", model=model)
+                taken.append((bucket, amount))
+            if self._in_flight is not None and not self._in_flight.acquire(blocking=self.on_limit == "wait"):
+                raise RateLimitError("Synthetic concurrency limit exceeded", llm_provider="openai", model=model)
+        except RateLimitError:
+            # A rejected call was never served, so it must not use up capacity
+            for bucket, amount in taken:
+                bucket.refund(amount)
+            raise
+
+    def _release(self):
+        if self._in_flight is not None:
+            self._in_flight.release()
+
+    def _chat_response(self, request: dict) -> dict:
+        response = fake_chat_response(request)
+        self._admit(request["model"], response["usage"]["total_tokens"])
+        return response
+
+    def chat(self, request: dict, call):
+        response = self._chat_response(request)
+        try:
+            time.sleep(self.chat_latency.sample() +
+                       self.chat_latency.per_token * response["usage"]["completion_tokens"])
+        finally:
+            self._release()
+        return ModelResponse(**response)
+
+    def chat_stream(self, request: dict, call):
+        response = self._chat_response(request)
+        try:
+            time.sleep(self.chat_latency.sample())
+            yield from _stream_chunks(response, self.chat_latency.per_token)
+        finally:
+            self._release()
+
+    def embed(self, requests: list, call) -> dict:
+        tokens = sum(_words(request["input"]) for request in requests)
+        self._admit(requests[0]["model"] if requests else "", tokens)
+        try:
+            time.sleep(self.embed_latency.sample() + self.embed_latency.per_token * tokens)
+        finally:
+            self._release()
+        return {"data": [{"index": i, "embedding": fake_vector(request["input"], request["dimensions"] or 1024)}
+                         for i, request in enumerate(requests)],
+                "usage": {"prompt_tokens": tokens}}
+
+
+BACKENDS = {cls.mode: cls for cls in (LiveBackend, RecordBackend, ReplayBackend, SyntheticBackend)}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend_from_env():
+    """
+    Backend selected by LLM_BACKEND (live, record, replay or synthetic).
+    Recordings live in LLM_RECORDINGS_PATH; LLM_REPLAY_SPEED scales the
+    recorded latency. The synthetic backend reads LLM_SYNTHETIC_LATENCY and
+    LLM_SYNTHETIC_EMBED_LATENCY (LatencyModel.parse specs), LLM_SYNTHETIC_RPS,
+    LLM_SYNTHETIC_TPM, LLM_SYNTHETIC_CONCURRENCY, LLM_SYNTHETIC_ON_LIMIT and
+    LLM_SYNTHETIC_SEED.
+    """
+    mode = os.getenv("LLM_BACKEND", "live")
+    if mode not in BACKENDS:
+        raise ValueError(f"Unknown LLM_BACKEND {mode!r}, expected one of {list(BACKENDS)}")
+    if mode in ("record", "replay"):
+        store = RecordingStore(os.getenv("LLM_RECORDINGS_PATH", DEFAULT_RECORDINGS_PATH))
+        if mode == "record":
+            return RecordBackend(store)
+        return ReplayBackend(store, speed=float(os.getenv("LLM_REPLAY_SPEED", 0)))
+    if mode == "synthetic":
+        seed = int(os.getenv("LLM_SYNTHETIC_SEED", 0))
+
+        def limit(name):
+            return float(os.getenv(name)) if os.getenv(name) else None
+        return SyntheticBackend(
+            chat_latency=LatencyModel.parse(os.getenv("LLM_SYNTHETIC_LATENCY", ""), seed=seed),
+            embed_latency=LatencyModel.parse(os.getenv("LLM_SYNTHETIC_EMBED_LATENCY", ""), seed=seed + 1),
+            rps=limit("LLM_SYNTHETIC_RPS"),
+            tpm=limit("LLM_SYNTHETIC_TPM"),
+            concurrency=int(os.getenv("LLM_SYNTHETIC_CONCURRENCY", 0)) or None,
+            on_limit=os.getenv("LLM_SYNTHETIC_ON_LIMIT", "wait"),
+        )
+    return LiveBackend()
+
+
+def get_backend():
+    """Process-wide backend, configured from the environment on first use."""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = backend_from_env()
+            if _backend.mode != "live":
+                logger.info(f"LLM and embedding calls go to the {_backend.mode} backend")
+        return _backend
+
+
+def set_backend(backend):
+    """Install `backend` for this process (None re-reads the environment on next use); returns the previous one."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+
+if __name__ == "__main__":
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+    # The calls below use the module-level backend of the imported module, not of this script
+    from src.utils.llm_backend import get_backend
+    from src.utils.llm_call import get_chat_completion
+    from src.utils.embedding_client import EmbeddingClient
+
+    parser = argparse.ArgumentParser(description="Drive concurrent chat and embedding calls through the configured "
+                                                 "LLM_BACKEND and report latency percentiles")
+    parser.add_argument("--calls", type=int, default=100)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--stream", action="store_true")
+    parser.add_argument("--stats", action="store_true", help="Only print the number of recordings per kind")
+    args = parser.parse_args()
+
+    if args.stats:
+        print(RecordingStore(os.getenv("LLM_RECORDINGS_PATH", DEFAULT_RECORDINGS_PATH)).counts())
+        raise SystemExit
+
+    def timed(fn, *fn_args):
+        started = time.perf_counter()
+        try:
+            result = fn(*fn_args)
+            if args.stream:
+                result = "".join(result)
+        except RateLimitError:
+            return None
+        return time.perf_counter() - started
+
+    questions = [f"Question {i}: what does section {i % 17} of the travel policy say?" for i in range(args.calls)]
+    client = EmbeddingClient(batch_size=16, max_workers=args.workers, cache_path=None)
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        started = time.perf_counter()
+        chat = list(pool.map(lambda q: timed(get_chat_completion, [{"role": "user", "content": q}], "", args.stream),
+                             questions))
+        chat_wall = time.perf_counter() - started
+    started = time.perf_counter()
+    client.embed(questions)
+    embed_wall = time.perf_counter() - started
+
+    served = [seconds for seconds in chat if seconds is not None]
+    p50, p95, p99 = np.percentile(served, [50, 95, 99]) if served else (np.nan,) * 3
+    print(f"{get_backend().mode} backend: {len(served)} of {args.calls} chat calls served in {chat_wall:.2f}s "
+          f"({len(served) / chat_wall:.1f}/s, {args.calls - len(served)} rate limited), "
+          f"p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms, p99 {p99 * 1000:.0f} ms")
+    print(f"{args.calls} texts embedded in {embed_wall:.2f}s ({client.stats['requests']} requests, "
+          f"{client.stats['retries']} retries)")
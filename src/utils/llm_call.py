@@ -2,9 +2,12 @@ import os
 import dotenv
 import logging
 
-from litellm import completion, embedding
+from litellm import completion
+from src.utils.embedding_client import embed_texts
+from src.utils.tracing import span, redact, payload_bytes
+from src.utils.llm_backend import get_backend, chat_request
 
-dotenv.load_dotenv(override = True)
+dotenv.load_dotenv(override = False)
 logger = logging.getLogger(__name__)
 
 api_key = os.getenv("OPENAI_API_KEY")
@@ -13,35 +16,83 @@ model = os.getenv("MODEL")
 max_tokens = os.getenv("MAX_TOKENS")
 temperature = os.getenv("TEMPERATURE")
 
-def get_chat_completion(chat_history, context=""):
-    logger.info(f"chat_history: {chat_history}")
+def model_config() -> dict:
+    """Model settings that change a completion, for keying cached or checkpointed results."""
+    return {"model": model, "max_tokens": max_tokens, "temperature": temperature}
+
+def get_chat_completion(chat_history, context="", stream=False, stage="generate"):
+    """
+    Chat completion for `chat_history`. With `stream=True` this returns an
+    iterator of text deltas as the model produces them instead of the full
+    response object.
+
+    Each call is traced under `stage` (e.g. "ocr", "generate", "judge") with
+    its request size and token usage. The payload is only logged at DEBUG,
+    with page images redacted.
+
+    The call goes through the LLM_BACKEND (src/utils/llm_backend.py), which
+    can record it, replay it from a recording or answer it synthetically.
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"chat_history: {redact(chat_history)}")
     model_kwargs = {
         "max_tokens": max_tokens,
         "temperature": temperature
     }
-    response = completion(
-        model=f"openai/{model}",
-        messages=chat_history,
-        base_url=base,
-        api_key=api_key,
-        **model_kwargs
-    )
+    if stream:
+        return _iter_deltas(chat_history, stage, model_kwargs)
+    backend = get_backend()
+    with span(stage, bytes=payload_bytes(chat_history), backend=backend.mode) as s:
+        response = backend.chat(chat_request(model, chat_history, **model_kwargs), lambda: completion(
+            model=f"openai/{model}",
+            messages=chat_history,
+            base_url=base,
+            api_key=api_key,
+            **model_kwargs
+        ))
+        _add_usage(s, getattr(response, "usage", None))
     return response
 
+def _add_usage(s, usage):
+    if usage:
+        s.add(prompt_tokens=getattr(usage, "prompt_tokens", 0), completion_tokens=getattr(usage, "completion_tokens", 0))
+
+def _iter_deltas(chat_history, stage, model_kwargs):
+    # The span covers the whole stream, so its time is time-to-last-token
+    backend = get_backend()
+    with span(stage, bytes=payload_bytes(chat_history), stream=True, backend=backend.mode) as s:
+        response = backend.chat_stream(chat_request(model, chat_history, **model_kwargs), lambda: completion(
+            model=f"openai/{model}",
+            messages=chat_history,
+            base_url=base,
+            api_key=api_key,
+            stream=True,
+            stream_options={"include_usage": True},
+            **model_kwargs
+        ))
+        usage, deltas = None, 0
+        for chunk in response:
+            usage = getattr(chunk, "usage", None) or usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                deltas += 1
+                yield delta
+        # Without a usage chunk from the endpoint, one streamed delta is roughly one token
+        if usage:
+            _add_usage(s, usage)
+        else:
+            s.add(completion_tokens=deltas)
+
 def get_embeddings(text):
-    model_name = "azure.text-embedding-3-large" 
-    
-    model_kwargs = {"dimensions": 1024}
-    
-    response = embedding( 
-        input=text, 
-        model=f"openai/{model_name}",
-        api_key=api_key,
-        api_base=base,
-        **model_kwargs
-    )
-    
-    return response
+    """
+    Embedding response in the litellm shape (`['data'][i]['embedding']`) for a
+    text or list of texts, served through the shared batched, cached client.
+    """
+    texts = [text] if isinstance(text, str) else list(text)
+    vectors = embed_texts(texts)
+    return {"data": [{"index": i, "embedding": v.tolist()} for i, v in enumerate(vectors)]}
 
 # if __name__ == "__main__":
 #     print(get_chat_completion([{"role" : "user", "content" : "Hi"}]))
@@ -0,0 +1,59 @@
+import os
+import sqlite3
+import threading
+
+
+class SQLiteStore:
+    """
+    Thread-safe SQLite table keyed by `key TEXT PRIMARY KEY`, read and written
+    in batches. Subclasses set `table` and `columns` (name, SQL type) and can
+    override `encode`/`decode` to convert values to and from column tuples;
+    by default a single column is stored as is.
+    """
+
+    table = None
+    columns = ()
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} (key TEXT PRIMARY KEY, "
+                           f"{', '.join(f'{name} {kind}' for name, kind in self.columns)})")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def encode(self, value) -> tuple:
+        return (value,)
+
+    def decode(self, *values):
+        return values[0]
+
+    def get_many(self, keys: list) -> dict:
+        names = ", ".join(name for name, _ in self.columns)
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, {names} FROM {self.table} WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update({key: self.decode(*values) for key, *values in rows})
+        return found
+
+    def put_many(self, items: dict):
+        placeholders = ", ".join("?" * (len(self.columns) + 1))
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, {', '.join(name for name, _ in self.columns)}) "
+                f"VALUES ({placeholders})",
+                [(key, *self.encode(value)) for key, value in items.items()],
+            )
+            self._conn.commit()
+
+    def query(self, sql: str, params=()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,169 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = "docinsights"
+COUNTERS = ("calls", "errors", "bytes", "prompt_tokens", "completion_tokens", "cache_hits", "retries", "items")
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+DATA_URL = re.compile(r"data:(?P<mime>[\w/+.-]+);base64,(?P<data>[A-Za-z0-9+/=]+)")
+
+
+class Span:
+    """Counters for one timed stage call; `add` is thread-safe so pool workers can report into it."""
+
+    def __init__(self, stage: str, fields: dict):
+        self.stage = stage
+        self.fields = dict(fields)
+        self._lock = threading.Lock()
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.fields[name] = self.fields.get(name, 0) + (value or 0)
+
+
+class Tracer:
+    """
+    Per-stage metrics for the pipeline (render, ocr, post_process, chunk,
+    embed, retrieve, prompt_build, generate, ...).
+
+    Each `span` records its wall time plus whatever counters the stage adds
+    (bytes, prompt/completion tokens, cache hits, retries, items). Finished
+    spans are logged as one JSON object per line and folded into running
+    totals and a latency histogram per stage, which `prometheus_text` renders
+    in the Prometheus text exposition format.
+    """
+
+    def __init__(self, log_spans=True):
+        self.log_spans = log_spans
+        self.totals = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, stage: str, **fields):
+        span = Span(stage, fields)
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.add(errors=1)
+            span.fields["error"] = type(e).__name__
+            raise
+        finally:
+            self._finish(span, time.perf_counter() - start)
+
+    def record(self, stage: str, seconds=None, **fields):
+        """Record a stage whose timing was measured elsewhere, or a bare counter update when `seconds` is None."""
+        self._finish(Span(stage, fields), seconds)
+
+    def _finish(self, span: Span, seconds):
+        with self._lock:
+            stage = self.totals.setdefault(span.stage, {
+                "seconds": 0.0, "buckets": [0] * len(SECONDS_BUCKETS), **{name: 0 for name in COUNTERS}})
+            if seconds is not None:
+                stage["calls"] += 1
+                stage["seconds"] += seconds
+                for i, bound in enumerate(SECONDS_BUCKETS):
+                    if seconds <= bound:
+                        stage["buckets"][i] += 1
+            for name in COUNTERS:
+                if isinstance(span.fields.get(name), (int, float)):
+                    stage[name] += span.fields[name]
+        if self.log_spans and logger.isEnabledFor(logging.INFO):
+            event = {"stage": span.stage, **({"seconds": round(seconds, 6)} if seconds is not None else {}),
+                     **span.fields}
+            logger.info(json.dumps(event, default=str))
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {stage: {**values, "buckets": list(values["buckets"])} for stage, values in self.totals.items()}
+
+    def merge(self, snapshot: dict):
+        """Fold another tracer's `snapshot` (e.g. from a worker process) into the totals."""
+        with self._lock:
+            for name, values in snapshot.items():
+                stage = self.totals.setdefault(name, {
+                    "seconds": 0.0, "buckets": [0] * len(SECONDS_BUCKETS), **{c: 0 for c in COUNTERS}})
+                stage["seconds"] += values["seconds"]
+                stage["buckets"] = [a + b for a, b in zip(stage["buckets"], values["buckets"])]
+                for counter in COUNTERS:
+                    stage[counter] += values.get(counter, 0)
+
+    def reset(self):
+        with self._lock:
+            self.totals.clear()
+
+    def prometheus_text(self) -> str:
+        """Totals in the Prometheus text format: counters per stage and a wall-time histogram."""
+        totals = self.snapshot()
+        lines = [f"# HELP {METRIC_PREFIX}_stage_seconds Wall time per pipeline stage call.",
+                 f"# TYPE {METRIC_PREFIX}_stage_seconds histogram"]
+        for stage, values in sorted(totals.items()):
+            # Buckets are already cumulative: a call counts towards every bound it falls under
+            for bound, count in zip(SECONDS_BUCKETS, values["buckets"]):
+                lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {values["calls"]}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {values["seconds"]:.6f}')
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} {values["calls"]}')
+        for name in COUNTERS:
+            lines += [f"# HELP {METRIC_PREFIX}_stage_{name}_total {name.replace('_', ' ').capitalize()} per pipeline stage.",
+                      f"# TYPE {METRIC_PREFIX}_stage_{name}_total counter"]
+            lines += [f'{METRIC_PREFIX}_stage_{name}_total{{stage="{stage}"}} {values[name]}'
+                      for stage, values in sorted(totals.items())]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str):
+        """Write `prometheus_text` atomically, e.g. for node_exporter's textfile collector."""
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    """Process-wide tracer shared by every stage."""
+    return _tracer
+
+
+def span(stage: str, **fields):
+    return _tracer.span(stage, **fields)
+
+
+def record(stage: str, seconds=None, **fields):
+    _tracer.record(stage, seconds, **fields)
+
+
+def _redact_string(text: str, max_chars: int) -> str:
+    text = DATA_URL.sub(lambda m: f"<{m['mime']} base64, {len(m['data'])} chars>", text)
+    if max_chars and len(text) > max_chars:
+        return f"{text[:max_chars]}... <{len(text) - max_chars} more chars>"
+    return text
+
+
+def redact(payload, max_chars=500):
+    """
+    Copy of a chat payload that is safe to log: base64 data URLs (page images)
+    become a short placeholder with their size and long strings are cut to
+    `max_chars`.
+    """
+    if isinstance(payload, str):
+        return _redact_string(payload, max_chars)
+    if isinstance(payload, dict):
+        return {key: redact(value, max_chars) for key, value in payload.items()}
+    if isinstance(payload, (list, tuple)):
+        return [redact(value, max_chars) for value in payload]
+    return payload
+
+
+def payload_bytes(messages) -> int:
+    """Approximate request size of chat messages (JSON encoded)."""
+    return len(json.dumps(messages, default=str).encode("utf-8"))
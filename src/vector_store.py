@@ -0,0 +1,438 @@
+import os
+import sys
+import glob
+import json
+import hashlib
+import time
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.metadata_index import MetadataIndex
+
+FORMAT_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+CHUNKS_DIR = "chunks"
+LEGACY_CHUNKS_FILE = "chunks.parquet"
+EMBEDDING_FILES = {"float32": "embeddings.f32", "float16": "embeddings.f16"}
+ROW_GROUP_SIZE = 4096
+CHUNK_COLUMNS = ("chunk_id", "source", "topic", "page", "chunk_text")
+CHUNK_SCHEMA = pa.schema([
+    ("chunk_id", pa.int64()),
+    ("source", pa.dictionary(pa.int32(), pa.string())),
+    ("topic", pa.dictionary(pa.int32(), pa.string())),
+    ("page", pa.int32()),
+    ("chunk_text", pa.string()),
+])
+
+
+def chunk_frame(chunks: pd.DataFrame) -> pd.DataFrame:
+    """
+    Chunk rows as typed columns (CHUNK_COLUMNS). Frames in the older layout,
+    chunk_text plus a JSON `metadata` string per row, are decoded once here.
+    """
+    if "metadata" in chunks.columns and "source" not in chunks.columns:
+        metadata = [json.loads(m) if isinstance(m, str) else (m or {}) for m in chunks["metadata"]]
+        chunks = pd.DataFrame({
+            "chunk_id": [m.get("chunk_id", -1) for m in metadata],
+            "source": [m.get("source", "") for m in metadata],
+            "topic": [m.get("topic", "") for m in metadata],
+            "page": [m.get("page", -1) for m in metadata],
+            "chunk_text": chunks["chunk_text"].to_numpy(),
+        })
+    return pd.DataFrame({
+        "chunk_id": pd.to_numeric(chunks["chunk_id"], errors="coerce").fillna(-1).astype(np.int64).to_numpy(),
+        "source": chunks["source"].astype(object).fillna("").astype(str).to_numpy(),
+        "topic": chunks["topic"].astype(object).fillna("").astype(str).to_numpy(),
+        "page": pd.to_numeric(chunks["page"], errors="coerce").fillna(-1).astype(np.int32).to_numpy(),
+        "chunk_text": chunks["chunk_text"].astype(object).fillna("").astype(str).to_numpy(),
+    })
+
+
+def chunk_table(chunks: pd.DataFrame) -> pa.Table:
+    return pa.Table.from_pandas(chunk_frame(chunks), schema=CHUNK_SCHEMA, preserve_index=False)
+
+
+def _to_numpy(column: pa.ChunkedArray) -> np.ndarray:
+    if pa.types.is_dictionary(column.type):
+        column = column.cast(pa.string())
+    if pa.types.is_string(column.type):
+        return np.asarray(column.to_pylist(), dtype=object)
+    return column.to_numpy()
+
+
+class VectorStore:
+    """
+    Versioned on-disk store for the vectorized knowledge base.
+
+    Layout of the store directory:
+        manifest.json    - format version, dtype, shape, KB version and chunk parts
+        embeddings.f32   - contiguous row-major matrix (or embeddings.f16)
+        chunks/*.parquet - typed chunk columns (CHUNK_SCHEMA) in row order,
+                           row groups of ROW_GROUP_SIZE with min/max statistics
+
+    Embeddings are L2-normalized on write and memory-mapped read-only on
+    load, so opening a store does not copy or parse any vectors. Chunk
+    columns are read one at a time on first use, and `take` reads only the
+    row groups holding the requested rows, so scoring never loads chunk_text.
+    """
+
+    def __init__(self, path: str, manifest: dict, embeddings: np.ndarray):
+        self.path = path
+        self.manifest = manifest
+        self.embeddings = embeddings
+        self._matrix = None
+        self._column_sum = None
+        self._columns = {}
+        self._row_groups = None
+        self._metadata_index = None
+
+    def __len__(self):
+        return self.manifest["count"]
+
+    @property
+    def dim(self) -> int:
+        return self.manifest["dim"]
+
+    @property
+    def version(self) -> str:
+        return self.manifest["kb_version"]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """float32 view of the embeddings for BLAS scoring (zero-copy for float32 stores)."""
+        if self._matrix is None:
+            if self.embeddings.dtype == np.float32:
+                self._matrix = self.embeddings
+            else:
+                self._matrix = np.asarray(self.embeddings, dtype=np.float32)
+        return self._matrix
+
+    @property
+    def column_sum(self) -> np.ndarray:
+        """Sum of all rows; `q @ column_sum` is the total similarity mass of a query."""
+        if self._column_sum is None:
+            self._column_sum = self.matrix.sum(axis=0, dtype=np.float64)
+        return self._column_sum
+
+    def _part_paths(self) -> list:
+        return [os.path.join(self.path, part["file"]) for part in self.manifest["parts"]]
+
+    def column(self, name: str) -> np.ndarray:
+        """One chunk column for every row, read from the Parquet parts on first use."""
+        if name not in self._columns:
+            if name not in CHUNK_COLUMNS:
+                raise KeyError(f"Unknown chunk column {name!r}, expected one of {CHUNK_COLUMNS}")
+            tables = [pq.read_table(path, columns=[name]) for path in self._part_paths()]
+            if tables:
+                self._columns[name] = _to_numpy(pa.concat_tables(tables).column(name))
+            else:
+                self._columns[name] = _to_numpy(pa.chunked_array([], CHUNK_SCHEMA.field(name).type))
+        return self._columns[name]
+
+    def columns(self, names=CHUNK_COLUMNS) -> dict:
+        """The named chunk columns as arrays (see `column`)."""
+        return {name: self.column(name) for name in names}
+
+    def take(self, rows, names=CHUNK_COLUMNS) -> dict:
+        """
+        Chunk columns for `rows` only. Columns already loaded are indexed in
+        memory; the rest are read from just the row groups containing `rows`.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        result = {name: self._columns[name][rows] for name in names if name in self._columns}
+        missing = [name for name in names if name not in result]
+        if not missing:
+            return result
+        if not len(rows):
+            return {**result, **{name: self.column(name)[:0] if name in self._columns else
+                                 _to_numpy(pa.chunked_array([], CHUNK_SCHEMA.field(name).type)) for name in missing}}
+        starts, groups = self._row_group_index()
+        group_of = np.searchsorted(starts, rows, side="right") - 1
+        tables, offsets, position = [], {}, 0
+        for group in np.unique(group_of):
+            path, row_group = groups[group]
+            table = pq.ParquetFile(path).read_row_group(row_group, columns=missing)
+            offsets[group] = position
+            position += table.num_rows
+            tables.append(table)
+        table = pa.concat_tables(tables)
+        local = np.array([offsets[g] for g in group_of], dtype=np.int64) + rows - starts[group_of]
+        for name in missing:
+            result[name] = _to_numpy(table.column(name).take(pa.array(local)))
+        return result
+
+    def _row_group_index(self):
+        """Global first row of every row group across the parts, and its (part path, row group)."""
+        if self._row_groups is None:
+            starts, groups, offset = [], [], 0
+            for path in self._part_paths():
+                metadata = pq.ParquetFile(path).metadata
+                for row_group in range(metadata.num_row_groups):
+                    starts.append(offset)
+                    groups.append((path, row_group))
+                    offset += metadata.row_group(row_group).num_rows
+            self._row_groups = (np.array(starts, dtype=np.int64), groups)
+        return self._row_groups
+
+    @property
+    def metadata_index(self) -> MetadataIndex:
+        """Categorical codes and bitmaps over the metadata columns, for filtered search."""
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex(self.columns(("source", "topic", "page")))
+        return self._metadata_index
+
+    @classmethod
+    def open(cls, path: str) -> "VectorStore":
+        manifest = read_manifest(path)
+        if manifest.get("dirty"):
+            raise ValueError(f"Vector store at {path} was left mid-patch; rebuild it")
+        if manifest["format_version"] > FORMAT_VERSION:
+            raise ValueError(
+                f"Vector store at {path} has format version {manifest['format_version']}, "
+                f"this code reads up to {FORMAT_VERSION}"
+            )
+        if manifest["format_version"] < 2:
+            manifest = _upgrade_chunks(path, manifest)
+        rows = sum(part["rows"] for part in manifest["parts"])
+        if rows != manifest["count"]:
+            raise ValueError(f"Vector store at {path} is inconsistent: {rows} chunks for {manifest['count']} vectors")
+        return cls(path, manifest, _map_embeddings(path, manifest))
+
+
+def is_vector_store(path: str) -> bool:
+    return os.path.isfile(os.path.join(path, MANIFEST_FILE))
+
+
+def read_manifest(path: str) -> dict:
+    with open(os.path.join(path, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _write_manifest(path: str, manifest: dict):
+    # Write-then-rename so a reader never sees a half written manifest
+    tmp_path = os.path.join(path, MANIFEST_FILE + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_FILE))
+
+
+def _map_embeddings(path: str, manifest: dict) -> np.ndarray:
+    shape = (manifest["count"], manifest["dim"])
+    if manifest["count"] == 0:
+        return np.empty(shape, dtype=manifest["dtype"])
+    return np.memmap(
+        os.path.join(path, EMBEDDING_FILES[manifest["dtype"]]),
+        dtype=manifest["dtype"],
+        mode="r",
+        shape=shape,
+    )
+
+
+def normalize_rows(embeddings: np.ndarray) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim == 1:
+        embeddings = embeddings.reshape(1, -1)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def kb_fingerprint(embeddings: np.ndarray, chunks: pd.DataFrame) -> str:
+    """Content hash identifying one version of the KB (used for cache invalidation)."""
+    digest = hashlib.sha256()
+    digest.update(np.ascontiguousarray(embeddings).tobytes())
+    digest.update(pd.util.hash_pandas_object(chunks, index=False).values.tobytes())
+    return digest.hexdigest()[:16]
+
+
+def _write_part(path: str, number: int, table: pa.Table) -> dict:
+    """Write one chunk part; pyarrow records min/max statistics for every row group."""
+    name = os.path.join(CHUNKS_DIR, f"part-{number:06d}.parquet")
+    os.makedirs(os.path.join(path, CHUNKS_DIR), exist_ok=True)
+    pq.write_table(table.cast(CHUNK_SCHEMA), os.path.join(path, name), row_group_size=ROW_GROUP_SIZE,
+                   write_statistics=True)
+    return {"file": name, "rows": table.num_rows}
+
+
+def _upgrade_chunks(path: str, manifest: dict) -> dict:
+    """Rewrite a format 1 store's chunks.parquet (JSON metadata strings) as typed parts; vectors are untouched."""
+    legacy_path = os.path.join(path, LEGACY_CHUNKS_FILE)
+    part = _write_part(path, 0, chunk_table(pd.read_parquet(legacy_path)))
+    manifest = {**manifest, "format_version": FORMAT_VERSION, "parts": [part], "next_part": 1}
+    _write_manifest(path, manifest)
+    os.remove(legacy_path)
+    return manifest
+
+
+def write_vector_store(path: str, embeddings: np.ndarray, chunks: pd.DataFrame, dtype: str = "float32",
+                       normalize=True) -> VectorStore:
+    """
+    Write embeddings and their chunk rows as a new vector store at `path`.
+    `normalize=False` writes rows taken from another store bit for bit.
+    """
+    if dtype not in EMBEDDING_FILES:
+        raise ValueError(f"Unsupported dtype {dtype}, expected one of {list(EMBEDDING_FILES)}")
+    embeddings = (normalize_rows(embeddings) if normalize else np.asarray(embeddings)).astype(dtype, copy=False)
+    if len(embeddings) != len(chunks):
+        raise ValueError(f"Got {len(embeddings)} embeddings for {len(chunks)} chunks")
+
+    os.makedirs(path, exist_ok=True)
+    for stale in glob.glob(os.path.join(path, CHUNKS_DIR, "*.parquet")) + glob.glob(os.path.join(path, LEGACY_CHUNKS_FILE)):
+        os.remove(stale)
+    chunks = chunk_frame(chunks)
+    part = _write_part(path, 0, pa.Table.from_pandas(chunks, schema=CHUNK_SCHEMA, preserve_index=False))
+    embeddings.tofile(os.path.join(path, EMBEDDING_FILES[dtype]))
+
+    manifest = {
+        "format_version": FORMAT_VERSION,
+        "dtype": dtype,
+        "dim": int(embeddings.shape[1]),
+        "count": int(embeddings.shape[0]),
+        "normalized": True,
+        "kb_version": kb_fingerprint(embeddings, chunks),
+        "parts": [part],
+        "next_part": 1,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    _write_manifest(path, manifest)
+    return VectorStore.open(path)
+
+
+def patch_vector_store(path: str, drop_mask, embeddings: np.ndarray, chunks: pd.DataFrame) -> VectorStore:
+    """
+    Drop the rows selected by `drop_mask` and append new rows, in place
+    (`drop_mask=None` only appends).
+
+    Kept vectors are compacted inside the existing file and new ones appended,
+    so nothing is re-embedded and only the changed rows are written. New chunk
+    rows go to a new Parquet part; only parts that lose rows are rewritten.
+    The manifest is flagged dirty for the duration; a store left dirty by a
+    crash refuses to open and must be rebuilt.
+    """
+    if not is_vector_store(path):
+        return write_vector_store(path, embeddings, chunks)
+    manifest = read_manifest(path)
+    if manifest["format_version"] < 2:
+        manifest = _upgrade_chunks(path, manifest)
+    dtype, dim, count = manifest["dtype"], manifest["dim"], manifest["count"]
+    keep = ~np.asarray(drop_mask, dtype=bool) if drop_mask is not None else np.ones(count, dtype=bool)
+    if len(keep) != count:
+        raise ValueError(f"drop_mask has {len(keep)} entries for {count} rows")
+    new_embeddings = normalize_rows(embeddings).astype(dtype, copy=False) if len(chunks) else np.empty((0, dim), dtype=dtype)
+    if len(new_embeddings) != len(chunks):
+        raise ValueError(f"Got {len(new_embeddings)} embeddings for {len(chunks)} chunks")
+    if len(chunks) and new_embeddings.shape[1] != dim:
+        raise ValueError(f"Got {new_embeddings.shape[1]}-dim embeddings for a {dim}-dim store")
+
+    _write_manifest(path, {**manifest, "dirty": True})
+
+    embeddings_path = os.path.join(path, EMBEDDING_FILES[dtype])
+    kept = int(keep.sum())
+    if kept < count:
+        matrix = np.memmap(embeddings_path, dtype=dtype, mode="r+", shape=(count, dim))
+        write_pos = 0
+        for start in range(0, count, 65536):
+            block = np.asarray(matrix[start:start + 65536][keep[start:start + 65536]])
+            matrix[write_pos:write_pos + len(block)] = block
+            write_pos += len(block)
+        matrix.flush()
+        del matrix
+        with open(embeddings_path, "r+b") as f:
+            f.truncate(kept * dim * np.dtype(dtype).itemsize)
+    with open(embeddings_path, "ab") as f:
+        f.write(new_embeddings.tobytes())
+
+    parts, obsolete, offset = [], [], 0
+    next_part = manifest.get("next_part", len(manifest["parts"]))
+    for part in manifest["parts"]:
+        part_keep = keep[offset:offset + part["rows"]]
+        offset += part["rows"]
+        if part_keep.all():
+            parts.append(part)
+            continue
+        obsolete.append(os.path.join(path, part["file"]))
+        if part_keep.any():
+            table = pq.read_table(os.path.join(path, part["file"])).filter(pa.array(part_keep))
+            parts.append(_write_part(path, next_part, table))
+            next_part += 1
+    new_chunks = chunk_frame(chunks)
+    if len(new_chunks):
+        parts.append(_write_part(path, next_part, pa.Table.from_pandas(new_chunks, schema=CHUNK_SCHEMA,
+                                                                       preserve_index=False)))
+        next_part += 1
+
+    patch_digest = hashlib.sha256(manifest["kb_version"].encode("utf-8"))
+    patch_digest.update(np.packbits(keep).tobytes())
+    patch_digest.update(kb_fingerprint(new_embeddings, new_chunks).encode("utf-8"))
+    manifest.update({
+        "format_version": FORMAT_VERSION,
+        "count": kept + len(new_embeddings),
+        "kb_version": patch_digest.hexdigest()[:16],
+        "parts": parts,
+        "next_part": next_part,
+        "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+    manifest.pop("dirty", None)
+    _write_manifest(path, manifest)
+    for stale in obsolete:
+        os.remove(stale)
+    return VectorStore.open(path)
+
+
+def export_parquet(store: VectorStore, path: str, block=ROW_GROUP_SIZE):
+    """
+    Write the whole KB as one portable Parquet file: the typed chunk columns
+    plus `embedding` as a fixed-size list of float32, one row group per
+    `block` rows, streamed so neither the vectors nor the text are held in full.
+    """
+    schema = CHUNK_SCHEMA.append(pa.field("embedding", pa.list_(pa.float32(), store.dim)))
+    with pq.ParquetWriter(path + ".tmp", schema) as writer:
+        for start in range(0, len(store), block):
+            rows = np.arange(start, min(start + block, len(store)))
+            columns = store.take(rows)
+            vectors = np.ascontiguousarray(store.matrix[start:start + len(rows)], dtype=np.float32)
+            table = pa.Table.from_pandas(pd.DataFrame(columns), schema=CHUNK_SCHEMA, preserve_index=False)
+            table = table.append_column("embedding", pa.FixedSizeListArray.from_arrays(vectors.reshape(-1), store.dim))
+            writer.write_table(table)
+    os.replace(path + ".tmp", path)
+
+
+def convert_parquet_to_store(parquet_path: str, store_path: str, dtype: str = "float32") -> VectorStore:
+    """Load a KB file written by `export_parquet` into a vector store."""
+    table = pq.read_table(parquet_path)
+    embedding = table.column("embedding").combine_chunks()
+    embeddings = embedding.flatten().to_numpy().reshape(len(table), embedding.type.list_size)
+    return write_vector_store(store_path, embeddings, table.drop_columns(["embedding"]).to_pandas(), dtype=dtype)
+
+
+def convert_csv_to_store(csv_path: str, store_path: str, dtype: str = "float32") -> VectorStore:
+    """Migrate a legacy vectorized_kb.csv (JSON-encoded embedding column) into a vector store."""
+    df = pd.read_csv(csv_path)
+    embeddings = np.array([json.loads(x) for x in df['embedding']], dtype=np.float32)
+    return write_vector_store(store_path, embeddings, df, dtype=dtype)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Convert a vectorized_kb.csv or .parquet into a memory-mapped vector "
+                                                 "store, or export a store as a single Parquet file")
+    parser.add_argument("--csv", default="/Users/pagrawal140/document-insights-prototype/output/vectorized_kb.csv")
+    parser.add_argument("--parquet", help="KB file written by --export, converted instead of --csv")
+    parser.add_argument("--out", default="/Users/pagrawal140/document-insights-prototype/output/vector_store")
+    parser.add_argument("--dtype", default="float32", choices=list(EMBEDDING_FILES))
+    parser.add_argument("--export", help="Write the store at --out to this Parquet file instead of converting")
+    args = parser.parse_args()
+
+    if args.export:
+        export_parquet(VectorStore.open(args.out), args.export)
+        print(f"Exported {args.out} to {args.export}")
+    else:
+        if args.parquet:
+            store = convert_parquet_to_store(args.parquet, args.out, dtype=args.dtype)
+        else:
+            store = convert_csv_to_store(args.csv, args.out, dtype=args.dtype)
+        print(f"Wrote {len(store)} vectors ({store.dim}-dim, {args.dtype}) to {args.out}")
@@ -0,0 +1,15 @@
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from src.metadata_index import parse_filter
+
+
+def test_parse_filter_combines_range_clauses():
+    assert parse_filter("page >= 5 and page <= 10") == {"page": [5, 10]}
+    assert parse_filter("page between 3 and 8 and page > 4") == {"page": [5, 8]}
+
+
+def test_parse_filter_intersects_value_clauses():
+    assert parse_filter("source in {a, b} and source = b") == {"source": ["b"]}
@@ -0,0 +1,37 @@
+import os
+import sys
+import json
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.retrieval import load_vectorized_kb
+from src.ann_index import build_index, load_index, benchmark
+
+# Recall@k, latency and memory of the ANN and quantized indexes against the exact
+# scan. Queries are perturbed KB vectors so the comparison runs without calling
+# the embedding API.
+
+kb = load_vectorized_kb("/Users/pagrawal140/document-insights-prototype/output/vector_store")
+rng = np.random.default_rng(0)
+sample = rng.choice(len(kb), size=min(200, len(kb)), replace=False)
+queries = np.asarray(kb.matrix[np.sort(sample)]) + 0.02 * rng.standard_normal((len(sample), kb.dim))
+
+indexes = [load_index(kb)] if load_index(kb) is not None else []
+indexes += [build_index(kb, "ivf", nprobe=nprobe) for nprobe in (1, 4, 16)]
+indexes += [build_index(kb, "hnsw", ef=ef) for ef in (16, 64)]
+# Quantized encodings, scored on codes alone (rerank=1) and with an exact re-rank of 4k candidates
+indexes += [build_index(kb, "sq8", rerank=rerank) for rerank in (1, 4)]
+indexes += [build_index(kb, "pq", rerank=rerank) for rerank in (1, 4)]
+
+results = []
+for index in indexes:
+    for k in (5, 10):
+        row = benchmark(kb, index, queries, k=k)
+        row["params"] = index._params()
+        results.append(row)
+        print(f"{row['kind']:5s} k={k:<3d} recall@k={row['recall_at_k']:.3f} "
+              f"exact={row['exact_ms_per_query']:.3f}ms index={row['index_ms_per_query']:.3f}ms "
+              f"memory={row['index_bytes'] / 2**20:.2f}MiB (exact {row['exact_bytes'] / 2**20:.2f}MiB) {row['params']}")
+
+with open("/Users/pagrawal140/document-insights-prototype/validation/ann_eval_results.json", "w") as f:
+    json.dump(results, f, indent=2)
@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import time
+import resource
+import tempfile
+import platform
+import subprocess
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from src.utils.fake_endpoint import FakeOpenAIServer
+
+# Offline benchmark of the retrieval paths, ingestion and chunking on synthetic
+# data. Embedding and LLM calls go to a local fake endpoint, so results depend
+# only on this code and this machine; each run writes one JSON file that can be
+# compared across commits.
+
+VOCABULARY_SIZE = 5000
+RESULTS_DIR = "/Users/pagrawal140/document-insights-prototype/validation/benchmark_results"
+
+
+def latency_summary(latencies_s: list) -> dict:
+    ms = np.asarray(latencies_s) * 1000
+    return {
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+        "mean_ms": float(ms.mean()),
+    }
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / 2**20 if platform.system() == "Darwin" else peak / 2**10
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+def synthetic_texts(n: int, rng, words_per_chunk=40) -> list:
+    """Zipf-distributed words from a fixed vocabulary, with an identifier in every tenth chunk."""
+    vocabulary = np.array([f"term{i}" for i in range(VOCABULARY_SIZE)])
+    ranks = np.minimum(rng.zipf(1.3, size=(n, words_per_chunk)), VOCABULARY_SIZE) - 1
+    texts = [" ".join(row) for row in vocabulary[ranks]]
+    for i in range(0, n, 10):
+        texts[i] += f" Form HUD-{10000 + i}"
+    return texts
+
+
+def synthetic_store(path: str, n: int, dim: int, n_clusters=64, seed=0):
+    """Write a vector store of `n` clustered unit vectors with synthetic chunk text and metadata."""
+    from src.vector_store import write_vector_store
+
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype(np.float32)
+    embeddings = np.empty((n, dim), dtype=np.float32)
+    for start in range(0, n, 65536):
+        stop = min(n, start + 65536)
+        embeddings[start:stop] = centers[rng.integers(0, n_clusters, stop - start)]
+        embeddings[start:stop] += 0.8 * rng.standard_normal((stop - start, dim)).astype(np.float32)
+    texts = synthetic_texts(n, rng)
+    ids = np.arange(n)
+    chunks = pd.DataFrame({"chunk_id": ids % 1000, "source": [f"doc_{i // 1000}" for i in ids],
+                           "topic": [f"Section {i % 37}" for i in ids], "page": (ids % 1000) // 10 + 1,
+                           "chunk_text": texts})
+    return write_vector_store(path, embeddings, chunks)
+
+
+def synthetic_queries(kb, n_queries: int, noise=0.3, seed=1):
+    """Perturbed corpus vectors, with query text taken from the same chunks (so BM25 has something to match)."""
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(kb), size=min(n_queries, len(kb)), replace=False))
+    vectors = np.asarray(kb.matrix[rows]) + noise * rng.standard_normal((len(rows), kb.dim)).astype(np.float32)
+    texts = [" ".join(kb.column("chunk_text")[row].split()[:6]) for row in rows]
+    return vectors, texts
+
+
+def recall(hits: list, exact: list) -> float:
+    return float(np.mean([len(set(h[0].tolist()) & set(e[0].tolist())) / max(1, len(e[0])) for h, e in zip(hits, exact)]))
+
+
+def bench_path(name, run, queries, q_texts, exact, batch_size=64):
+    """Per-query latency percentiles, batched QPS and recall@k against the exact hits."""
+    latencies = []
+    for i in range(len(queries)):
+        start = time.perf_counter()
+        run(queries[i:i + 1], q_texts[i:i + 1])
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    hits = []
+    for i in range(0, len(queries), batch_size):
+        hits.extend(run(queries[i:i + batch_size], q_texts[i:i + batch_size]))
+    elapsed = time.perf_counter() - start
+    return {"path": name, **latency_summary(latencies), "qps": len(queries) / elapsed,
+            "recall_at_k": recall(hits, exact) if exact is not None else 1.0}
+
+
+def bench_retrieval(n: int, dim: int, n_queries: int, k: int, workdir: str, hnsw_max=20000, pq_max=200000) -> list:
+    from src.vector_store import VectorStore
+    from src.retrieval import search, hybrid_search
+    from src.ann_index import build_index
+    from src.lexical_index import build_lexical_index
+
+    start = time.perf_counter()
+    kb = synthetic_store(os.path.join(workdir, f"store_{n}"), n, dim)
+    build_s = time.perf_counter() - start
+    kb = VectorStore.open(kb.path)
+    queries, q_texts = synthetic_queries(kb, n_queries)
+    exact = search(kb, queries, top_k=k)
+    base = {"corpus_size": n, "dim": dim, "k": k, "n_queries": len(queries)}
+    rows = [{**base, **bench_path("exact", lambda q, t: search(kb, q, top_k=k), queries, q_texts, None),
+             "build_s": build_s, "index_bytes": int(kb.matrix.nbytes)}]
+
+    kinds = [("ivf", {"nprobe": 8})]
+    if n <= hnsw_max:
+        kinds.append(("hnsw", {"ef": 64}))
+    kinds.append(("sq8", {"rerank": 4}))
+    if n <= pq_max:
+        kinds.append(("pq", {"rerank": 4}))
+    for kind, params in kinds:
+        start = time.perf_counter()
+        index = build_index(kb, kind, **params)
+        build_s = time.perf_counter() - start
+        row = bench_path(kind, lambda q, t: search(kb, q, top_k=k, index=index), queries, q_texts, exact)
+        rows.append({**base, **row, "params": params, "build_s": build_s, "index_bytes": index.memory_bytes()})
+
+    start = time.perf_counter()
+    lexical = build_lexical_index(kb)
+    build_s = time.perf_counter() - start
+    row = bench_path("hybrid", lambda q, t: hybrid_search(kb, t, q, lexical, top_k=k), queries, q_texts, exact)
+    lexical_bytes = lexical.indptr.nbytes + lexical.doc_ids.nbytes + lexical.tfs.nbytes + lexical.doc_len.nbytes
+    rows.append({**base, **row, "build_s": build_s, "index_bytes": int(lexical_bytes),
+                 "note": "recall is overlap with dense exact hits; fusion changes the ranking by design"})
+    for row in rows:
+        row["peak_rss_mb"] = peak_rss_mb()
+    return rows
+
+
+def synthetic_pdf(path: str, n_pages: int, scanned_every=10):
+    """PDF with a text layer on most pages and an image-only page every `scanned_every` pages (sent to OCR)."""
+    import fitz
+
+    rng = np.random.default_rng(2)
+    doc = fitz.open()
+    for page_no in range(n_pages):
+        page = doc.new_page()
+        if scanned_every and page_no % scanned_every == scanned_every - 1:
+            pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 600, 800), False)
+            pixmap.set_rect(pixmap.irect, (240, 240, 240))
+            page.insert_image(page.rect, pixmap=pixmap)
+            continue
+        page.insert_text((72, 72), f"Section {page_no + 1}: Policy", fontsize=16)
+        body = synthetic_texts(8, rng)
+        page.insert_textbox(fitz.Rect(72, 100, 540, 760), "\n\n".join(body), fontsize=10)
+    doc.save(path)
+    doc.close()
+
+
+def bench_ingestion(n_pages: int, workdir: str) -> dict:
+    from src.preprocessing import extract_text_from_pdf_pages
+
+    pdf_path = os.path.join(workdir, "synthetic.pdf")
+    synthetic_pdf(pdf_path, n_pages)
+    start = time.perf_counter()
+    extract_text_from_pdf_pages(pdf_path, os.path.join(workdir, "synthetic.json"), resume=False)
+    elapsed = time.perf_counter() - start
+    return {"stage": "ingestion", "pages": n_pages, "seconds": elapsed, "pages_per_s": n_pages / elapsed}
+
+
+def bench_embedding(n_texts: int) -> dict:
+    from src.utils.embedding_client import embed_texts
+
+    texts = synthetic_texts(n_texts, np.random.default_rng(3))
+    start = time.perf_counter()
+    embed_texts(texts)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    embed_texts(texts)
+    cached = time.perf_counter() - start
+    return {"stage": "embedding", "texts": n_texts, "texts_per_s": n_texts / elapsed,
+            "cached_texts_per_s": n_texts / cached}
+
+
+def bench_chunking(n_sections: int) -> dict:
+    from src.chunking import iter_chunks
+
+    texts = synthetic_texts(n_sections, np.random.default_rng(4), words_per_chunk=300)
+    df = pd.DataFrame({"Context": [t.replace(" term1 ", ". Term1 ") for t in texts],
+                       "Keyword": [f"Section {i}" for i in range(n_sections)],
+                       "Page_Number": [i // 3 + 1 for i in range(n_sections)]})
+    words = sum(len(t.split()) for t in texts)
+    try:
+        start = time.perf_counter()
+        n_chunks = sum(1 for _ in iter_chunks(df, "synthetic"))
+        elapsed = time.perf_counter() - start
+    except Exception as e:
+        # The tokenizer needs its encoding file; report instead of failing the whole run
+        return {"stage": "chunking", "sections": n_sections, "error": f"{type(e).__name__}: {e}"}
+    return {"stage": "chunking", "sections": n_sections, "chunks": n_chunks, "seconds": elapsed,
+            "sections_per_s": n_sections / elapsed, "words_per_s": words / elapsed}
+
+
+def main(sizes, dim, n_queries, k, pages, output_path):
+    results = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"platform": platform.platform(), "python": platform.python_version(), "cpus": os.cpu_count()},
+        "config": {"sizes": sizes, "dim": dim, "n_queries": n_queries, "k": k, "pages": pages},
+        "retrieval": [],
+        "pipeline": [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in sizes:
+            rows = bench_retrieval(n, dim, n_queries, k, workdir)
+            for row in rows:
+                print(f"n={n:<8d} {row['path']:6s} p50={row['p50_ms']:.2f}ms p95={row['p95_ms']:.2f}ms "
+                      f"p99={row['p99_ms']:.2f}ms qps={row['qps']:.0f} recall@{k}={row['recall_at_k']:.3f} "
+                      f"mem={row['index_bytes'] / 2**20:.1f}MiB")
+            results["retrieval"].extend(rows)
+        for row in (bench_ingestion(pages, workdir), bench_embedding(2000), bench_chunking(500)):
+            print(row)
+            results["pipeline"].append(row)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Benchmark results saved to {output_path}")
+
+
+def assert_offline(base_url: str):
+    """Fail before any call is made unless the chat and embedding clients point at the fake endpoint."""
+    from src.utils import llm_call
+    from src.utils.embedding_client import get_client
+    from src.utils.llm_backend import get_backend
+
+    targets = {"chat": llm_call.base, "embeddings": get_client().api_base}
+    wrong = {name: url for name, url in targets.items() if url != base_url}
+    if wrong or get_backend().mode != "live":
+        raise RuntimeError(f"Benchmark is not offline: {wrong or get_backend().mode} instead of {base_url}")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Offline retrieval and ingestion benchmark on synthetic data")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Comma separated corpus sizes, e.g. 1000,10000,100000,1000000 (1M rows at 384 dims peaks near 6 GB)")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir, FakeOpenAIServer(latency=0.005) as server:
+        # Point every client at the fake endpoint before any src module reads its settings
+        os.environ.update({
+            "OPENAI_API_BASE": server.base_url,
+            "OPENAI_API_KEY": "benchmark",
+            "MODEL": "fake-chat",
+            "EMBEDDING_CACHE_PATH": os.path.join(cache_dir, "embeddings.sqlite"),
+            "LLM_BACKEND": "live",
+        })
+        assert_offline(server.base_url)
+        output = args.out or os.path.join(RESULTS_DIR, f"benchmark_{git_commit() or 'local'}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+        main([int(n) for n in args.sizes.split(",")], args.dim, args.queries, args.k, args.pages, output)
@@ -1,13 +1,13 @@
 import json
 import os
 import sys
-import time
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from src.utils.llm_call import get_chat_completion
+from src.utils.llm_call import get_chat_completion, model_config
+from src.utils.batch_runner import run_batch
 
-def call_llm_judge(question, answer, context):
-    prompt = f"""
+def judge_prompt(question, answer, context):
+    return f"""
                 You are an expert evaluator for an AI question-answering system. Your task is to rate the answer on 4 criteria:
                 1. Accuracy: Is the answer factually correct according to the provided context?
                 2. Completeness: Does it fully answer the question, covering all major aspects?
@@ -36,15 +36,22 @@ def call_llm_judge(question, answer, context):
                 }}
             """.strip()
 
+def judge(question, answer, context):
+    """Score one answer. Raises on API or JSON errors so the batch runner can retry or record them."""
+    prompt = judge_prompt(question, answer, context)
+    response = get_chat_completion(
+        [
+            {"role": "system", "content": "You are an expert QA system evaluator."},
+            {"role": "user", "content": prompt}
+        ],
+        stage="judge"
+    )
+    output = response['choices'][0]['message']['content'].strip()
+    return json.loads(output)
+
+def call_llm_judge(question, answer, context):
     try:
-        response = get_chat_completion(
-            [
-                {"role": "system", "content": "You are an expert QA system evaluator."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        output = response['choices'][0]['message']['content'].strip()
-        return json.loads(output)
+        return judge(question, answer, context)
     except Exception as e:
         print("Error:", e)
         return {"error": str(e)}
@@ -55,28 +62,37 @@ def format_context_snippets(context_list):
         for c in context_list
     )
 
-def main():
+def evaluate_item(item):
+    q = item["question"]
+    a = item["answer"]
+    c = format_context_snippets(item.get("contexts", []))
+    return {
+        "question": q,
+        "answer": a,
+        "evaluation": judge(q, a, c)
+    }
+
+def judge_config():
+    """Model and prompt template behind `evaluate_item`, for keying its checkpoint."""
+    context = format_context_snippets([{"source": "{source}", "section": "{section}", "page": "{page}",
+                                        "context": "{context}"}])
+    return {**model_config(), "prompt": judge_prompt("{question}", "{answer}", context)}
+
+def main(max_workers=8, rate=None):
     input_path = "/Users/pagrawal140/document-insights-prototype/output/generated_answers.json"
     output_path = "/Users/pagrawal140/document-insights-prototype/validation/judge_llm_scores.json"
 
     with open(input_path, "r") as f:
         data = json.load(f)
 
-    results = []
-    for item in data:
-        q = item["question"]
-        a = item["answer"]
-        c = format_context_snippets(item.get("contexts", []))
-
-        print(f"Evaluating: {q[:60]}...")
-        eval_result = call_llm_judge(q, a, c)
-        results.append({
-            "question": q,
-            "answer": a,
-            "evaluation": eval_result
-        })
-
-        time.sleep(2)  # to avoid rate limits
+    # Rate limits are handled by the shared token bucket and retries instead of a fixed sleep per item
+    evaluations = run_batch(data, evaluate_item, f"{os.path.splitext(output_path)[0]}.jsonl",
+                            max_workers=max_workers, rate=rate, label="evaluations", stage="judge",
+                            config=judge_config())
+    results = [
+        result or {"question": item["question"], "answer": item["answer"], "evaluation": {"error": "evaluation failed"}}
+        for item, result in zip(data, evaluations)
+    ]
 
     with open(output_path, "w") as f:
         json.dump(results, f, indent=2)
@@ -84,4 +100,7 @@ def main():
     print(f"Done! Evaluation saved to: {output_path}")
 
 if __name__ == "__main__":
-    main()
+    main(
+        max_workers=int(os.getenv("JUDGE_WORKERS", 8)),
+        rate=float(os.getenv("JUDGE_RATE", 0)) or None
+    )
@@ -7,7 +7,8 @@ import matplotlib.pyplot as plt
 from sklearn.metrics.pairwise import cosine_similarity
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from src.utils.llm_call import get_embeddings
+from src.utils.embedding_client import embed_texts
+from src.retrieval import load_vectorized_kb
 
 questions = [
         "What is the procedure for financial approval outlined in the policies?",
@@ -17,11 +18,12 @@ questions = [
         "What internal controls are established for auditing and financial oversight?"
     ]
 
-for q in questions:
-    q_embedding = get_embeddings(q)['data'][0]['embedding']
-    kb_df = pd.read_csv("/Users/pagrawal140/document-insights-prototype/output/vectorized_kb.csv")
-    kb_df['embedding'] = kb_df['embedding'].apply(lambda x: np.array(json.loads(x)))
-    sims = cosine_similarity([q_embedding], list(kb_df['embedding'].values))[0]
+kb = load_vectorized_kb("/Users/pagrawal140/document-insights-prototype/output/vector_store")
+
+q_embeddings = embed_texts(questions)
+
+for q_embedding in q_embeddings:
+    sims = cosine_similarity([q_embedding], kb.embeddings)[0]
     plt.plot(sorted(sims, reverse=True))
     plt.title("Similarity score distribution")
     plt.xlabel("Chunk rank")